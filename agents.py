@@ -0,0 +1,136 @@
+"""
+Computer players. An agent chooses moves for whichever seat of a Match is
+current; see match.py for how moves are represented.
+"""
+
+import math
+import random
+import numpy as np
+from abc import ABC, abstractmethod
+from match import *
+
+_CASTLE = resource_index['C']
+_FENCE = resource_index['F']
+_WORKERS = [resource_index[worker] for worker, out in RESOURCE_GROWTH]
+_STOCKS = [resource_index[out] for worker, out in RESOURCE_GROWTH]
+
+
+class Agent(ABC):
+    """Base class of agents."""
+
+    def __init__(self, seed=None):
+        """
+        :param seed: Optional seed for the agent's random choices.
+        """
+        self.random = random.Random(seed)
+
+    @abstractmethod
+    def choose_move(self, match: Match):
+        """
+        :param match: Match; the agent plays the current seat.
+        :return: A legal move.
+        """
+        pass
+
+    def playable(self, match: Match) -> tuple:
+        """
+        :return: Indices of the cards the current player can play.
+        """
+        return PLAYABLE_SLOTS[match.playable_mask()]
+
+    def close(self) -> None:
+        """Release the agent's resources, e.g. worker processes."""
+        pass
+
+
+class RandomAgent(Agent):
+    """Plays a random playable card, or discards a random card."""
+
+    def choose_move(self, match: Match):
+        playable = self.playable(match)
+        if playable:
+            return self.random.choice(playable)
+        return [self.random.randrange(HAND_SIZE)]
+
+
+class GreedyAgent(Agent):
+    """
+    Plays the card that leads to the best evaluate() score, or discards
+    the most expensive card.
+    """
+
+    def choose_move(self, match: Match):
+        seat = match.current
+        hand = match.hands[seat]
+        playable = self.playable(match)
+        if not playable:
+            return [max(range(HAND_SIZE),
+                        key=lambda i: hand[i].cost_amount)]
+        scores = score_plays(match.dealer.registry, match.players[seat],
+                             match.players[1 - seat],
+                             [hand[i].id for i in playable])
+        best_score = -math.inf
+        best = None
+        for i, score in zip(playable, scores.tolist()):
+            # Break ties randomly
+            score += self.random.random() * 1e-3
+            if score > best_score:
+                best_score = score
+                best = i
+        return best
+
+
+def score_plays(registry: CardRegistry, player: Player, opponent: Player,
+                card_ids: List[int]) -> np.ndarray:
+    """
+    Score playing each of some cards with evaluate(), without playing them.
+    :param registry: Registry of the cards.
+    :param player: Player who would play the cards.
+    :param opponent: Their opponent.
+    :param card_ids: IDs of cards the player can afford.
+    :return: Array of the evaluate() score after each card.
+    """
+    mine, theirs = apply_effects(registry.effects[card_ids],
+                                 np.asarray(player.stocks),
+                                 np.asarray(opponent.stocks))
+    # Cards whose effect vectors aren't exact are played on copies
+    inexact = ~registry.exact_effects[card_ids]
+    for row in np.flatnonzero(inexact) if inexact.any() else ():
+        you = player.copy()
+        them = opponent.copy()
+        registry[card_ids[row]]._play(you, them)
+        mine[row] = you.stocks
+        theirs[row] = them.stocks
+    return evaluate_many(mine, theirs)
+
+
+def evaluate(player: Player, opponent: Player) -> float:
+    """
+    Heuristic value of a position.
+    :param player: Player to evaluate for.
+    :param opponent: Their opponent.
+    :return: Higher is better for player; infinite if someone has won.
+        card_effects.evaluate_many must give the same scores.
+    """
+    winner = won(player, opponent)
+    if winner is player:
+        return math.inf
+    elif winner is opponent:
+        return -math.inf
+
+    mine = player.stocks
+    theirs = opponent.stocks
+    score = (mine[_CASTLE] - theirs[_CASTLE]) + \
+        0.5 * (max(mine[_FENCE], 0) - max(theirs[_FENCE], 0))
+    for i in _WORKERS:
+        score += 4 * (mine[i] - theirs[i])
+    for i in _STOCKS:
+        score += 0.1 * (mine[i] - theirs[i])
+    return score
+
+
+# AGENTS[name] = agent class
+AGENTS = {
+    'random': RandomAgent,
+    'greedy': GreedyAgent,
+}
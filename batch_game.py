@@ -0,0 +1,294 @@
+"""
+Headless engine that plays many games at once.
+Every game's resources are kept in NumPy arrays, one row per game and one
+column per resource (in resource_order), and each turn is applied to the
+whole batch with masks.
+
+Player 0 is the player who goes first (the listener in main.py).
+"""
+
+from typing import Callable, List, Tuple
+import numpy as np
+from card_dealer import *
+from card_program import *
+from game import *
+
+NUM_RESOURCES = len(resource_order)
+_CASTLE = resource_index['C']
+_FENCE = resource_index['F']
+
+
+class BatchGame:
+    def __init__(self, dealer: CardDealer, num_games: int, seed=None):
+        """
+        Start a batch of games with starting resources and freshly dealt
+        hands.
+        :param dealer: Card dealer; its cards and weights are used for every
+            game.
+        :param num_games: Number of games.
+        :param seed: Optional seed: an integer or a numpy SeedSequence.
+        """
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        deal_seed, policy_seed = seed.spawn(2)
+        self.dealer = CardDealer(dealer.card_weights, deal_seed)
+        self.cards = self.dealer.cards
+        # Random generator for moves, e.g. random_moves()
+        self.rng = np.random.default_rng(policy_seed)
+        self.num_games = num_games
+        self._compile_cards()
+
+        # resources[p] is the (num_games, NUM_RESOURCES) array of player p
+        start = np.array([STARTING_RESOURCES[r] for r in resource_order],
+                         dtype=np.int32)
+        self.resources = np.tile(start, (2, num_games, 1))
+        # hands[p] is the (num_games, HAND_SIZE) array of card indices
+        self.hands = self.dealer.deal_many((2, num_games, HAND_SIZE))
+
+        # Number of turns played so far; player turn % 2 moves next
+        self.turn = 0
+        # Number of turns each game lasted
+        self.turns = np.zeros(num_games, dtype=np.int32)
+        # Index of the player who won each game, or -1 if it isn't over
+        self.winner = np.full(num_games, -1, dtype=np.int8)
+
+    def _compile_cards(self) -> None:
+        """
+        Flatten card costs and actions into arrays indexed by card. Action
+        arrays have one column per action slot; shorter cards are padded
+        with OP_NONE.
+        """
+        num_cards = len(self.cards)
+        num_slots = max(len(card.program) for card in self.cards)
+        self.cost_index = np.array([c.cost_index for c in self.cards],
+                                   dtype=np.intp)
+        self.cost_amount = np.array([c.cost_amount for c in self.cards],
+                                    dtype=np.int32)
+        self.action_op = np.zeros((num_cards, num_slots), dtype=np.int8)
+        self.action_resource = np.zeros((num_cards, num_slots), dtype=np.intp)
+        self.action_amount = np.zeros((num_cards, num_slots), dtype=np.int32)
+        self.action_target = np.zeros((num_cards, num_slots), dtype=np.intp)
+
+        for i, card in enumerate(self.cards):
+            for j, instruction in enumerate(card.program):
+                (self.action_op[i, j], self.action_resource[i, j],
+                 self.action_amount[i, j], self.action_target[i, j]) = \
+                    instruction
+
+    def set_state(self, stocks: List[List[int]], current: int,
+                  hands: List[List[int]] = (None, None)) -> None:
+        """
+        Put every game in the same position, e.g. to estimate it by playing
+        it out. Turn counts restart from 0.
+        :param stocks: Stocks of both players, in seat order.
+        :param current: Seat of the player to move; their resources have
+            already grown.
+        :param hands: Card indices of each seat's hand, or None to keep the
+            randomly dealt hands.
+        """
+        self.resources[:] = np.array(stocks, dtype=np.int32)[:, None]
+        for p, hand in enumerate(hands):
+            if hand is not None:
+                self.hands[p] = hand
+        self.turn = current
+        self.turns[:] = 0
+        self.winner[:] = won_batch(self.resources[0], self.resources[1])
+
+    @property
+    def current_player(self) -> int:
+        """Index of the player to move in every unfinished game."""
+        return self.turn % 2
+
+    @property
+    def active(self) -> np.ndarray:
+        """Boolean mask of games that aren't over."""
+        return self.winner < 0
+
+    def playable(self) -> np.ndarray:
+        """
+        :return: (num_games, HAND_SIZE) boolean array; True where the current
+            player can play that card of their hand.
+        """
+        p = self.current_player
+        hand = self.hands[p]
+        have = np.take_along_axis(self.resources[p], self.cost_index[hand],
+                                  axis=1)
+        return have >= self.cost_amount[hand]
+
+    def random_moves(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Pick a random move for every game: a random playable card, or a
+        single random discard if no card is playable.
+        :return: (play, discard) arguments for step().
+        """
+        playable = self.playable()
+        keys = self.rng.random(playable.shape)
+        any_playable = playable.any(axis=1)
+        play = np.where(playable, keys, -1.0).argmax(axis=1)
+        discard_i = keys.argmax(axis=1)
+        discard = np.zeros(playable.shape, dtype=bool)
+        discard[np.arange(self.num_games), discard_i] = True
+        discard[any_playable] = False
+        return np.where(any_playable, play, -1), discard
+
+    def greedy_moves(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Pick GreedyAgent's move for every game: the playable card after which
+        evaluate() scores best, or a discard of the most expensive card if no
+        card is playable. Every hand is scored at once with the registry's
+        effect vectors; for cards whose vectors aren't exact, the scores are
+        approximate.
+        :return: (play, discard) arguments for step().
+        """
+        p = self.current_player
+        hand = self.hands[p]
+        res = self.resources
+        playable = self.playable()
+        # Only unfinished games are scored
+        rows = np.nonzero(self.active)[0]
+        mine, theirs = apply_effects(self.dealer.registry.effects[hand[rows]],
+                                     res[p, rows, None], res[1 - p, rows, None])
+        scores = np.full(playable.shape, -np.inf)
+        # Break ties at random, like GreedyAgent
+        scores[rows] = evaluate_many(mine, theirs) + \
+            self.rng.random((len(rows), HAND_SIZE)) * 1e-3
+        scores[~playable] = -np.inf
+        play = scores.argmax(axis=1)
+        # Like GreedyAgent, discard rather than play a card that loses
+        any_playable = (scores > -np.inf).any(axis=1)
+
+        discard = np.zeros(playable.shape, dtype=bool)
+        discard_i = self.cost_amount[hand].argmax(axis=1)
+        discard[np.arange(self.num_games), discard_i] = True
+        discard[any_playable] = False
+        return np.where(any_playable, play, -1), discard
+
+    def step(self, play: np.ndarray, discard: np.ndarray = None) -> None:
+        """
+        Do one turn of every unfinished game, then grow the next player's
+        resources and check for winners.
+        :param play: (num_games,) integer array; the hand index of the card to
+            play, or -1 to discard instead.
+        :param discard: (num_games, HAND_SIZE) boolean array of cards to
+            discard, used where play is -1.
+        :raises: ValueError if a move of an unfinished game is illegal.
+        """
+        p = self.current_player
+        res = self.resources
+        active = self.active
+        play = np.asarray(play)
+
+        # Card turns
+        rows = np.nonzero(active & (play >= 0))[0]
+        slots = play[rows]
+        if np.any(slots >= HAND_SIZE):
+            raise ValueError('Card index out of bounds')
+        cards = self.hands[p, rows, slots]
+        cost_index = self.cost_index[cards]
+        cost_amount = self.cost_amount[cards]
+        if np.any(res[p, rows, cost_index] < cost_amount):
+            raise ValueError('Card can\'t be played')
+        res[p, rows, cost_index] -= cost_amount
+        self._do_actions(p, rows, cards)
+        self.hands[p, rows, slots] = self._deal(rows)
+
+        # Discard turns
+        discarding = active & (play < 0)
+        if np.any(discarding):
+            if discard is None:
+                raise ValueError('Discard mask required')
+            discard = np.asarray(discard) & discarding[:, None]
+            counts = discard.sum(axis=1)[discarding]
+            if np.any((counts < 1) | (counts > MAX_DISCARD)):
+                raise ValueError('Must discard 1 to {} cards'.format(
+                    MAX_DISCARD))
+            self.hands[p][discard] = self._deal(np.nonzero(discard)[0])
+
+        # Switch turns and grow the next player's resources
+        self.turns[active] += 1
+        self.turn += 1
+        p = self.current_player
+        for worker, out_resource in RESOURCE_GROWTH_INDEX:
+            res[p, active, out_resource] += res[p, active, worker]
+
+        winner = won_batch(res[0], res[1])
+        self.winner[active] = winner[active]
+
+    def _deal(self, rows: np.ndarray) -> np.ndarray:
+        """
+        :param rows: Game of each card to deal, in order.
+        :return: Card index of each dealt card.
+        """
+        return self.dealer.deal_many(len(rows))
+
+    def _do_actions(self, p: int, rows: np.ndarray, cards: np.ndarray) -> None:
+        """
+        Do the actions of the played cards, one action slot at a time so
+        each card's actions happen in order.
+        :param p: Index of the card player.
+        :param rows: Games in which a card was played.
+        :param cards: Card played in each of those games.
+        """
+        res = self.resources
+        o = 1 - p
+        for j in range(self.action_op.shape[1]):
+            op = self.action_op[cards, j]
+            resource = self.action_resource[cards, j]
+            amount = self.action_amount[cards, j]
+
+            m = op == OP_CHANGE
+            if np.any(m):
+                r, col = rows[m], resource[m]
+                target = np.where(self.action_target[cards[m], j] ==
+                                  TARGET_PLAYER, p, o)
+                res[target, r, col] = np.maximum(
+                    0, res[target, r, col] + amount[m])
+
+            m = op == OP_TRANSFER
+            if np.any(m):
+                r, col = rows[m], resource[m]
+                transfer = np.minimum(res[o, r, col], amount[m])
+                res[o, r, col] = np.maximum(0, res[o, r, col] - transfer)
+                res[p, r, col] = np.maximum(0, res[p, r, col] + transfer)
+
+            m = op == OP_ATTACK
+            if np.any(m):
+                r, a = rows[m], amount[m]
+                # Same as Player.attacked: the fence takes the whole attack,
+                # and the castle loses what the fence couldn't absorb
+                fence = res[o, r, _FENCE]
+                castle = res[o, r, _CASTLE]
+                res[o, r, _FENCE] = fence - a
+                res[o, r, _CASTLE] = np.where(
+                    fence >= a, castle, np.maximum(0, castle - (a - fence)))
+
+    def run(self, policy: Callable = None, max_turns: int = 10000) \
+            -> np.ndarray:
+        """
+        Play until every game is over.
+        :param policy: Function from this BatchGame to (play, discard)
+            arguments for step(). Defaults to random_moves.
+        :param max_turns: Stop after this many turns even if some games
+            aren't over.
+        :return: The winner array.
+        """
+        if policy is None:
+            policy = BatchGame.random_moves
+        while self.turn < max_turns and np.any(self.active):
+            self.step(*policy(self))
+        return self.winner
+
+
+def won_batch(resources1: np.ndarray, resources2: np.ndarray) -> np.ndarray:
+    """
+    Batch version of won().
+    :param resources1: (num_games, NUM_RESOURCES) resources of a player.
+    :param resources2: Resources of the other player.
+    :return: For each game, 0 if the first player has won, 1 if the second
+        player has won, else -1.
+    """
+    castle1 = resources1[:, _CASTLE]
+    castle2 = resources2[:, _CASTLE]
+    won1 = (castle1 >= CASTLE_WIN) | (castle2 <= 0)
+    won2 = (castle2 >= CASTLE_WIN) | (castle1 <= 0)
+    return np.where(won1, 0, np.where(won2, 1, -1)).astype(np.int8)
@@ -0,0 +1,22 @@
+"""
+Benchmarks of the game's hot paths. Run them with
+
+    python -m benchmarks [-k PATTERN] [--save FILE] [--compare FILE]
+
+from the repository root. Every benchmark is seeded, so runs do the same
+work. Results can be saved as a JSON baseline and compared with later
+runs; see benchmarks/__main__.py.
+"""
+
+# BENCHMARKS[name] = setup function. A setup function takes a seed and
+# returns (run, ops): run() does ops operations, and can be called
+# repeatedly.
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    """Decorator that registers a setup function under a name."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
@@ -0,0 +1,144 @@
+"""
+Run the benchmarks and report time per operation, operations per second
+and memory use: peak traced memory of a run, and memory blocks a run
+leaves allocated, per operation. The latter counts blocks that are kept
+(caches, growing tables, leaks), not every allocation; CPython has no
+allocation counter, and short-lived allocations show up in the peak
+instead.
+
+    python -m benchmarks [-k PATTERN] [--repeat N] [--seed SEED]
+                         [--save FILE] [--compare FILE] [--threshold T]
+
+--save writes the results as a JSON baseline; benchmarks/baseline.json is
+one for the current tree. --compare reads a baseline and exits with status
+1 if any benchmark got slower by more than the threshold (a fraction; 0.1
+is 10%). Timings depend on the machine, so compare with a baseline saved
+on the same one.
+"""
+
+import argparse
+import fnmatch
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from benchmarks import BENCHMARKS
+import benchmarks.micro
+import benchmarks.protocol
+import benchmarks.games
+
+# Version of the JSON baseline format
+BASELINE_VERSION = 1
+
+
+def measure(setup, seed: int, repeat: int) -> dict:
+    """
+    Run a benchmark.
+    :param setup: Setup function from BENCHMARKS.
+    :param seed: Seed.
+    :param repeat: Number of timed runs.
+    :return: Results.
+    """
+    run, ops = setup(seed)
+    # Warm up
+    run()
+
+    times = []
+    gc.collect()
+    gc.disable()
+    try:
+        for i in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    times.sort()
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        run()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    retained_blocks = sum(stat.count_diff
+                          for stat in after.compare_to(before, 'filename'))
+
+    return {
+        'ns_per_op': times[0] / ops * 1e9,
+        'median_ns_per_op': times[len(times) // 2] / ops * 1e9,
+        'ops_per_sec': ops / times[0],
+        'peak_kib': (peak_memory - start_memory) / 1024,
+        'retained_blocks_per_op': retained_blocks / ops,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    :param results: Results of this run.
+    :param baseline: Results of the baseline run.
+    :param threshold: Allowed slowdown, as a fraction.
+    :return: Names of the benchmarks that regressed.
+    """
+    regressed = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['ns_per_op'] / baseline[name]['ns_per_op']
+        flag = ''
+        if ratio > 1 + threshold:
+            regressed.append(name)
+            flag = '  REGRESSION'
+        print('{:28} {:+7.1%} vs baseline{}'.format(name, ratio - 1, flag))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks', description='Run benchmarks.')
+    parser.add_argument('-k', '--pattern', default='*',
+                        help='only run benchmarks matching this glob')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timed runs per benchmark (the best is used)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='FILE',
+                        help='write results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare with a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='allowed slowdown against the baseline')
+    args = parser.parse_args()
+
+    results = {}
+    print('{:28} {:>12} {:>12} {:>10} {:>11}'.format(
+        'Benchmark', 'ns/op', 'ops/s', 'peak KiB', 'retained/op'))
+    for name, setup in BENCHMARKS.items():
+        if not fnmatch.fnmatch(name, args.pattern):
+            continue
+        result = results[name] = measure(setup, args.seed, args.repeat)
+        print('{:28} {:12.0f} {:12.0f} {:10.1f} {:11.3f}'.format(
+            name, result['ns_per_op'], result['ops_per_sec'],
+            result['peak_kib'], result['retained_blocks_per_op']))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'version': BASELINE_VERSION, 'python': sys.version,
+                       'results': results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('version') != BASELINE_VERSION:
+            sys.exit('Unsupported baseline version')
+        print()
+        if compare(results, baseline['results'], args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
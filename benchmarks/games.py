@@ -0,0 +1,85 @@
+"""End-to-end simulated games, and storing their results."""
+
+import os
+import tempfile
+import numpy as np
+from benchmarks import benchmark
+from batch_game import *
+from tournament import *
+
+# Number of games per run
+GAMES = 50
+BATCH_GAMES = 2000
+RESULTS = 2000
+
+
+def _matches(seed: int, agent_classes):
+    dealer = read_cards('cards.txt', use_cache=False)
+    seeds = np.random.SeedSequence(seed)
+
+    def run():
+        dealer.seed(seeds)
+        agents = [agent_class(seed) for agent_class in agent_classes]
+        for i in range(GAMES):
+            play_match(agents, dealer)
+    return run, GAMES
+
+
+@benchmark('game.random')
+def game_random(seed: int):
+    return _matches(seed, [RandomAgent, RandomAgent])
+
+
+@benchmark('game.greedy')
+def game_greedy(seed: int):
+    return _matches(seed, [GreedyAgent, GreedyAgent])
+
+
+@benchmark('game.batch')
+def game_batch(seed: int):
+    dealer = read_cards('cards.txt', use_cache=False)
+
+    def run():
+        BatchGame(dealer, BATCH_GAMES, seed).run()
+    return run, BATCH_GAMES
+
+
+@benchmark('game.batch_greedy')
+def game_batch_greedy(seed: int):
+    dealer = read_cards('cards.txt', use_cache=False)
+
+    def run():
+        BatchGame(dealer, BATCH_GAMES, seed).run(BatchGame.greedy_moves)
+    return run, BATCH_GAMES
+
+
+def _store_results(seed: int, batch_size: int):
+    dealer = read_cards('cards.txt', use_cache=False)
+    dealer.seed(seed)
+    agents = [RandomAgent(seed), RandomAgent(seed + 1)]
+    matches = []
+    for i in range(16):
+        match = Match(dealer)
+        while match.winner() is None:
+            match.do_move(agents[match.current].choose_move(match))
+        matches.append(match)
+    directory = tempfile.TemporaryDirectory()
+    store = ResultStore(os.path.join(directory.name, 'results.db'),
+                        batch_size)
+
+    # The directory is deleted once run() is gone
+    def run(directory=directory):
+        for i in range(RESULTS):
+            store.add_match(matches[i % len(matches)], ['a', 'b'], 0.0)
+        store.flush()
+    return run, RESULTS
+
+
+@benchmark('results.add')
+def results_add(seed: int):
+    return _store_results(seed, RESULTS_BATCH_SIZE)
+
+
+@benchmark('results.add_unbatched')
+def results_add_unbatched(seed: int):
+    return _store_results(seed, 1)
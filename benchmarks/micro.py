@@ -0,0 +1,103 @@
+"""Microbenchmarks of card play, dealing, attacks and card lookups."""
+
+import random
+from benchmarks import benchmark
+from card_dealer import *
+
+# Number of operations per run
+OPS = 10000
+
+# Stocks are large enough that repeated runs never run out
+_RICH = {r: 10 ** 8 for r in resource_order}
+
+
+@benchmark('card.play')
+def card_play(seed: int):
+    dealer = read_cards('cards.txt', use_cache=False)
+    rng = random.Random(seed)
+    cards = [rng.choice(dealer.cards) for i in range(OPS)]
+    you = Player(_RICH)
+    opponent = Player(_RICH)
+
+    def run():
+        for card in cards:
+            card.play(you, opponent, True)
+    return run, OPS
+
+
+@benchmark('dealer.deal')
+def dealer_deal(seed: int):
+    dealer = read_cards('cards.txt', use_cache=False)
+    dealer.seed(seed)
+    deal = dealer.deal
+
+    def run():
+        for i in range(OPS):
+            deal()
+    return run, OPS
+
+
+@benchmark('dealer.deal_many')
+def dealer_deal_many(seed: int):
+    dealer = read_cards('cards.txt', use_cache=False)
+    dealer.seed(seed)
+
+    def run():
+        dealer.deal_many(OPS)
+    return run, OPS
+
+
+@benchmark('player.attacked')
+def player_attacked(seed: int):
+    rng = random.Random(seed)
+    amounts = [rng.randint(1, 32) for i in range(OPS)]
+    player = Player(_RICH)
+
+    def run():
+        for amount in amounts:
+            player.attacked(amount)
+    return run, OPS
+
+
+def _large_registry(rng: random.Random, num_cards: int) -> CardRegistry:
+    """
+    :return: Registry of num_cards copies of cards from cards.txt, with
+        random costs.
+    """
+    dealer = read_cards('cards.txt', use_cache=False)
+    card_weights = {}
+    for i in range(num_cards):
+        card = rng.choice(dealer.cards)
+        card_weights[Card('{} {}'.format(card.name, i), card.cost_resource,
+                          rng.randint(1, 50), card.actions)] = 1
+    return CardRegistry(card_weights)
+
+
+def _random_stocks(rng: random.Random):
+    return [[rng.randint(0, 50) for r in resource_order] for i in range(OPS)]
+
+
+@benchmark('registry.num_affordable')
+def registry_num_affordable(seed: int):
+    rng = random.Random(seed)
+    registry = _large_registry(rng, 5000)
+    stocks = _random_stocks(rng)
+
+    def run():
+        for s in stocks:
+            registry.num_affordable(s)
+    return run, OPS
+
+
+@benchmark('registry.scan_affordable')
+def registry_scan_affordable(seed: int):
+    """The linear scan that num_affordable replaces, for comparison."""
+    rng = random.Random(seed)
+    registry = _large_registry(rng, 5000)
+    players = [Player.from_stocks(s)
+               for s in _random_stocks(rng)[:OPS // 100]]
+
+    def run():
+        for player in players:
+            sum(card.can_be_played(player) for card in registry.cards)
+    return run, OPS // 100
@@ -0,0 +1,136 @@
+"""
+Loopback socket benchmarks of myprotocol. Local transports are echoed by a
+separate process, as between two bots on one machine.
+"""
+
+import multiprocessing
+import os
+import random
+import socket
+import tempfile
+import time
+import threading
+import myprotocol
+import transport
+from benchmarks import benchmark
+
+# Number of messages per run
+MESSAGES = 2000
+
+# Size of a turn message
+TURN_SIZE = 8
+
+
+def _loopback_pair():
+    """
+    :return: Two connected TCP sockets over the loopback interface.
+    """
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    client = socket.create_connection(server.getsockname())
+    conn, address = server.accept()
+    server.close()
+    return client, conn
+
+
+def _local_pair(address: str):
+    """
+    Start an echo process that connects to an address.
+    :return: The connection it made, made by the transport module.
+    """
+    def echo():
+        while True:
+            try:
+                sock = transport.connect(address)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                time.sleep(0.001)
+        _echo(sock)
+    process = multiprocessing.get_context('fork').Process(target=echo,
+                                                          daemon=True)
+    process.start()
+    return transport.accept_one(address)[0]
+
+
+def _echo(sock: socket.socket) -> None:
+    """Echo every message received on sock until the connection closes."""
+    connection = myprotocol.FramedConnection(sock)
+    try:
+        while True:
+            for payload in connection.recv_messages():
+                connection.queue_message(payload)
+            connection.flush()
+    except (RuntimeError, OSError):
+        sock.close()
+
+
+def _start_echo(sock: socket.socket) -> None:
+    """Echo every message received on sock in a thread."""
+    threading.Thread(target=_echo, args=(sock,), daemon=True).start()
+
+
+def _payloads(seed: int, size: int):
+    rng = random.Random(seed)
+    return [bytes(rng.getrandbits(8) for i in range(size))
+            for j in range(16)]
+
+
+def _latency(seed: int, client):
+    """Round trips of turn-sized messages, one at a time."""
+    payloads = _payloads(seed, TURN_SIZE)
+
+    def run():
+        for i in range(MESSAGES):
+            myprotocol.send_message(client, payloads[i % len(payloads)])
+            myprotocol.recv_message(client)
+    return run, MESSAGES
+
+
+@benchmark('protocol.latency')
+def protocol_latency(seed: int):
+    client, server = _loopback_pair()
+    _start_echo(server)
+    return _latency(seed, client)
+
+
+@benchmark('protocol.latency.unix')
+def protocol_latency_unix(seed: int):
+    path = os.path.join(tempfile.mkdtemp(), 'castlewars')
+    return _latency(seed, _local_pair(transport.UNIX_PREFIX + path))
+
+
+@benchmark('protocol.latency.shm')
+def protocol_latency_shm(seed: int):
+    name = 'castlewars-bench-{}'.format(os.getpid())
+    return _latency(seed, _local_pair(transport.SHM_PREFIX + name))
+
+
+def _throughput(seed: int, size: int):
+    """Messages sent back to back, then all echoes received."""
+    client, server = _loopback_pair()
+    _start_echo(server)
+    payloads = _payloads(seed, size)
+    connection = myprotocol.FramedConnection(client)
+
+    def run():
+        received = 0
+        for i in range(MESSAGES):
+            connection.queue_message(payloads[i % len(payloads)])
+            if i % 64 == 63:
+                connection.flush()
+                received += len(connection.recv_messages())
+        connection.flush()
+        while received < MESSAGES:
+            received += len(connection.recv_messages())
+    return run, MESSAGES
+
+
+@benchmark('protocol.throughput.turn')
+def protocol_throughput_turn(seed: int):
+    return _throughput(seed, TURN_SIZE)
+
+
+@benchmark('protocol.throughput.4k')
+def protocol_throughput_4k(seed: int):
+    return _throughput(seed, 4096)
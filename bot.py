@@ -0,0 +1,243 @@
+"""
+Headless play by an external bot process, over its stdin and stdout.
+
+Messages are JSON objects, one per line. The engine first sends what the
+bot needs to decode states:
+    {"resources": ["B", ...], "cards": ["name", ...], "moves": [0, ...,
+     [0, 1], ...]}
+cards is indexed by card ID and moves by move code; see moves.MOVES. Then
+the engine runs many games at once and sends the decisions pending in all
+of them as one batch:
+    {"decisions": [{"game": 3, "seat": 0, "turn": 12, "you": [...],
+                    "opponent": [...], "hand": [card ID, ...],
+                    "legal": [move code, ...]}, ...]}
+you and opponent are stocks in resources order. The bot answers every
+batch with one move code per decision, in the same order:
+    {"moves": [5, 12, ...]}
+so a bot that batches its inference sees many states per round trip.
+
+    python bot.py [-n GAMES] [-b BATCH] [--opponent AGENT] [--seed SEED]
+        COMMAND...
+
+The bot plays each seat in half the games, against AGENT (default greedy)
+or, with --opponent self, against itself.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from typing import Dict, TextIO
+from tournament import *
+
+# Games run at once, and so the most decisions per batch
+DEFAULT_BATCH_SIZE = 64
+
+
+class BotError(RuntimeError):
+    """Exception for a bot that breaks the protocol."""
+    pass
+
+
+class BotConnection:
+    """Line-delimited JSON connection to a bot."""
+
+    def __init__(self, reader: TextIO, writer: TextIO,
+                 registry: CardRegistry, process: subprocess.Popen = None):
+        """
+        Send the hello message.
+        :param reader: Stream of the bot's answers.
+        :param writer: Stream to the bot.
+        :param registry: Registry of the cards in play.
+        :param process: Bot process, if it was started by spawn().
+        """
+        self.reader = reader
+        self.writer = writer
+        self.process = process
+        self._send({'resources': resource_order,
+                    'cards': [card.name for card in registry.cards],
+                    'moves': MOVES})
+
+    @classmethod
+    def spawn(cls, command: List[str], registry: CardRegistry) \
+            -> 'BotConnection':
+        """
+        Start a bot process and connect to its stdin and stdout. Its stderr
+        is left alone.
+        :param command: Command line of the bot.
+        :param registry: Registry of the cards in play.
+        """
+        process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, text=True,
+                                   bufsize=1)
+        return cls(process.stdout, process.stdin, registry, process)
+
+    def decide(self, decisions: List[Dict]) -> List[int]:
+        """
+        Send a batch of decisions and wait for the bot's moves.
+        :param decisions: Decisions, as in the module docstring.
+        :return: Move code of each decision. Each is one of its legal
+            moves.
+        :raises: BotError if the bot's answer is missing or malformed, or a
+            move is illegal.
+        """
+        self._send({'decisions': decisions})
+        line = self.reader.readline()
+        if not line:
+            raise BotError('Bot closed its output')
+        try:
+            moves = json.loads(line)['moves']
+        except (ValueError, TypeError, KeyError):
+            raise BotError('Bad answer: {!r}'.format(line[:80]))
+        if not isinstance(moves, list) or len(moves) != len(decisions):
+            raise BotError('Expected {} moves'.format(len(decisions)))
+        for decision, code in zip(decisions, moves):
+            if type(code) is not int or code not in decision['legal']:
+                raise BotError('Illegal move {!r} in game {}'.format(
+                    code, decision['game']))
+        return moves
+
+    def close(self) -> None:
+        """Close the bot's input and wait for a spawned bot to exit."""
+        try:
+            self.writer.close()
+        except OSError:
+            # It already closed its input, and what we buffered is lost
+            pass
+        if self.process is not None:
+            self.process.wait()
+
+    def _send(self, message: Dict) -> None:
+        """:raises: BotError if the bot closed its input."""
+        try:
+            self.writer.write(json.dumps(message, separators=(',', ':')))
+            self.writer.write('\n')
+            self.writer.flush()
+        except OSError:
+            raise BotError('Bot closed its input')
+
+
+class _BotGame:
+    """A match of a batch, and which of its seats the bot plays."""
+    __slots__ = ('id', 'match', 'agents')
+
+    def __init__(self, game_id: int, match: Match, agents: List[Agent]):
+        """
+        :param agents: Agent of each seat; None for the bot.
+        """
+        self.id = game_id
+        self.match = match
+        self.agents = agents
+
+    def decision(self) -> Dict:
+        """:return: The decision the bot has to make in this game."""
+        match = self.match
+        seat = match.current
+        return {'game': self.id, 'seat': seat, 'turn': match.num_turns,
+                'you': match.players[seat].stocks.tolist(),
+                'opponent': match.players[1 - seat].stocks.tolist(),
+                'hand': [card.id for card in match.hands[seat]],
+                'legal': match.legal_moves()}
+
+
+def play_games(bot: BotConnection, dealer: CardDealer, num_games: int,
+               opponent: Agent = None, batch_size: int = DEFAULT_BATCH_SIZE,
+               max_turns: int = MAX_TURNS) -> MatchupStats:
+    """
+    Play games between a bot and an agent, up to batch_size at once. The
+    agent moves right away; the bot's decisions in all running games are
+    sent as one batch.
+    :param bot: Bot connection.
+    :param dealer: Card dealer; every game gets a dealer spawned from it.
+    :param num_games: Number of games. The bot has seat i % 2 in game i.
+    :param opponent: The bot's opponent, or None for the bot itself.
+    :param batch_size: Number of games run at once.
+    :param max_turns: A game is a draw after this many turns.
+    :return: Statistics of the games, from the bot's perspective; against
+        itself, from seat 0's.
+    """
+    stats = MatchupStats()
+    running = []
+    next_game = 0
+    while running or next_game < num_games:
+        # Start games until the batch is full
+        while len(running) < batch_size and next_game < num_games:
+            agents = [None, opponent] if next_game % 2 == 0 \
+                else [opponent, None]
+            running.append(_BotGame(next_game, Match(dealer.spawn(1)[0]),
+                                    agents))
+            next_game += 1
+
+        # Let the agent move until the bot has to, and end finished games
+        waiting = []
+        for game in running:
+            match = game.match
+            winner = match.winner()
+            while winner is None and match.num_turns < max_turns and \
+                    game.agents[match.current] is not None:
+                match.do_move(game.agents[match.current].choose_move(match))
+                winner = match.winner()
+            if winner is None and match.num_turns < max_turns:
+                waiting.append(game)
+                continue
+            if winner is not None and opponent is not None:
+                winner = 0 if game.agents[winner] is None else 1
+            stats.add_game(winner, match.num_turns)
+        running = waiting
+        if not running:
+            continue
+
+        moves = bot.decide([game.decision() for game in running])
+        for game, code in zip(running, moves):
+            game.match.do_move(MOVES[code])
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Play a bot process against an agent.')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+                        help='command line of the bot')
+    parser.add_argument('-n', '--games', type=int, default=100)
+    parser.add_argument('-b', '--batch', type=int,
+                        default=DEFAULT_BATCH_SIZE,
+                        help='games run at once')
+    parser.add_argument('--opponent', default='greedy',
+                        choices=sorted(AGENTS) + ['self'])
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--cards', default='cards.txt',
+                        help='card definition file')
+    args = parser.parse_args()
+    if not args.command:
+        parser.error('need a bot command')
+
+    dealer = read_cards(args.cards)
+    dealer.seed(args.seed)
+    opponent = None
+    if args.opponent != 'self':
+        opponent = AGENTS[args.opponent](args.seed)
+    try:
+        bot = BotConnection.spawn(args.command, dealer.registry)
+    except BotError as e:
+        print('Bot error: {}'.format(e), file=sys.stderr)
+        exit(1)
+    try:
+        stats = play_games(bot, dealer, args.games, opponent, args.batch)
+    except BotError as e:
+        print('Bot error: {}'.format(e), file=sys.stderr)
+        exit(1)
+    finally:
+        bot.close()
+        if opponent is not None:
+            opponent.close()
+
+    rate, low, high = stats.win_rate()
+    mean, stdev = stats.turns()
+    print('bot vs {}: {} wins, {} losses, {} draws'.format(
+        args.opponent, stats.wins[0], stats.wins[1], stats.draws))
+    print('    win rate {:.1%} (95% CI {:.1%}-{:.1%}); '
+          '{:.1f} turns (sd {:.1f})'.format(rate, low, high, mean, stdev))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Fan-out of match snapshots to spectators.
+
+A match publishes each snapshot once: it is encoded and framed once, and
+the same bytes object is queued on every watcher. Each watcher has its own
+task and a small bounded queue. Snapshots are complete, so a watcher that
+falls behind skips to the latest one instead of buffering, and slow
+spectators never hold up the match or each other.
+"""
+
+import asyncio
+import collections
+import metrics
+import myprotocol
+
+# Frames a watcher may have queued before older ones are dropped
+WATCHER_QUEUE_SIZE = 4
+
+# Bytes the transport buffers for a watcher before its task waits; small,
+# so a slow spectator backs up into its queue, where frames are dropped
+WATCHER_WRITE_BUFFER = 4096
+
+_WATCHERS = metrics.counter('castlewars_server_watchers_total',
+                            'Spectators that started watching a match.')
+_FRAMES_DROPPED = metrics.counter(
+    'castlewars_server_frames_dropped_total',
+    'Snapshots skipped because a spectator fell behind.')
+
+
+class Watcher:
+    """A spectator's connection, with its queue of frames to send."""
+
+    def __init__(self, writer: asyncio.StreamWriter,
+                 queue_size: int = WATCHER_QUEUE_SIZE):
+        """
+        :param writer: Stream to the spectator.
+        :param queue_size: Frames that may be queued before older ones are
+            dropped.
+        """
+        self.writer = writer
+        writer.transport.set_write_buffer_limits(WATCHER_WRITE_BUFFER)
+        self.queue_size = queue_size
+        self.queue = collections.deque()
+        # Set when there are frames to send, or when closed
+        self.ready = asyncio.Event()
+        self.is_closed = False
+        if metrics.enabled:
+            _WATCHERS.inc()
+
+    def push(self, frame: bytes) -> None:
+        """
+        Queue a frame, dropping the queued ones if the queue is full.
+        :param frame: Framed message; shared with the other watchers.
+        """
+        if self.is_closed:
+            return
+        if len(self.queue) >= self.queue_size:
+            if metrics.enabled:
+                _FRAMES_DROPPED.inc(len(self.queue))
+            self.queue.clear()
+        self.queue.append(frame)
+        self.ready.set()
+
+    def close(self) -> None:
+        """Stop once the queued frames are sent."""
+        self.is_closed = True
+        self.ready.set()
+
+    async def run(self) -> None:
+        """
+        Send queued frames until closed, or until the spectator leaves.
+        """
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                while self.queue:
+                    self.writer.write(self.queue.popleft())
+                    await self.writer.drain()
+                if self.is_closed:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.is_closed = True
+            self.writer.close()
+
+
+class Broadcast:
+    """The spectators of one match."""
+
+    def __init__(self, match_id: int):
+        """
+        :param match_id: Match ID.
+        """
+        self.match_id = match_id
+        self.watchers = set()
+        # Last published frame, for spectators who join late
+        self.latest = None
+
+    def add(self, watcher: Watcher) -> None:
+        """Start sending frames to a watcher, beginning with the latest."""
+        self.watchers.add(watcher)
+        if self.latest is not None:
+            watcher.push(self.latest)
+
+    def publish(self, payload: bytes) -> None:
+        """
+        Send a message to every watcher. It is framed once, and every
+        watcher queues the same frame.
+        :param payload: Message.
+        """
+        frame = myprotocol.frame_message(payload)
+        self.latest = frame
+        closed = []
+        for watcher in self.watchers:
+            if watcher.is_closed:
+                closed.append(watcher)
+            else:
+                watcher.push(frame)
+        self.watchers.difference_update(closed)
+
+    def close(self) -> None:
+        """Close every watcher once it has sent its queued frames."""
+        for watcher in self.watchers:
+            watcher.close()
+        self.watchers.clear()
@@ -1,8 +1,13 @@
 from typing import List
+import metrics
 from card_action import *
+from card_program import *
 from player import *
 from resource import *
 
+_CARDS_PLAYED = metrics.counter('castlewars_cards_played_total',
+                                'Cards played, by anyone.')
+
 
 class Card:
     def __init__(self, name: str, cost_resource: str, cost_amount: int,
@@ -17,17 +22,24 @@ class Card:
         """
         self.name = name
         self.cost_resource = cost_resource
+        self.cost_index = resource_index[cost_resource]
         self.cost_amount = cost_amount
         assert len(actions) >= 1
         self.actions = actions
+        self.program = compile_actions(actions)
         self.description = description
+        # Assigned by CardRegistry
+        self.id = None
+        # Formatted by cost_string and action_string on first use
+        self._cost_string = None
+        self._action_string = None
 
     def can_be_played(self, player: Player) -> bool:
         """
         :param player: A player.
         :return: True if that player can play this card.
         """
-        return player.resources[self.cost_resource] >= self.cost_amount
+        return player.stocks[self.cost_index] >= self.cost_amount
 
     def play(self, you: Player, opponent: Player, is_by_you: bool) -> bool:
         """
@@ -38,6 +50,8 @@ class Card:
         :return: True if the card was successfully played; False if the card
             is not playable.
         """
+        if metrics.enabled:
+            _CARDS_PLAYED.inc()
         if is_by_you:
             return self._play(you, opponent)
         else:
@@ -51,30 +65,35 @@ class Card:
         :return: True if the card was successfully played; False if the card
             is not playable.
         """
+        stocks = player.stocks
         # Can't afford
-        if not self.can_be_played(player):
+        if stocks[self.cost_index] < self.cost_amount:
             return False
 
-        player.lose_resource(self.cost_resource, self.cost_amount)
-        for action in self.actions:
-            action.do(player, opponent)
+        stocks[self.cost_index] -= self.cost_amount
+        run_program(self.program, stocks, opponent.stocks)
         return True
 
     def cost_string(self) -> str:
         """
         :return: String representing card resource cost and amount.
         """
-        return '{} {}'.format(self.cost_amount,
-                              resource_long[self.cost_resource])
+        if self._cost_string is None:
+            self._cost_string = '{} {}'.format(
+                self.cost_amount, resource_long[self.cost_resource])
+        return self._cost_string
 
     def action_string(self) -> str:
         """
         :return: Card description if it had one; else use the card actions to
             generate a description.
         """
-        if self.description:
-            return self.description
-        return ', '.join(map(str, self.actions))
+        if self._action_string is None:
+            if self.description:
+                self._action_string = self.description
+            else:
+                self._action_string = ', '.join(map(str, self.actions))
+        return self._action_string
 
     def __str__(self) -> str:
         """
@@ -30,15 +30,16 @@ class ResourceChange(CardAction):
             (False if the change is applied to the opponent.)
         """
         self.resource = resource
+        self.index = resource_index[resource]
         self.amount = amount
         self.is_for_player = is_for_player
 
     def do(self, player, opponent):
         """Do the resource change."""
         if self.is_for_player:
-            player.change_resource(self.resource, self.amount)
+            player.change_stock(self.index, self.amount)
         else:
-            opponent.change_resource(self.resource, self.amount)
+            opponent.change_stock(self.index, self.amount)
 
     def __str__(self):
         if self.is_for_player:
@@ -56,15 +57,16 @@ class ResourceTransfer(CardAction):
         :param amount: Positive integer amount; transfer at most this amount.
         """
         self.resource = resource
+        self.index = resource_index[resource]
         assert amount >= 1
         self.amount = amount
 
     def do(self, player, opponent):
         """Transfer the resource."""
-        transfer_amount = min(opponent.resources[self.resource], self.amount)
+        transfer_amount = min(opponent.stocks[self.index], self.amount)
         # Move 'transfer_amount' stocks from opponent to player
-        opponent.lose_resource(self.resource, transfer_amount)
-        player.change_resource(self.resource, transfer_amount)
+        opponent.lose_stock(self.index, transfer_amount)
+        player.change_stock(self.index, transfer_amount)
 
     def __str__(self):
         return 'transfer {} {}'.format(
@@ -0,0 +1,167 @@
+"""
+Compiled cache of a parsed card definition file, so that processes can load
+a card set without parsing it.
+
+The cache is a binary file next to the card file. It starts with
+    magic (4 bytes) | format version (2 bytes) | SHA-256 of the card file
+    (32 bytes) | number of cards (4 bytes)
+followed by each card, in card file order (so card IDs stay the same):
+    weight (4 bytes) | cost resource index (1 byte) | cost amount (4 bytes)
+    | number of instructions (1 byte) | name length (2 bytes)
+    | description length (2 bytes; 0xffff for none, so descriptions are
+      shorter than that)
+    | instructions: opcode, resource index (1 byte each), amount (4 bytes),
+      target (1 byte) | name (UTF-8) | description (UTF-8)
+All integers are big-endian. A cache whose version or digest doesn't match
+is ignored.
+"""
+
+import mmap
+import os
+import struct
+from typing import Dict
+from card import *
+
+# Version of the cache format; bump when it changes
+CACHE_VERSION = 1
+
+CACHE_MAGIC = b'CWCC'
+
+_HEADER = struct.Struct('>4sH32sI')
+_CARD = struct.Struct('>IBiBHH')
+_INSTRUCTION = struct.Struct('>BBiB')
+_NO_DESCRIPTION = 0xffff
+
+
+def cache_filename(filename: str) -> str:
+    """
+    :param filename: Card definition file.
+    :return: Name of its cache file.
+    """
+    return filename + '.cache'
+
+
+def write_card_cache(filename: str, digest: bytes,
+                     card_weights: Dict[Card, int]) -> None:
+    """
+    Write a cache file. Failing to write it (e.g. in a read-only directory)
+    is not an error, and card sets the format can't hold (e.g. a name of 64
+    KiB or more) are not cached.
+    :param filename: Cache file.
+    :param digest: SHA-256 digest of the card file.
+    :param card_weights: Cards parsed from the card file, with weights.
+    """
+    try:
+        data = _encode_cache(digest, card_weights)
+    except struct.error:
+        return
+
+    # Write to a temporary file and rename it, so readers never see a
+    # partial cache
+    temp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        with open(temp_filename, 'wb') as f:
+            f.write(data)
+        os.replace(temp_filename, filename)
+    except OSError:
+        try:
+            os.remove(temp_filename)
+        except OSError:
+            pass
+
+
+def _encode_cache(digest: bytes, card_weights: Dict[Card, int]) -> bytes:
+    """
+    :return: Contents of a cache file; see write_card_cache.
+    :raises: struct.error if a card doesn't fit the format.
+    """
+    parts = [_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, digest,
+                          len(card_weights))]
+    for card, weight in card_weights.items():
+        name = card.name.encode()
+        description = b''
+        description_length = _NO_DESCRIPTION
+        if card.description is not None:
+            description = card.description.encode()
+            description_length = len(description)
+            # The longest length would read back as no description
+            if description_length >= _NO_DESCRIPTION:
+                raise struct.error('Description too long')
+        parts.append(_CARD.pack(weight, card.cost_index, card.cost_amount,
+                                len(card.program), len(name),
+                                description_length))
+        for instruction in card.program:
+            parts.append(_INSTRUCTION.pack(*instruction))
+        parts.append(name)
+        parts.append(description)
+    return b''.join(parts)
+
+
+def load_card_cache(filename: str, digest: bytes):
+    """
+    Load a cache file.
+    :param filename: Cache file.
+    :param digest: SHA-256 digest of the card file.
+    :return: Dictionary from cards to their weights, in card file order, or
+        None if there is no usable cache for that digest.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return _parse_cache(data, digest)
+    except (OSError, ValueError, IndexError, struct.error,
+            UnicodeDecodeError):
+        # Missing, empty or corrupt
+        return None
+
+
+def _parse_cache(data, digest: bytes):
+    """
+    :param data: Contents of a cache file.
+    :param digest: SHA-256 digest of the card file.
+    :return: See load_card_cache.
+    """
+    magic, version, cache_digest, num_cards = _HEADER.unpack_from(data)
+    if magic != CACHE_MAGIC or version != CACHE_VERSION or \
+            cache_digest != digest:
+        return None
+
+    card_weights = {}
+    offset = _HEADER.size
+    for i in range(num_cards):
+        weight, cost_index, cost_amount, num_instructions, name_length, \
+            description_length = _CARD.unpack_from(data, offset)
+        offset += _CARD.size
+
+        actions = []
+        for j in range(num_instructions):
+            op, index, amount, target = _INSTRUCTION.unpack_from(data, offset)
+            offset += _INSTRUCTION.size
+            actions.append(_action(op, index, amount, target))
+
+        name = data[offset:offset + name_length].decode()
+        offset += name_length
+        description = None
+        if description_length != _NO_DESCRIPTION:
+            description = data[offset:offset + description_length].decode()
+            offset += description_length
+
+        card_weights[Card(name, resource_order[cost_index], cost_amount,
+                          actions, description)] = weight
+    if offset != len(data):
+        raise ValueError('Trailing data in card cache')
+    return card_weights
+
+
+def _action(op: int, index: int, amount: int, target: int) -> CardAction:
+    """
+    :return: The card action that compiles to the given instruction.
+    """
+    if op == OP_ATTACK:
+        return Attack(amount)
+    elif op == OP_TRANSFER:
+        return ResourceTransfer(resource_order[index], amount)
+    elif op == OP_CHANGE:
+        return ResourceChange(resource_order[index], amount,
+                              target == TARGET_PLAYER)
+    raise ValueError('Bad opcode {}'.format(op))
@@ -1,29 +1,116 @@
 from typing import List, Dict
 from card import *
-import random
+from card_registry import *
+from card_cache import *
+import copy
+import hashlib
+import operator
+import numpy as np
+
+# Number of card indices deal() draws from the generator at a time
+_DEAL_BUFFER_SIZE = 256
 
 
 class CardDealer:
-    def __init__(self, card_weights: Dict[Card, int]):
+    def __init__(self, card_weights: Dict[Card, int], seed=None):
         """
         Create a card dealer.
         :param card_weights: card_weights[card] is the relative integer weight
             of that card. card_weights.keys() is the set of all cards.
+        :param seed: Optional seed: an integer or a numpy SeedSequence. Use
+            spawn() (or SeedSequence.spawn) to get dealers with independent
+            random streams, e.g. one per game or worker process.
         """
         self.card_weights = card_weights
         self.total_weight = sum(card_weights.values())
+        self.registry = CardRegistry(card_weights)
+        # cards[i] is the card with index (and ID) i
+        self.cards = self.registry.cards
+        self._alias_prob, self._alias = _alias_table(
+            list(card_weights.values()))
+        self.seed(seed)
+
+    def seed(self, seed=None) -> None:
+        """
+        Restart the dealer's random stream.
+        :param seed: An integer, a numpy SeedSequence, or None for fresh
+            entropy.
+        """
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.rng = np.random.Generator(np.random.PCG64(seed))
+        self._buffer = iter(())
+        # Generator state just before the buffer was filled, so the buffer
+        # can be recreated by set_state
+        self._buffer_state = self.rng.bit_generator.state
+
+    def get_state(self) -> tuple:
+        """
+        :return: (generator state, generator state before the deal()
+            buffer was filled, number of cards left in the buffer): enough
+            to continue dealing the same cards, e.g. in another process. The
+            generator states are PCG64 state dictionaries.
+        """
+        return (self.rng.bit_generator.state, self._buffer_state,
+                operator.length_hint(self._buffer))
+
+    def set_state(self, state: tuple) -> None:
+        """
+        Continue dealing from a state returned by get_state() of a dealer
+        with the same cards.
+        :param state: Dealer state.
+        """
+        rng_state, buffer_state, buffered = state
+        self.rng.bit_generator.state = buffer_state
+        buffer = self.deal_many(_DEAL_BUFFER_SIZE).tolist()
+        self._buffer = iter(buffer[len(buffer) - buffered:])
+        self._buffer_state = buffer_state
+        self.rng.bit_generator.state = rng_state
+
+    def spawn(self, num_dealers: int) -> List['CardDealer']:
+        """
+        :param num_dealers: Number of dealers.
+        :return: Dealers with the same cards, each with a random stream that
+            doesn't overlap with this dealer's or each other's.
+        """
+        dealers = []
+        for seed in self.seed_sequence.spawn(num_dealers):
+            dealer = copy.copy(self)
+            dealer.seed(seed)
+            dealers.append(dealer)
+        return dealers
+
+    def deal_many(self, size) -> np.ndarray:
+        """
+        Deal card indices in bulk.
+        :param size: Number of cards, or a tuple for the shape of the result.
+        :return: Array of indices into self.cards from weighted random draws.
+        """
+        # Alias method: pick a column uniformly, then keep it or take its
+        # alias. Integer thresholds make the weights exact.
+        column = self.rng.integers(len(self.cards), size=size)
+        keep = self.rng.integers(self.total_weight, size=size) < \
+            self._alias_prob[column]
+        return np.where(keep, column, self._alias[column])
+
+    def deal_index(self) -> int:
+        """
+        :return: Index into self.cards of a card from a weighted random draw.
+        """
+        index = next(self._buffer, None)
+        if index is None:
+            self._buffer_state = self.rng.bit_generator.state
+            self._buffer = iter(self.deal_many(_DEAL_BUFFER_SIZE).tolist())
+            index = next(self._buffer)
+        return index
 
     def deal(self) -> Card:
         """
         Deal a card.
         :return: A card from a weighted random draw.
         """
-        rand = random.randrange(self.total_weight)
-        for card, weight in self.card_weights.items():
-            rand -= weight
-            if rand < 0:
-                return card
-        assert False, 'Didn\'t draw a card at end of deal()'
+        return self.cards[self.deal_index()]
 
     def deal_list(self, num_cards: int) -> List[Card]:
         """
@@ -34,55 +121,139 @@ class CardDealer:
         return [self.deal() for i in range(num_cards)]
 
 
-def read_cards(filename: str) -> CardDealer:
+def _alias_table(weights: List[int]):
     """
-    Read card definitions from a file.
+    Build a Walker/Vose alias table for integer weights.
+    :param weights: Positive integer weights.
+    :return: (prob, alias) arrays. Column i is kept if a uniform draw from
+        range(sum(weights)) is below prob[i]; otherwise alias[i] is taken.
+    """
+    n = len(weights)
+    total = sum(weights)
+    # Compare weight * n with total, so that an average column is exactly
+    # full and everything stays an integer
+    scaled = [weight * n for weight in weights]
+    prob = [total] * n
+    alias = list(range(n))
+    small = [i for i in range(n) if scaled[i] < total]
+    large = [i for i in range(n) if scaled[i] >= total]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        # Column s is topped up with column l's weight
+        scaled[l] -= total - scaled[s]
+        if scaled[l] < total:
+            small.append(l)
+        else:
+            large.append(l)
+    return np.array(prob, dtype=np.int64), np.array(alias, dtype=np.intp)
+
+
+def read_cards(filename: str, use_cache: bool = True) -> CardDealer:
+    """
+    Read card definitions from a file. The parsed cards are also saved to a
+    compiled cache file next to it (see card_cache), which is loaded instead
+    of parsing the file again until the file changes.
     :param filename: File to read from.
+    :param use_cache: False to always parse the file and not write a cache.
     :return: Card dealer.
     """
+    with open(filename, 'rb') as f:
+        source = f.read()
+    digest = hashlib.sha256(source).digest()
+
+    card_weights = None
+    if use_cache:
+        card_weights = load_card_cache(cache_filename(filename), digest)
+    if card_weights is None:
+        card_weights = parse_cards(source.decode())
+        if use_cache:
+            write_card_cache(cache_filename(filename), digest, card_weights)
+    return CardDealer(card_weights)
+
+
+def parse_cards(text: str) -> Dict[Card, int]:
+    """
+    Parse card definitions.
+    :param text: Contents of a card definition file.
+    :return: Dictionary from cards to their weights, in file order.
+    """
     card_weights = {}
+    lines = text.splitlines()
+    i = 0
 
-    with open(filename) as f:
-        for line in f:
-            line = line.strip()
-            # Ignore blank lines and comments
-            if line == '' or line.startswith('#'):
-                continue
-
-            # Assume it's card data. Read and strip next 4 lines.
-            name = line.title()
-            weight = int(next(f).strip())
-            cost_line = next(f).strip()
-            actions_line = next(f).strip()
-
-            # Parse cost and actions
-            cost_resource = cost_line[0]
-            cost_amount = int(cost_line[1:])
-            actions = []
-            # Split actions_line by whitespace
-            for action_str in actions_line.split():
-                if action_str[:2] == 'at':
-                    actions.append(Attack(int(action_str[2:])))
-                elif action_str[0] == 't':
-                    actions.append(ResourceTransfer(
-                        action_str[1], int(action_str[2:])))
-                elif action_str[0] == 'o':
-                    # Resource change for opponent
-                    actions.append(ResourceChange(
-                        action_str[1], int(action_str[2:]), False))
-                else:
-                    # Resource change for player
-                    actions.append(ResourceChange(
-                        action_str[0], int(action_str[1:]), True))
-
-            description = None
-            # Read further lines for @-decorated terms
-            while f.read(1) == '@':
-                line_split = next(f).strip().split(maxsplit=1)
-                if line_split[0] == 'description':
-                    description = line_split[1]
-
-            card_weights[Card(name, cost_resource, cost_amount, actions,
-                              description)] = weight
+    while i < len(lines):
+        line = lines[i].strip()
+        i += 1
+        # Ignore blank lines and comments
+        if line == '' or line.startswith('#'):
+            continue
 
-    return CardDealer(card_weights)
+        # Assume it's card data. Read and strip next 3 lines.
+        name = line.title()
+        weight = int(lines[i].strip())
+        cost_line = lines[i + 1].strip()
+        actions_line = lines[i + 2].strip()
+        i += 3
+
+        # Parse cost and actions
+        cost_resource = cost_line[0]
+        cost_amount = int(cost_line[1:])
+        actions = []
+        # Split actions_line by whitespace
+        for action_str in actions_line.split():
+            if action_str[:2] == 'at':
+                actions.append(Attack(int(action_str[2:])))
+            elif action_str[0] == 't':
+                actions.append(ResourceTransfer(
+                    action_str[1], int(action_str[2:])))
+            elif action_str[0] == 'o':
+                # Resource change for opponent
+                actions.append(ResourceChange(
+                    action_str[1], int(action_str[2:]), False))
+            else:
+                # Resource change for player
+                actions.append(ResourceChange(
+                    action_str[0], int(action_str[1:]), True))
+
+        description = None
+        # Read further lines for @-decorated terms
+        while i < len(lines) and lines[i].startswith('@'):
+            line_split = lines[i][1:].strip().split(maxsplit=1)
+            i += 1
+            if line_split[0] == 'description':
+                description = line_split[1]
+
+        card_weights[Card(name, cost_resource, cost_amount, actions,
+                          description)] = weight
+
+    return card_weights
+
+
+def replace_weights(text: str, weights: List[int]) -> str:
+    """
+    Change the weights in card definitions, keeping everything else.
+    :param text: Contents of a card definition file.
+    :param weights: New weight of each card, in file order.
+    :return: The card definitions with the new weights.
+    """
+    lines = text.splitlines(keepends=True)
+    weights = iter(weights)
+    i = 0
+
+    while i < len(lines):
+        line = lines[i].strip()
+        i += 1
+        if line == '' or line.startswith('#'):
+            continue
+
+        # Name line; the weight is on the next line
+        ending = lines[i][len(lines[i].rstrip('\r\n')):]
+        lines[i] = '{}{}'.format(next(weights), ending)
+        i += 3
+        while i < len(lines) and lines[i].startswith('@'):
+            i += 1
+
+    return ''.join(lines)
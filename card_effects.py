@@ -0,0 +1,146 @@
+"""
+Card effects as fixed-width vectors, so many cards can be tried against a
+state with a few NumPy operations instead of copying players and playing
+each card.
+
+An effect vector has these columns, R = len(resource_order) each except
+the attack:
+    EFFECT_COST      amount paid, in the cost resource's column
+    EFFECT_SELF      change of each of the player's resources
+    EFFECT_OPPONENT  change of each of the opponent's resources
+    EFFECT_ATTACK    attack amount (one column)
+    EFFECT_TRANSFER  most of each resource taken from the opponent
+A vector is exact if its card touches each resource of each side with at
+most one action, and attacks at most once without also changing the
+opponent's fence or castle: then the order of its actions doesn't matter,
+and apply_effects has the same result as Card.play. evaluate_many scores
+the resulting states.
+"""
+
+from typing import List, Tuple
+import math
+import numpy as np
+from card import *
+from game import *
+
+_R = len(resource_order)
+
+EFFECT_COST = slice(0, _R)
+EFFECT_SELF = slice(_R, 2 * _R)
+EFFECT_OPPONENT = slice(2 * _R, 3 * _R)
+EFFECT_ATTACK = 3 * _R
+EFFECT_TRANSFER = slice(3 * _R + 1, 4 * _R + 1)
+EFFECT_WIDTH = 4 * _R + 1
+
+_CASTLE = resource_index['C']
+_FENCE = resource_index['F']
+_WORKERS = [resource_index[worker] for worker, out in RESOURCE_GROWTH]
+_STOCKS = [resource_index[out] for worker, out in RESOURCE_GROWTH]
+# Weight of each resource's difference in evaluate_many, except the fence's
+_SCORE_WEIGHTS = np.zeros(len(resource_order))
+_SCORE_WEIGHTS[_CASTLE] = 1
+_SCORE_WEIGHTS[_WORKERS] = 4
+_SCORE_WEIGHTS[_STOCKS] = 0.1
+
+
+def effect_vector(card: Card) -> Tuple[List[int], bool]:
+    """
+    :param card: A card.
+    :return: (effect vector, whether it is exact).
+    """
+    vector = [0] * EFFECT_WIDTH
+    vector[EFFECT_COST.start + card.cost_index] = card.cost_amount
+    # (side, resource index) pairs that actions touch; side 0 is the player
+    touched = []
+    num_attacks = 0
+    for op, index, amount, target in card.program:
+        if op == OP_CHANGE:
+            side = EFFECT_SELF if target == TARGET_PLAYER else EFFECT_OPPONENT
+            vector[side.start + index] += amount
+            touched.append((target, index))
+        elif op == OP_TRANSFER:
+            vector[EFFECT_TRANSFER.start + index] += amount
+            touched.append((TARGET_PLAYER, index))
+            touched.append((TARGET_OPPONENT, index))
+        elif op == OP_ATTACK:
+            vector[EFFECT_ATTACK] += amount
+            num_attacks += 1
+    is_exact = len(touched) == len(set(touched)) and num_attacks <= 1
+    if num_attacks and ((TARGET_OPPONENT, _FENCE) in touched or
+                        (TARGET_OPPONENT, _CASTLE) in touched):
+        is_exact = False
+    return vector, is_exact
+
+
+def effect_matrix(cards: List[Card]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param cards: Cards.
+    :return: (effects, exact): (len(cards), EFFECT_WIDTH) array of effect
+        vectors, and boolean array of whether each is exact.
+    """
+    vectors = [effect_vector(card) for card in cards]
+    effects = np.array([v for v, is_exact in vectors], dtype=np.int64)
+    effects = effects.reshape(len(cards), EFFECT_WIDTH)
+    exact = np.array([is_exact for v, is_exact in vectors], dtype=bool)
+    return effects, exact
+
+
+def apply_effects(effects: np.ndarray, player_stocks: np.ndarray,
+                  opponent_stocks: np.ndarray) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Play each of some cards against a state, without changing it. The
+    cards are assumed to be affordable.
+    :param effects: (..., EFFECT_WIDTH) array of effect vectors.
+    :param player_stocks: (..., R) array of the stocks of the player who
+        plays the cards; broadcast against the effects, e.g. (R,) for one
+        state or (n, 1, R) for n states with a hand each.
+    :param opponent_stocks: Stocks of their opponent, of the same shape.
+    :return: (player stocks, opponent stocks): arrays of the stocks after
+        each card, of the broadcast shape. Same as Card.play for exact
+        effect vectors.
+    """
+    mine = player_stocks.astype(np.int64) - effects[..., EFFECT_COST]
+    theirs = np.empty_like(mine)
+    theirs[...] = opponent_stocks
+
+    caps = effects[..., EFFECT_TRANSFER]
+    transfer = np.minimum(np.maximum(theirs, 0), caps)
+    theirs -= transfer
+    mine = np.where(caps != 0, np.maximum(mine + transfer, 0), mine)
+
+    delta = effects[..., EFFECT_SELF]
+    mine = np.where(delta != 0, np.maximum(mine + delta, 0), mine)
+    delta = effects[..., EFFECT_OPPONENT]
+    theirs = np.where(delta != 0, np.maximum(theirs + delta, 0), theirs)
+
+    # Same as Player.attacked
+    attack = effects[..., EFFECT_ATTACK]
+    fence = theirs[..., _FENCE].copy()
+    theirs[..., _FENCE] = fence - attack
+    hit = (attack > 0) & (fence < attack)
+    theirs[..., _CASTLE] = np.where(
+        hit, np.maximum(theirs[..., _CASTLE] - (attack - fence), 0),
+        theirs[..., _CASTLE])
+    return mine, theirs
+
+
+def evaluate_many(mine: np.ndarray, theirs: np.ndarray) -> np.ndarray:
+    """
+    Same as agents.evaluate, for many positions at once.
+    :param mine: (..., R) array of the stocks of the player to evaluate for.
+    :param theirs: Array of their opponent's stocks, of the same shape.
+    :return: (...) array of scores.
+    """
+    # Weighted sum of the differences, plus the fence term, whose negative
+    # values don't count
+    score = (mine - theirs) @ _SCORE_WEIGHTS + \
+        0.5 * (np.maximum(mine[..., _FENCE], 0) -
+               np.maximum(theirs[..., _FENCE], 0))
+
+    # Same order of checks as won()
+    my_castle = mine[..., _CASTLE]
+    their_castle = theirs[..., _CASTLE]
+    i_won = (my_castle >= CASTLE_WIN) | (their_castle <= 0)
+    they_won = (their_castle >= CASTLE_WIN) | (my_castle <= 0)
+    return np.where(i_won, math.inf, np.where(they_won, -math.inf, score))
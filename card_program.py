@@ -0,0 +1,74 @@
+"""
+Card actions compiled into flat programs.
+A program is a tuple of (opcode, resource index, amount, target)
+instructions, executed by run_program directly on stock arrays. It has the
+same effect as doing the card actions it was compiled from, in order.
+"""
+
+from typing import List, Tuple
+from card_action import *
+
+# Opcodes
+OP_NONE = 0  # No action; only used as padding
+OP_CHANGE = 1  # ResourceChange
+OP_TRANSFER = 2  # ResourceTransfer
+OP_ATTACK = 3  # Attack
+
+# Targets
+TARGET_PLAYER = 0
+TARGET_OPPONENT = 1
+
+_CASTLE = resource_index['C']
+_FENCE = resource_index['F']
+
+
+def compile_actions(actions: List[CardAction]) -> Tuple:
+    """
+    Compile card actions into a program.
+    :param actions: List of card actions.
+    :return: Tuple of (opcode, resource index, amount, target) instructions.
+        Resource index and target are 0 when the opcode doesn't use them.
+    """
+    program = []
+    for action in actions:
+        if isinstance(action, Attack):
+            program.append((OP_ATTACK, 0, action.amount, TARGET_OPPONENT))
+        elif isinstance(action, ResourceTransfer):
+            program.append((OP_TRANSFER, action.index, action.amount,
+                            TARGET_PLAYER))
+        elif isinstance(action, ResourceChange):
+            target = TARGET_PLAYER if action.is_for_player \
+                else TARGET_OPPONENT
+            program.append((OP_CHANGE, action.index, action.amount, target))
+        else:
+            raise TypeError('Can\'t compile {}'.format(type(action).__name__))
+    return tuple(program)
+
+
+def run_program(program: Tuple, player, opponent) -> None:
+    """
+    Run a program, from the perspective of the card player.
+    :param program: Program from compile_actions.
+    :param player: Stock array of the player who played the card.
+    :param opponent: Stock array of their opponent.
+    """
+    sides = (player, opponent)
+    for op, index, amount, target in program:
+        if op == OP_CHANGE:
+            stocks = sides[target]
+            value = stocks[index] + amount
+            stocks[index] = value if value > 0 else 0
+        elif op == OP_ATTACK:
+            # Same as Player.attacked
+            fence = opponent[_FENCE]
+            opponent[_FENCE] = fence - amount
+            if fence < amount:
+                value = opponent[_CASTLE] - (amount - fence)
+                opponent[_CASTLE] = value if value > 0 else 0
+        elif op == OP_TRANSFER:
+            have = opponent[index]
+            transfer = have if have < amount else amount
+            assert transfer >= 0
+            opponent[index] = have - transfer
+            value = player[index] + transfer
+            player[index] = value if value > 0 else 0
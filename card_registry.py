@@ -0,0 +1,116 @@
+"""
+Registry of a card set. Gives every card a stable integer ID (its position
+in the card file) and a digest of the whole set, so peers can check that
+they loaded the same cards. It also holds the effect vectors of all cards,
+indexed by ID; see card_effects.
+
+For finding the cards a player can afford without checking each one, the
+registry also lists the card IDs grouped by cost resource, each group
+sorted by cost amount: the affordable cards of a group are a prefix of
+it, found by bisecting.
+"""
+
+from typing import Dict, List, Tuple
+import bisect
+import hashlib
+from card import *
+from card_effects import *
+
+
+class CardRegistry:
+    def __init__(self, card_weights: Dict[Card, int]):
+        """
+        Register cards, assigning IDs in iteration order.
+        :param card_weights: card_weights[card] is the relative integer weight
+            of that card.
+        """
+        # cards[card_id] is the card with that ID
+        self.cards = list(card_weights)
+        # weights[card_id] is the weight of that card
+        self.weights = list(card_weights.values())
+        for card_id, card in enumerate(self.cards):
+            card.id = card_id
+        # effects[card_id] = effect vector of that card; exact_effects[card_id]
+        # = whether it is exact
+        self.effects, self.exact_effects = effect_matrix(self.cards)
+        self._index_costs()
+        self.digest = self._digest()
+
+    def _index_costs(self) -> None:
+        """
+        List card IDs by cost resource, then cost amount.
+        """
+        # by_cost = card IDs sorted by cost resource index, then cost amount,
+        # then ID
+        self.by_cost = sorted(range(len(self.cards)), key=lambda i: (
+            self.cards[i].cost_index, self.cards[i].cost_amount, i))
+        # The cards of cost resource r are by_cost[_group_starts[r]:
+        # _group_starts[r + 1]], and _group_costs[r] are their cost amounts
+        self._group_starts = []
+        self._group_costs = []
+        start = 0
+        for r in range(len(resource_order)):
+            self._group_starts.append(start)
+            costs = []
+            while start < len(self.by_cost) and \
+                    self.cards[self.by_cost[start]].cost_index == r:
+                costs.append(self.cards[self.by_cost[start]].cost_amount)
+                start += 1
+            self._group_costs.append(costs)
+        self._group_starts.append(start)
+
+    def affordable_ranges(self, stocks) -> List[Tuple[int, int]]:
+        """
+        :param stocks: Stocks of a player, in resource_order.
+        :return: (start, stop) ranges of by_cost, one per cost resource; the
+            cards in them are the ones the player can afford.
+        """
+        return [(start, start + bisect.bisect_right(costs, stock))
+                for start, costs, stock in zip(self._group_starts,
+                                               self._group_costs, stocks)]
+
+    def affordable_ids(self, stocks) -> List[int]:
+        """
+        :param stocks: Stocks of a player, in resource_order.
+        :return: IDs of the cards the player can afford, in by_cost order.
+        """
+        ids = []
+        for start, stop in self.affordable_ranges(stocks):
+            ids += self.by_cost[start:stop]
+        return ids
+
+    def num_affordable(self, stocks) -> int:
+        """
+        :param stocks: Stocks of a player, in resource_order.
+        :return: Number of cards the player can afford.
+        """
+        return sum(bisect.bisect_right(costs, stock)
+                   for costs, stock in zip(self._group_costs, stocks))
+
+    def _digest(self) -> bytes:
+        """
+        :return: SHA-256 digest of everything that defines the card set: each
+            card's ID, weight, name, cost, actions and description.
+        """
+        h = hashlib.sha256()
+        for card, weight in zip(self.cards, self.weights):
+            h.update(repr((card.id, weight, card.name, card.cost_resource,
+                           card.cost_amount, card.program,
+                           card.description)).encode())
+        return h.digest()
+
+    def __getitem__(self, card_id: int) -> Card:
+        """
+        :param card_id: Card ID.
+        :return: The card with that ID.
+        :raises: IndexError if there is no such card.
+        """
+        if card_id < 0:
+            raise IndexError('Bad card ID {}'.format(card_id))
+        return self.cards[card_id]
+
+    def __len__(self) -> int:
+        """
+        :return: Number of cards.
+        """
+        return len(self.cards)
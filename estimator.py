@@ -0,0 +1,137 @@
+"""
+Background estimate of who is winning, from random playouts.
+
+A worker process plays the current position out many times with random
+moves, using BatchGame, and reports the share of playouts won and the mean
+number of turns they lasted after every batch. It runs in its own, lower
+priority process so it never competes with the game loop for the GIL or
+the CPU. Every new position
+cancels the playouts of the last one; the opponent's hand is unknown, so
+each playout deals them a random one.
+
+    estimator = WinEstimator()
+    estimator.update(players, seat, hand, current)
+    ...
+    estimate = estimator.poll()
+"""
+
+import multiprocessing
+import os
+from batch_game import *
+
+# Playouts per batch; a new position is noticed between batches
+ESTIMATE_BATCH = 256
+
+# Playouts of a position after which the worker waits for the next one
+MAX_PLAYOUTS = 16384
+
+# Playouts that last this many turns are draws, counted as half a win
+MAX_PLAYOUT_TURNS = 1000
+
+
+class Estimate:
+    """Playout results of a position, from one player's perspective."""
+
+    def __init__(self, win_rate: float, turns: float, playouts: int,
+                 is_current: bool = True):
+        """
+        :param win_rate: Share of playouts the player won, counting draws as
+            half a win.
+        :param turns: Mean number of turns the playouts lasted.
+        :param playouts: Number of playouts.
+        :param is_current: False if the position has changed since.
+        """
+        self.win_rate = win_rate
+        self.turns = turns
+        self.playouts = playouts
+        self.is_current = is_current
+
+
+class WinEstimator:
+    """Handle of the worker process."""
+
+    def __init__(self, card_file: str = 'cards.txt', seed=None):
+        """
+        Start the worker.
+        :param card_file: Card definition file. It must define the same
+            cards as the game's dealer.
+        :param seed: Optional seed of the playouts.
+        """
+        self._conn, worker_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_estimate_positions, args=(worker_conn, card_file, seed),
+            daemon=True)
+        self._process.start()
+        worker_conn.close()
+        # Number of the last position sent
+        self._position = 0
+        self.estimate = None
+
+    def update(self, players: List[Player], seat: int, hand: List[Card],
+               current: int) -> None:
+        """
+        Start estimating a new position, cancelling the last one. Doesn't
+        wait for the worker.
+        :param players: Players in seat order.
+        :param seat: Seat of the player to estimate for.
+        :param hand: Their hand.
+        :param current: Seat of the player to move.
+        """
+        self._position += 1
+        if self.estimate is not None:
+            self.estimate.is_current = False
+        self._conn.send((self._position,
+                         [player.stocks.tolist() for player in players],
+                         seat, [card.id for card in hand], current))
+
+    def poll(self) -> Estimate:
+        """
+        Take the worker's latest results, without waiting.
+        :return: Estimate of the current position, or if there is none yet,
+            the last estimate of an earlier one; None if there is neither.
+        """
+        while self._conn.poll():
+            position, win_rate, turns, playouts = self._conn.recv()
+            self.estimate = Estimate(win_rate, turns, playouts,
+                                     position == self._position)
+        return self.estimate
+
+    def close(self) -> None:
+        """Stop the worker."""
+        self._conn.send(None)
+        self._conn.close()
+        self._process.join()
+
+
+def _estimate_positions(conn, card_file: str, seed) -> None:
+    """
+    Worker process: estimate each position sent on conn until None is
+    sent.
+    """
+    # Yield the CPU to the game whenever it needs it
+    if hasattr(os, 'nice'):
+        os.nice(10)
+    dealer = read_cards(card_file)
+    seeds = np.random.SeedSequence(seed)
+    message = conn.recv()
+    while message is not None:
+        position, stocks, seat, hand, current = message
+        hands = [None, None]
+        hands[seat] = hand
+        wins = 0.0
+        turns = 0
+        playouts = 0
+        while playouts < MAX_PLAYOUTS and not conn.poll():
+            game = BatchGame(dealer, ESTIMATE_BATCH, seeds.spawn(1)[0])
+            game.set_state(stocks, current, hands)
+            winner = game.run(max_turns=MAX_PLAYOUT_TURNS + current)
+            wins += int(np.count_nonzero(winner == seat)) + \
+                0.5 * np.count_nonzero(winner < 0)
+            turns += int(game.turns.sum())
+            playouts += ESTIMATE_BATCH
+            conn.send((position, wins / playouts, turns / playouts,
+                       playouts))
+        # Skip to the latest position
+        message = conn.recv()
+        while message is not None and conn.poll():
+            message = conn.recv()
@@ -0,0 +1,78 @@
+"""
+Game rules shared by the terminal game and the headless engines.
+"""
+
+from typing import List
+from player import *
+
+
+STARTING_RESOURCES = {
+    'B': 2, 'b': 5,
+    'S': 2, 'w': 5,
+    'M': 2, 'c': 5,
+    'C': 30, 'F': 10
+}
+
+# Number of cards in each player's hand
+HAND_SIZE = 8
+
+# Maximum number of cards that can be discarded at once
+MAX_DISCARD = 3
+
+# Win when your castle is at least this much
+CASTLE_WIN = 100
+
+# [worker, out_resource] pairs: each turn, out_resource grows by the number
+# of workers
+RESOURCE_GROWTH = [['B', 'b'], ['S', 'w'], ['M', 'c']]
+# Same as RESOURCE_GROWTH, with resource indices
+RESOURCE_GROWTH_INDEX = [[resource_index[worker], resource_index[out]]
+                         for worker, out in RESOURCE_GROWTH]
+
+_CASTLE = resource_index['C']
+
+# Odd multiplier that makes state_hash depend on seat order
+_SEAT_MULTIPLIER = 0x9e3779b97f4a7c15
+
+
+def is_unique(lst: List) -> bool:
+    """Return true if the list has unique elements."""
+    return len(lst) == len(set(lst))
+
+
+def grow_resources(player: Player) -> None:
+    """
+    Grow the resources of a player on their turn. (E.g. grow their bricks
+    by the number of builders they have.)
+    :param player: Player.
+    """
+    stocks = player.stocks
+    for worker, out_resource in RESOURCE_GROWTH_INDEX:
+        stocks[out_resource] += stocks[worker]
+
+
+def won(player1: Player, player2: Player) -> Player:
+    """
+    :param player1: A player.
+    :param player2: Another player.
+    :return: If either player has won, return that player. Else, return None.
+    """
+    castle1 = player1.stocks[_CASTLE]
+    castle2 = player2.stocks[_CASTLE]
+    if castle1 >= CASTLE_WIN or castle2 <= 0:
+        return player1
+    elif castle2 >= CASTLE_WIN or castle1 <= 0:
+        return player2
+
+    return None
+
+
+def state_hash(player1: Player, player2: Player) -> int:
+    """
+    :param player1: Player who moved first.
+    :param player2: The other player.
+    :return: 64-bit hash of both players' stocks, for peers to check that
+        they agree on the game state at the end of a turn.
+    """
+    return (player1.stock_hash() * _SEAT_MULTIPLIER +
+            player2.stock_hash()) & HASH_MASK
@@ -1,114 +1,430 @@
+import getpass
+import os
 import sys
 import socket
-import pickle
+import time
+import metrics
 import myprotocol
 import re
+import select
+import transport
 from card_dealer import *
 from player_turn import *
+from game import *
+from turn_codec import *
+from match_codec import *
+from render import *
+from estimator import *
+from results import ResultStore
+from server import run_server
 
 
-STARTING_RESOURCES = {
-    'B': 2, 'b': 5,
-    'S': 2, 'w': 5,
-    'M': 2, 'c': 5,
-    'C': 30, 'F': 10
-}
+# Seconds between redraws of the win estimate while waiting for the opponent
+ESTIMATE_REFRESH = 0.25
 
-# Number of cards in each player's hand
-HAND_SIZE = 8
+# Attempts to reconnect to a suspended match, and seconds between them
+RESUME_ATTEMPTS = 30
+RESUME_DELAY = 1
 
-# Maximum number of cards that can be discarded at once
-MAX_DISCARD = 3
 
-
-def is_unique(lst: List) -> bool:
-    """Return true if the list has unique elements."""
-    return len(lst) == len(set(lst))
+class InputException(Exception):
+    """Exception for bad user input."""
+    pass
 
 
-def grow_resources(player: Player) -> None:
+def draw_board(renderer: Renderer, you: Player, opponent: Player,
+               hand: List[Card], messages: List[str],
+               estimator: WinEstimator = None) -> List[str]:
     """
-    Grow the resources of a player on their turn. (E.g. grow their bricks
-    by the number of builders they have.)
-    :param player: Player.
+    Draw castle stats for both players, your hand and some messages, then
+    clear the messages.
+    :param renderer: Renderer to draw with.
+    :param you: Player representing you.
+    :param opponent: Player representing your opponent.
+    :param hand: Your hand, or None to leave it out.
+    :param messages: Lines to show below the board.
+    :param estimator: Optional win estimator; its latest estimate is shown
+        in the first line.
+    :return: Lines of the frame.
+    """
+    lines = []
+    if estimator is not None:
+        lines += [win_estimate_line(estimator.poll()), '']
+    lines += castle_stats_lines(you, opponent) + ['']
+    if hand is not None:
+        lines += hand_lines(you, hand) + ['']
+    lines += messages
+    renderer.draw(lines)
+    messages.clear()
+    return lines
+
+
+def win_estimate_line(estimate: Estimate) -> str:
     """
-    for worker, out_resource in [['B', 'b'], ['S', 'w'], ['M', 'c']]:
-        player.resources[out_resource] += player.resources[worker]
+    :param estimate: Estimate, or None if there is none yet.
+    :return: Line showing the estimate.
+    """
+    if estimate is None:
+        return 'Win chance: estimating...'
+    return estimate_line(estimate.win_rate, estimate.turns,
+                         estimate.is_current)
 
 
-def won(player1: Player, player2: Player) -> Player:
+def wait_for_turn(sock: socket.socket, renderer: Renderer,
+                  frame: List[str], estimator: WinEstimator) -> None:
+    """
+    Wait until the opponent's turn starts arriving, redrawing the win
+    estimate whenever it changes. Returns right away if the connection or
+    the renderer can't do that.
+    :param sock: Connection to the opponent.
+    :param renderer: Renderer that drew frame.
+    :param frame: Lines of the current frame, drawn by draw_board with the
+        estimator.
+    :param estimator: Win estimator, or None.
     """
-    :param player1: A player.
-    :param player2: Another player.
-    :return: If either player has won, return that player. Else, return None.
+    if estimator is None or not renderer.use_ansi or \
+            not hasattr(sock, 'fileno'):
+        return
+    estimate = estimator.estimate
+    while not select.select([sock], [], [], ESTIMATE_REFRESH)[0]:
+        if estimator.poll() is not estimate:
+            estimate = estimator.estimate
+            frame[0] = win_estimate_line(estimate)
+            renderer.draw(frame)
+
+
+def input_turn(player: Player, hand: List[Card]) -> str:
     """
-    # Win when your castle is at least this much
-    CASTLE_WIN = 100
+    Ask for a turn until the input is valid.
+    :param player: Player. For checking whether the cards are playable.
+    :param hand: List of cards.
+    :return: Card index to play, or 'd' followed by card indices to discard.
+    """
+    print('0-{} to play that card; d... (ex. d3, d246) to discard up to {} cards'.format(
+        HAND_SIZE - 1, MAX_DISCARD
+    ))
+
+    # Get valid input
+    result = input('Your turn: ')
+    while True:
+        try:
+            if result.startswith('d'):  # Discard turn
+                if not re.match('^[0-' + str(HAND_SIZE - 1) + ']{1,3}$', result[1:]):
+                    raise InputException('That doesn\'t make sense.')
+                if not is_unique(result[1:]):
+                    raise InputException('Discarded cards must be unique.')
+            else:  # Card turn
+                i = int(result)
+                if not 0 <= i < HAND_SIZE:
+                    raise InputException('That\'s out of bounds.')
+                if not hand[i].can_be_played(player):
+                    raise InputException('You can\'t play that card.')
+            return result
 
-    if player1.resources['C'] >= CASTLE_WIN or player2.resources['C'] <= 0:
-        return player1
-    elif player2.resources['C'] >= CASTLE_WIN or player1.resources['C'] <= 0:
-        return player2
+        except ValueError:  # Failure to convert something to int
+            result = input('That doesn\'t make sense. ')
 
-    return None
+        except InputException as e:  # Some other bad input.
+            result = input('{} '.format(str(e)))
 
 
-class InputException(Exception):
-    """Exception for bad user input."""
-    pass
+def handshake(sock: socket.socket, registry: CardRegistry) -> None:
+    """
+    Exchange handshakes with the other player.
+    :raises: ProtocolError if they use another wire version or card set.
+    """
+    myprotocol.send_message(sock, encode_handshake(registry))
+    check_handshake(myprotocol.recv_message(sock), registry)
+
+
+_BYTES_SENT = metrics.histogram(
+    'castlewars_turn_bytes_sent', 'Size of sent turn messages.',
+    metrics.SIZE_BUCKETS)
+_BYTES_RECEIVED = metrics.histogram(
+    'castlewars_turn_bytes_received', 'Size of received turn messages.',
+    metrics.SIZE_BUCKETS)
+_ENCODE_SECONDS = metrics.histogram(
+    'castlewars_turn_encode_seconds', 'Time to encode a turn.',
+    metrics.TIME_BUCKETS)
+_DECODE_SECONDS = metrics.histogram(
+    'castlewars_turn_decode_seconds', 'Time to decode a turn.',
+    metrics.TIME_BUCKETS)
+_SEND_SECONDS = metrics.histogram(
+    'castlewars_turn_send_seconds', 'Time to send a turn message.',
+    metrics.TIME_BUCKETS)
+_NETWORK_WAIT_SECONDS = metrics.histogram(
+    'castlewars_network_wait_seconds',
+    'Time spent waiting for the opponent\'s turn message.',
+    metrics.TIME_BUCKETS)
+_INPUT_SECONDS = metrics.histogram(
+    'castlewars_input_seconds', 'Time spent on your own turns.',
+    metrics.TIME_BUCKETS)
+_GAME_TURNS = metrics.histogram(
+    'castlewars_game_turns', 'Number of turns of finished games.',
+    metrics.TURN_BUCKETS)
+_GAMES_WON = metrics.counter(
+    'castlewars_games_won_total', 'Finished games that you won.')
+_GAMES_LOST = metrics.counter(
+    'castlewars_games_lost_total', 'Finished games that you lost.')
+_RESYNCS = metrics.counter(
+    'castlewars_resyncs_total', 'Times the state hash differed from the '
+    'opponent\'s and the state was resynced.')
+
+
+def send_turn(sock: socket.socket, turn: PlayerTurn, state_hash: int) \
+        -> None:
+    """
+    Send a player turn as a message over a socket.
+    :param state_hash: State hash after the turn, for the peer to check.
+    """
+    if not metrics.enabled:
+        myprotocol.send_message(sock, encode_checked_turn(turn, state_hash))
+        return
 
+    start = time.perf_counter()
+    message = encode_checked_turn(turn, state_hash)
+    encoded = time.perf_counter()
+    myprotocol.send_message(sock, message)
+    _ENCODE_SECONDS.observe(encoded - start)
+    _SEND_SECONDS.observe(time.perf_counter() - encoded)
+    _BYTES_SENT.observe(len(message))
 
-def print_castle_stats(you: Player, opponent: Player) -> None:
-    """Print resource stats for both players' castles.
-    :param you: Player representing you.
-    :param opponent: Player representing your opponent.
+
+def recv_turn(sock: socket.socket, registry: CardRegistry,
+              players: List[Player], wait: Callable[[], None] = None):
     """
-    boundary = '-------------+' + ' ' * 30 + '+-------------'
-    fmt = '{1:>3} {0:8} |' + ' ' * 30 + '| {2:>3} {0:8}'
-    resource_order = [['B', 'b'], ['S', 'w'], ['M', 'c'], ['C', 'F']]
+    Receive another player's turn from a socket. Answers resync requests
+    that come before it.
+    :param players: Both players, in seat order; sent on resync requests.
+    :param wait: Optional function to call first, which returns once the
+        turn starts arriving; e.g. to do something while waiting.
+    :return: (player turn, the peer's state hash after it).
+    """
+    start = time.perf_counter()
+    if wait is not None:
+        wait()
+    message = myprotocol.recv_message(sock)
+    while message[:1] == bytes([TURN_RESYNC]):
+        myprotocol.send_message(sock, encode_full_state(*players))
+        message = myprotocol.recv_message(sock)
+    if not metrics.enabled:
+        return decode_checked_turn(message, registry)
+
+    received = time.perf_counter()
+    result = decode_checked_turn(message, registry)
+    _NETWORK_WAIT_SECONDS.observe(received - start)
+    _DECODE_SECONDS.observe(time.perf_counter() - received)
+    _BYTES_RECEIVED.observe(len(message))
+    return result
+
+
+def resync(sock: socket.socket, players: List[Player]) -> None:
+    """
+    Replace the players' stocks with the peer's.
+    :param players: Both players, in seat order.
+    """
+    if metrics.enabled:
+        _RESYNCS.inc()
+    myprotocol.send_message(sock, encode_resync())
+    for player, synced in zip(players,
+                              decode_full_state(myprotocol.recv_message(sock))):
+        player.stocks[:] = synced.stocks
 
-    for resource_group in resource_order:
-        print(boundary)
-        for r in resource_group:
-            print(fmt.format(
-                resource_long[r], you.resources[r], opponent.resources[r]
-            ))
-    print(boundary)
 
+def join_server(ip: str, port: int, registry: CardRegistry,
+                token: bytes = None) -> socket.socket:
+    """
+    Connect to a game server, and join a new match or resume one.
+    :param ip: Server address.
+    :param port: Server port.
+    :param registry: Card registry.
+    :param token: Session token of the match to resume, or None to join a
+        new one.
+    :return: Connection to the server.
+    :raises: OSError or RuntimeError if the connection fails.
+    """
+    sock = transport.connect('{}:{}'.format(ip, port))
+    handshake(sock, registry)
+    if token is None:
+        myprotocol.send_message(sock, encode_join())
+    else:
+        myprotocol.send_message(sock, encode_resume(token))
+    return sock
 
-def print_hand(player: Player, hand: List[Card]) -> None:
-    """Print a hand of cards.
-    :param player: Player. For checking whether the cards are playable.
-    :param hand: List of cards.
+
+def resume_on_server(ip: str, port: int, registry: CardRegistry,
+                     token: bytes):
+    """
+    Reconnect to a suspended match, retrying for a while; e.g. while the
+    server restarts.
+    :return: Connection to the server, or None if it couldn't be made.
     """
-    def ok_if(condition: bool) -> str:
-        """Return 'OK' character if the condition is True, '' if False."""
-        if condition:
-            return 'OK'
-        return ''
+    if token is None:
+        return None
+    for attempt in range(RESUME_ATTEMPTS):
+        try:
+            return join_server(ip, port, registry, token)
+        except (OSError, RuntimeError):
+            time.sleep(RESUME_DELAY)
+    return None
 
-    fmt = '{:2} {:1}) {:18} {:13} {}'
-    print(fmt.format('', '', 'Card', 'Cost', 'Actions'))
-    for i, card in enumerate(hand):
-        print(fmt.format(
-            ok_if(card.can_be_played(player)), i, card.name,
-            card.cost_string(), card.action_string().capitalize()
-        ))
 
+def play_on_server(ip: str, port: int) -> None:
+    """
+    Play a match hosted by a game server (see server.py).
+    :param ip: Server address.
+    :param port: Server port.
+    """
+    print('Connecting to {}:{}...'.format(ip, port))
+    dealer = read_cards('cards.txt')
+    sock = join_server(ip, port, dealer.registry)
+    print('Connected! Waiting for an opponent...')
+    print()
 
-def send_turn(sock: socket.socket, turn: PlayerTurn) -> None:
-    """Send a player turn as a message over a socket."""
-    myprotocol.send_message(sock, pickle.dumps(turn))
+    renderer = Renderer()
+    # Lines describing the last turn, shown below the board
+    messages = []
+    state = None
+    # Session token, if the server lets us resume the match
+    token = None
+    while True:
+        try:
+            message = decode_server_message(myprotocol.recv_message(sock),
+                                            dealer.registry)
+        except (RuntimeError, ConnectionError):
+            if token is None:
+                raise
+            message = MatchSuspended()
+
+        if isinstance(message, SessionStarted):
+            token = message.token
+            continue
+        elif isinstance(message, MatchSuspended):
+            sock.close()
+            sock = resume_on_server(ip, port, dealer.registry, token)
+            if sock is None:
+                messages.append('Lost the connection to the server.')
+                break
+            messages.append('Reconnected to the server.')
+            continue
+        elif isinstance(message, MatchAborted):
+            messages.append('Your opponent left.')
+            break
+        elif isinstance(message, MoveRejected):
+            messages.append(message.reason)
+        else:
+            state = message
+            # Describe the last turn
+            turn = state.last_turn
+            if isinstance(turn, CardTurn):
+                if state.is_last_by_you:
+                    messages.append('Played {}'.format(turn.card))
+                else:
+                    messages.append('Your opponent played: {}'.format(
+                        turn.card))
+            elif isinstance(turn, DiscardTurn):
+                if state.is_last_by_you:
+                    messages.append('You discarded:')
+                else:
+                    messages.append('Your opponent discarded:')
+                for card in turn.cards:
+                    messages.append('\t{}'.format(card))
+
+            if state.is_game_over:
+                if state.is_won:
+                    messages.append('Congratulations, you won!')
+                else:
+                    messages.append(
+                        'Your opponent won--better luck next time!')
+                break
+
+        if state.is_your_turn:
+            draw_board(renderer, state.you, state.opponent, state.hand,
+                       messages)
+            result = input_turn(state.you, state.hand)
+            if result.startswith('d'):
+                message = encode_discard(list(map(int, result[1:])))
+            else:
+                message = encode_play(int(result))
+            try:
+                myprotocol.send_message(sock, message)
+            except (RuntimeError, ConnectionError):
+                # The next receive notices too, and resumes if it can
+                pass
+        else:
+            messages.append('Waiting for opponent\'s move...')
+            draw_board(renderer, state.you, state.opponent, state.hand,
+                       messages)
 
+    if state is not None:
+        draw_board(renderer, state.you, state.opponent, None, messages)
+    else:
+        print('\n'.join(messages))
+    sock.close()
+    print()
+    input('Press enter to exit. ')
 
-def recv_turn(sock: socket.socket) ->  PlayerTurn:
-    """Receive another player's from a socket."""
-    return pickle.loads(myprotocol.recv_message(sock))
+
+def watch_on_server(ip: str, port: int, match_id: int = 0) -> None:
+    """
+    Watch a match hosted by a game server.
+    :param ip: Server address.
+    :param port: Server watch port.
+    :param match_id: ID of the match to watch; 0 for the latest one.
+    """
+    print('Connecting to {}:{}...'.format(ip, port))
+    sock = transport.connect('{}:{}'.format(ip, port))
+    dealer = read_cards('cards.txt')
+    handshake(sock, dealer.registry)
+    myprotocol.send_message(sock, encode_watch(match_id))
+    print('Connected! Waiting for the match...')
+
+    renderer = Renderer()
+    while True:
+        message = decode_spectator_message(myprotocol.recv_message(sock),
+                                           dealer.registry)
+        if isinstance(message, MatchAborted):
+            print('The match is over or a player left.')
+            break
+
+        lines = ['Match {}, turn {}'.format(message.match_id,
+                                            message.num_turns), '']
+        lines += castle_stats_lines(*message.players) + ['']
+        turn = message.last_turn
+        player_name = 'Player {}'.format((message.last_seat or 0) + 1)
+        if isinstance(turn, CardTurn):
+            lines.append('{} played: {}'.format(player_name, turn.card))
+        elif isinstance(turn, DiscardTurn):
+            lines.append('{} discarded:'.format(player_name))
+            for card in turn.cards:
+                lines.append('\t{}'.format(card))
+        if message.is_game_over:
+            lines.append('Player {} won!'.format(message.winner + 1))
+        renderer.draw(lines)
+        if message.is_game_over:
+            break
+
+    sock.close()
+    print()
+    input('Press enter to exit. ')
 
 
 def main():
     # Script name is always first argument
-    if len(sys.argv) != 3:
+    if sys.argv[1:2] == ['-s'] and len(sys.argv) in (3, 4):
+        watch_port = int(sys.argv[3]) if len(sys.argv) == 4 else None
+        run_server(int(sys.argv[2]), read_cards('cards.txt'), watch_port)
+        return
+    if sys.argv[1:2] == ['-j'] and len(sys.argv) == 4:
+        play_on_server(sys.argv[2], int(sys.argv[3]))
+        return
+    if sys.argv[1:2] == ['-w'] and len(sys.argv) in (4, 5):
+        match_id = int(sys.argv[4]) if len(sys.argv) == 5 else 0
+        watch_on_server(sys.argv[2], int(sys.argv[3]), match_id)
+        return
+
+    is_local = len(sys.argv) == 2 and transport.is_address(sys.argv[1])
+    if len(sys.argv) != 3 and not is_local:
         print('Castle Wars!')
         print('A clone of the game by Mads Lundemo https://m0rkeulv.com/')
         print()
@@ -117,144 +433,166 @@ def main():
         print()
         print('{} -l <port>'.format(sys.argv[0]))
         print('to listen on that port as a server.')
+        print()
+        print('{} [-l] unix:<path>'.format(sys.argv[0]))
+        print('{} [-l] shm:<name>'.format(sys.argv[0]))
+        print('to connect or listen (-l) on the same machine, through a Unix')
+        print('socket or shared memory.')
+        print()
+        print('{} -s <port> [<watch port>]'.format(sys.argv[0]))
+        print('to host matches for many players on that port, and let')
+        print('spectators watch them on the watch port.')
+        print()
+        print('{} -j <ip> <port>'.format(sys.argv[0]))
+        print('to join a match on a server started with -s.')
+        print()
+        print('{} -w <ip> <watch port> [<match ID>]'.format(sys.argv[0]))
+        print('to watch a match (by default the latest) on such a server.')
         exit(1)
 
-    # Get ip, port, and listening or not from command line
-    is_listen = False
-    ip = None
-    if sys.argv[1] == '-l':
-        is_listen = True
+    # Get the address, and listening or not from command line
+    is_listen = sys.argv[1] == '-l'
+    if is_local:
+        address = sys.argv[1]
+    elif is_listen and transport.is_address(sys.argv[2]):
+        address = sys.argv[2]
+    elif is_listen:
+        address = ':{}'.format(int(sys.argv[2]))
     else:
-        ip = sys.argv[1]
-    port = int(sys.argv[2])
-
-    # Create socket connection with other peer
-    sock = None
-    if is_listen:  # TCP server, listen for a connection
-        print('Listening on port {}, waiting for connection...'.format(port))
-        server_sock = socket.socket()
-        # server_sock.bind((socket.gethostname(), port))
-        server_sock.bind(('', port))
-        server_sock.listen()
-        # 'sock' is a *new* socket representing a connection with the client.
-        sock, address = server_sock.accept()
-        print('Accepted connection with {}:{}'.format(*address))
-
-    else:  # TCP client, connect to the server
-        print('Connecting to {}:{}...'.format(ip, port))
-        sock = socket.socket()
-        sock.connect((ip, port))
+        address = '{}:{}'.format(sys.argv[1], int(sys.argv[2]))
+
+    # Create connection with other peer
+    if is_listen:  # Server, listen for a connection
+        print('Listening on {}, waiting for connection...'.format(address))
+        # 'sock' is a *new* connection with the client.
+        sock, peer = transport.accept_one(address)
+        print('Accepted connection with {}'.format(peer))
+
+    else:  # Client, connect to the server
+        print('Connecting to {}...'.format(address))
+        sock = transport.connect(address)
         print('Connected!')
     print()
+    # Name of the opponent in the results database: their host, as the
+    # server names its clients
+    opponent_name = 'local' if transport.is_address(address) \
+        else sock.getpeername()[0]
 
     # Create players
     you = Player(STARTING_RESOURCES)
     opponent = Player(STARTING_RESOURCES)
 
-    # Read cards and deal a hand
+    # Read cards, check that the other player has the same cards, and deal
+    # a hand
     dealer = read_cards('cards.txt')
+    handshake(sock, dealer.registry)
     your_hand = dealer.deal_list(HAND_SIZE)
 
     # Listener goes first
     is_your_turn = is_listen
+    # Players in seat order, for state hashes
+    players = [you, opponent] if is_listen else [opponent, you]
+    # True if the opponent's state hash differed from ours
+    is_out_of_sync = False
+    num_turns = 0
+
+    # Record metrics if a metrics file is given
+    metrics_file = os.environ.get('CASTLEWARS_METRICS')
+    metrics.enabled = bool(metrics_file)
+    # Store the result if a results database is given
+    results_file = os.environ.get('CASTLEWARS_RESULTS')
+    # plays[seat][card name] = times that seat played that card
+    plays = [{}, {}]
+    game_start = time.monotonic()
+
+    renderer = Renderer()
+    # Lines describing the last turns, shown below the board
+    messages = []
+    your_seat = players.index(you)
+    # Estimates the position in the background, from your seat; only shown
+    # on a terminal, so not worth a process otherwise
+    estimator = WinEstimator() if sys.stdout.isatty() else None
 
     while won(you, opponent) == None:
-        # Print castle stats and your hand
-        print_castle_stats(you, opponent)
-        print()
-        print_hand(you, your_hand)
-        print()
+        if estimator is not None:
+            current = your_seat if is_your_turn else 1 - your_seat
+            estimator.update(players, your_seat, your_hand, current)
+
+        # Draw castle stats, your hand and what happened
+        if not is_your_turn:
+            messages.append('Waiting for opponent\'s move...')
+        frame = draw_board(renderer, you, opponent, your_hand, messages,
+                           estimator)
 
         if is_your_turn:
-            print('0-{} to play that card; d... (ex. d3, d246) to discard up to {} cards'.format(
-                HAND_SIZE - 1, MAX_DISCARD
-            ))
-
-            # Get valid input
-            result = input('Your turn: ')
-            while True:
-                try:
-                    if result.startswith('d'):  # Discard turn
-                        if not re.match('^[0-' + str(HAND_SIZE - 1) + ']{1,3}$', result[1:]):
-                            raise InputException('That doesn\'t make sense.')
-                        if not is_unique(result[1:]):
-                            raise InputException('Discarded cards must be unique.')
-                    else:  # Card turn
-                        i = int(result)
-                        if not 0 <= i < HAND_SIZE:
-                            raise InputException('That\'s out of bounds.')
-                        if not your_hand[i].can_be_played(you):
-                            raise InputException('You can\'t play that card.')
-                    break
-
-                except ValueError:  # Failure to convert something to int
-                    result = input('That doesn\'t make sense. ')
-
-                except InputException as e:  # Some other bad input.
-                    result = input('{} '.format(str(e)))
-
-            print()
+            turn_start = time.perf_counter()
+            result = input_turn(you, your_hand)
+            if metrics.enabled:
+                _INPUT_SECONDS.observe(time.perf_counter() - turn_start)
 
             # Parse input result and do turn
             turn = None
             if result.startswith('d'):  # Discard turn
                 # Do the discard, and set turn
                 cards_i = list(map(int, result[1:]))
-                print('You discarded:')
+                messages.append('You discarded:')
                 for i in cards_i:
-                    print('\t{}'.format(your_hand[i]))
+                    messages.append('\t{}'.format(your_hand[i]))
                 # Set to-be-sent turn information
                 turn = DiscardTurn([your_hand[i] for i in cards_i])
-                print()
 
                 # Get new cards
-                print('You got new cards:')
+                messages.append('You got new cards:')
                 for i in cards_i:
                     new_card = dealer.deal()
-                    print('\t{}'.format(new_card))
+                    messages.append('\t{}'.format(new_card))
                     your_hand[i] = new_card
 
             else:  # Card turn
                 card_i = int(result)
                 # Play the card
-                print('Played {}'.format(your_hand[card_i]))
-                print()
+                messages.append('Played {}'.format(your_hand[card_i]))
                 your_hand[card_i].play(you, opponent, True)
+                name = your_hand[card_i].name
+                plays[your_seat][name] = plays[your_seat].get(name, 0) + 1
                 # Set to-be-sent turn information
                 turn = CardTurn(your_hand[card_i])
 
                 # Get a new card
                 new_card = dealer.deal()
-                print('Got new card: {}'.format(new_card))
+                messages.append('Got new card: {}'.format(new_card))
                 your_hand[card_i] = new_card
 
-            print()
-
             # Send turn info to other player
-            send_turn(sock, turn)
+            send_turn(sock, turn, state_hash(*players))
 
         else:  # Other player's turn
 
             # Receive turn
-            print('Waiting for opponent\'s move...')
-            print()
-            turn = recv_turn(sock)
+            turn, their_hash = recv_turn(
+                sock, dealer.registry, players,
+                lambda: wait_for_turn(sock, renderer, frame, estimator))
 
             # Carry out the turn
             if isinstance(turn, CardTurn):
-                print('Your opponent played: {}'.format(turn.card))
+                messages.append('Your opponent played: {}'.format(turn.card))
                 turn.card.play(you, opponent, False)
+                name = turn.card.name
+                their_plays = plays[1 - your_seat]
+                their_plays[name] = their_plays.get(name, 0) + 1
             elif isinstance(turn, DiscardTurn):
-                print('Your opponent discarded:')
+                messages.append('Your opponent discarded:')
                 for card in turn.cards:
-                    print('\t{}'.format(card))
-                print()
-                print('...and got {} new cards.'.format(len(turn.cards)))
-            print()
-
+                    messages.append('\t{}'.format(card))
+                messages.append('...and got {} new cards.'.format(
+                    len(turn.cards)))
+            is_out_of_sync = state_hash(*players) != their_hash
 
         # Switch turns
         is_your_turn = not is_your_turn
+        num_turns += 1
+        if metrics_file:
+            metrics.export(metrics_file)
 
         # Grow the current player's resources
         # This happens on every turn except the first player's first turn
@@ -263,15 +601,36 @@ def main():
         else:
             grow_resources(opponent)
 
-    print_castle_stats(you, opponent)
-    print()
-
-    if won(you, opponent) == you:
-        print('Congratulations, you won!')
+        # Take the opponent's state if it differs from ours
+        if is_out_of_sync:
+            messages.append('Out of sync with your opponent; resynced.')
+            resync(sock, players)
+            is_out_of_sync = False
+
+    if estimator is not None:
+        estimator.close()
+    is_won = won(you, opponent) == you
+    if metrics_file:
+        _GAME_TURNS.observe(num_turns)
+        (_GAMES_WON if is_won else _GAMES_LOST).inc()
+        metrics.export(metrics_file)
+    if results_file:
+        names = [None, None]
+        names[your_seat] = getpass.getuser()
+        names[1 - your_seat] = opponent_name
+        winner = your_seat if is_won else 1 - your_seat
+        store = ResultStore(results_file)
+        store.add(names, winner, num_turns, players, plays,
+                  time.monotonic() - game_start)
+        store.close()
+
+    if is_won:
+        messages.append('Congratulations, you won!')
     else:
-        print('Your opponent won--better luck next time!')
-    print()
+        messages.append('Your opponent won--better luck next time!')
+    draw_board(renderer, you, opponent, None, messages)
     input('Press enter to exit. ')
 
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
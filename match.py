@@ -0,0 +1,149 @@
+"""
+Authoritative state of one two-player game: both players' resources and
+hands, the dealer, and whose turn it is. Seat 0 moves first.
+
+A move is either the index of a card in the current player's hand, to play
+it, or a list of indices, to discard those cards. moves.py numbers the
+moves and generates the legal ones.
+"""
+
+from typing import List
+from card_dealer import *
+from game import *
+from moves import *
+from player_turn import *
+from turn_codec import TURN_CARD, TURN_DISCARD
+
+
+class IllegalMove(Exception):
+    """Exception for a move that breaks the rules."""
+    pass
+
+
+class Match:
+    def __init__(self, dealer: CardDealer):
+        """
+        Start a match with starting resources and freshly dealt hands.
+        :param dealer: Card dealer for both players. It should not be shared
+            with other matches.
+        """
+        self.dealer = dealer
+        self.players = [Player(STARTING_RESOURCES),
+                        Player(STARTING_RESOURCES)]
+        self.hands = [dealer.deal_list(HAND_SIZE),
+                      dealer.deal_list(HAND_SIZE)]
+        # Seat of the player to move
+        self.current = 0
+        # Number of turns played so far
+        self.num_turns = 0
+        # plays[seat][card_id] is how many times that seat played that card
+        self.plays = [[0] * len(dealer.cards) for seat in range(2)]
+        # Optional replay.GameRecorder, told about every turn
+        self.recorder = None
+
+    def winner(self):
+        """
+        :return: Seat of the player who has won, or None if nobody has won.
+        """
+        player = won(*self.players)
+        if player is None:
+            return None
+        return self.players.index(player)
+
+    def playable_mask(self) -> int:
+        """
+        :return: Bitmask of the current player's playable cards; see
+            moves.playable_mask.
+        """
+        return playable_mask(self.players[self.current],
+                             self.hands[self.current])
+
+    def legal_moves(self) -> tuple:
+        """
+        :return: Codes of the current player's legal moves; see moves.MOVES.
+        """
+        return LEGAL_MOVES[self.playable_mask()]
+
+    def check_play(self, slot: int) -> None:
+        """
+        Check that the current player can play a card.
+        :param slot: Index of the card in their hand.
+        :raises: IllegalMove if they can't.
+        """
+        if not 0 <= slot < HAND_SIZE:
+            raise IllegalMove('That\'s out of bounds.')
+        if not self.hands[self.current][slot].can_be_played(
+                self.players[self.current]):
+            raise IllegalMove('You can\'t play that card.')
+
+    def check_discard(self, slots: List[int]) -> None:
+        """
+        Check that the current player can discard some cards.
+        :param slots: Indices of the cards in their hand.
+        :raises: IllegalMove if they can't.
+        """
+        if not 1 <= len(slots) <= MAX_DISCARD:
+            raise IllegalMove('Discard 1 to {} cards.'.format(MAX_DISCARD))
+        if not all(0 <= slot < HAND_SIZE for slot in slots):
+            raise IllegalMove('That\'s out of bounds.')
+        if not is_unique(slots):
+            raise IllegalMove('Discarded cards must be unique.')
+
+    def play(self, slot: int) -> CardTurn:
+        """
+        The current player plays a card and gets a new one, ending their
+        turn.
+        :param slot: Index of the card in their hand.
+        :return: The turn.
+        :raises: IllegalMove if they can't play that card.
+        """
+        self.check_play(slot)
+        seat = self.current
+        hand = self.hands[seat]
+        card = hand[slot]
+        card.play(self.players[seat], self.players[1 - seat], True)
+        self.plays[seat][card.id] += 1
+        hand[slot] = self.dealer.deal()
+        self._end_turn()
+        if self.recorder is not None:
+            self.recorder.add_turn(self, TURN_CARD, [slot], [card.id],
+                                   [hand[slot].id])
+        return CardTurn(card)
+
+    def discard(self, slots: List[int]) -> DiscardTurn:
+        """
+        The current player discards cards and gets new ones, ending their
+        turn.
+        :param slots: Indices of the cards in their hand.
+        :return: The turn.
+        :raises: IllegalMove if they can't discard those cards.
+        """
+        self.check_discard(slots)
+        hand = self.hands[self.current]
+        turn = DiscardTurn([hand[slot] for slot in slots])
+        for slot in slots:
+            hand[slot] = self.dealer.deal()
+        self._end_turn()
+        if self.recorder is not None:
+            self.recorder.add_turn(self, TURN_DISCARD, slots,
+                                   [card.id for card in turn.cards],
+                                   [hand[slot].id for slot in slots])
+        return turn
+
+    def do_move(self, move) -> PlayerTurn:
+        """
+        The current player makes a move.
+        :param move: Index of a card in their hand to play it, or a list of
+            indices to discard those cards.
+        :return: The turn.
+        :raises: IllegalMove if the move breaks the rules.
+        """
+        if isinstance(move, int):
+            return self.play(move)
+        return self.discard(list(move))
+
+    def _end_turn(self) -> None:
+        """Switch turns and grow the next player's resources."""
+        self.num_turns += 1
+        self.current = 1 - self.current
+        grow_resources(self.players[self.current])
@@ -0,0 +1,353 @@
+"""
+Binary messages between a game server and its clients.
+Connections start with the handshake from turn_codec, client first.
+
+Client to server:
+    MSG_JOIN:    type (1 byte); a player's first message, to join a new match
+    MSG_RESUME:  type (1 byte) | session token (32 bytes); instead of
+                 MSG_JOIN, to return to a suspended match (see session.py)
+    MSG_PLAY:    type (1 byte) | hand index (1 byte)
+    MSG_DISCARD: type (1 byte) | hand indices (1 byte each)
+    MSG_WATCH:   type (1 byte) | match ID (4 bytes; 0 for the latest match);
+                 the only message of a spectator, on the server's watch port
+Server to spectator:
+    MSG_SNAPSHOT: type (1 byte) | match ID (4 bytes)
+                 | winner seat (1 byte; 0xff for none)
+                 | seat of the last turn (1 byte; 0xff for none)
+                 | number of turns (4 bytes)
+                 | resources of seat 0, then seat 1 (4 bytes each, in
+                 resource_order)
+                 | the last turn, encoded by turn_codec, if there was one
+    MSG_ABORT
+Server to client:
+    MSG_STATE:   type (1 byte) | flags (1 byte) | number of turns (4 bytes)
+                 | your resources, opponent resources (4 bytes each, in
+                 resource_order) | your hand (2-byte card IDs)
+                 | the last turn, encoded by turn_codec, if there was one
+    MSG_REJECT:  type (1 byte) | reason (UTF-8)
+    MSG_ABORT:   type (1 byte); the opponent left
+    MSG_SESSION: type (1 byte) | session token (32 bytes); sent when a match
+                 starts, if the server checkpoints matches
+    MSG_SUSPEND: type (1 byte); the match was suspended, e.g. because the
+                 server is shutting down or the opponent's connection
+                 dropped: reconnect and resume
+All integers are big-endian.
+"""
+
+from turn_codec import *
+from game import *
+from session import TOKEN_SIZE
+
+# Message types
+MSG_PLAY = 1
+MSG_DISCARD = 2
+MSG_STATE = 3
+MSG_REJECT = 4
+MSG_ABORT = 5
+MSG_WATCH = 6
+MSG_SNAPSHOT = 7
+MSG_JOIN = 8
+MSG_RESUME = 9
+MSG_SESSION = 10
+MSG_SUSPEND = 11
+
+# MSG_STATE flags
+FLAG_YOUR_TURN = 1
+FLAG_LAST_BY_YOU = 2
+FLAG_GAME_OVER = 4
+FLAG_YOU_WON = 8
+
+_NUM_RESOURCES = len(resource_order)
+_STATE = struct.Struct('>BBI{}i{}H'.format(2 * _NUM_RESOURCES, HAND_SIZE))
+_WATCH = struct.Struct('>BI')
+_SNAPSHOT = struct.Struct('>BIBBI{}i'.format(2 * _NUM_RESOURCES))
+_NO_SEAT = 0xff
+
+
+class MatchState:
+    """A match from the perspective of one client."""
+
+    def __init__(self, flags: int, num_turns: int, you: Player,
+                 opponent: Player, hand: List[Card],
+                 last_turn: PlayerTurn = None):
+        """
+        :param flags: MSG_STATE flags.
+        :param num_turns: Number of turns played so far.
+        :param you: Player representing the client.
+        :param opponent: Player representing their opponent.
+        :param hand: The client's hand.
+        :param last_turn: The last turn, if there was one.
+        """
+        self.flags = flags
+        self.num_turns = num_turns
+        self.you = you
+        self.opponent = opponent
+        self.hand = hand
+        self.last_turn = last_turn
+
+    @property
+    def is_your_turn(self) -> bool:
+        return bool(self.flags & FLAG_YOUR_TURN)
+
+    @property
+    def is_last_by_you(self) -> bool:
+        return bool(self.flags & FLAG_LAST_BY_YOU)
+
+    @property
+    def is_game_over(self) -> bool:
+        return bool(self.flags & FLAG_GAME_OVER)
+
+    @property
+    def is_won(self) -> bool:
+        return bool(self.flags & FLAG_YOU_WON)
+
+
+class MoveRejected:
+    """The server rejected the client's move."""
+
+    def __init__(self, reason: str):
+        """
+        :param reason: Why the move was rejected.
+        """
+        self.reason = reason
+
+
+class MatchAborted:
+    """The opponent left the match."""
+    pass
+
+
+class SessionStarted:
+    """The server checkpoints the match, and gave the client a token."""
+
+    def __init__(self, token: bytes):
+        """
+        :param token: Session token, for resuming the match.
+        """
+        self.token = token
+
+
+class MatchSuspended:
+    """The server suspended the match; the client should resume it."""
+    pass
+
+
+class MatchSnapshot:
+    """A match from the perspective of a spectator."""
+
+    def __init__(self, match_id: int, winner, last_seat, num_turns: int,
+                 players: List[Player], last_turn: PlayerTurn = None):
+        """
+        :param match_id: Match ID.
+        :param winner: Seat of the winner, or None if nobody has won.
+        :param last_seat: Seat of the player who did the last turn, or None
+            if there was no turn yet.
+        :param num_turns: Number of turns played so far.
+        :param players: Players in seat order.
+        :param last_turn: The last turn, if there was one.
+        """
+        self.match_id = match_id
+        self.winner = winner
+        self.last_seat = last_seat
+        self.num_turns = num_turns
+        self.players = players
+        self.last_turn = last_turn
+
+    @property
+    def is_game_over(self) -> bool:
+        return self.winner is not None
+
+
+def encode_join() -> bytes:
+    """
+    :return: Join message.
+    """
+    return bytes([MSG_JOIN])
+
+
+def encode_resume(token: bytes) -> bytes:
+    """
+    :param token: Session token.
+    :return: Resume message.
+    """
+    return bytes([MSG_RESUME]) + token
+
+
+def decode_join(data: bytes):
+    """
+    :param data: A player's first message.
+    :return: None to join a new match, or the session token of a match to
+        resume.
+    :raises: ProtocolError if the message is malformed.
+    """
+    if data == bytes([MSG_JOIN]):
+        return None
+    if len(data) == 1 + TOKEN_SIZE and data[0] == MSG_RESUME:
+        return data[1:]
+    raise ProtocolError('Bad join message')
+
+
+def encode_play(slot: int) -> bytes:
+    """
+    :param slot: Index of the card to play in the hand.
+    :return: Move message.
+    """
+    return bytes([MSG_PLAY, slot])
+
+
+def encode_discard(slots: List[int]) -> bytes:
+    """
+    :param slots: Indices of the cards to discard in the hand.
+    :return: Move message.
+    """
+    return bytes([MSG_DISCARD] + slots)
+
+
+def decode_move(data: bytes):
+    """
+    :param data: Move message.
+    :return: (MSG_PLAY, hand index) or (MSG_DISCARD, list of hand indices).
+    :raises: ProtocolError if the message is malformed.
+    """
+    if len(data) == 2 and data[0] == MSG_PLAY:
+        return MSG_PLAY, data[1]
+    elif len(data) >= 2 and data[0] == MSG_DISCARD:
+        return MSG_DISCARD, list(data[1:])
+    raise ProtocolError('Bad move message')
+
+
+def encode_state(flags: int, num_turns: int, you: Player, opponent: Player,
+                 hand: List[Card], last_turn: PlayerTurn = None) -> bytes:
+    """
+    :return: State message; see MatchState for the parameters.
+    """
+    data = _STATE.pack(MSG_STATE, flags, num_turns, *you.stocks,
+                       *opponent.stocks, *[card.id for card in hand])
+    if last_turn is not None:
+        data += encode_turn(last_turn)
+    return data
+
+
+def encode_reject(reason: str) -> bytes:
+    """
+    :param reason: Why the move was rejected.
+    :return: Reject message.
+    """
+    return bytes([MSG_REJECT]) + reason.encode()
+
+
+def encode_abort() -> bytes:
+    """
+    :return: Abort message.
+    """
+    return bytes([MSG_ABORT])
+
+
+def encode_session(token: bytes) -> bytes:
+    """
+    :param token: Session token of the client's seat.
+    :return: Session message.
+    """
+    return bytes([MSG_SESSION]) + token
+
+
+def encode_suspend() -> bytes:
+    """
+    :return: Suspend message.
+    """
+    return bytes([MSG_SUSPEND])
+
+
+def encode_watch(match_id: int = 0) -> bytes:
+    """
+    :param match_id: ID of the match to watch; 0 for the latest one.
+    :return: Watch message.
+    """
+    return _WATCH.pack(MSG_WATCH, match_id)
+
+
+def decode_watch(data: bytes) -> int:
+    """
+    :param data: Watch message.
+    :return: ID of the match to watch; 0 for the latest one.
+    :raises: ProtocolError if the message is malformed.
+    """
+    if len(data) != _WATCH.size or data[0] != MSG_WATCH:
+        raise ProtocolError('Bad watch message')
+    return _WATCH.unpack(data)[1]
+
+
+def encode_snapshot(match_id: int, winner, last_seat, num_turns: int,
+                    players: List[Player],
+                    last_turn: PlayerTurn = None) -> bytes:
+    """
+    :return: Snapshot message; see MatchSnapshot for the parameters.
+    """
+    data = _SNAPSHOT.pack(
+        MSG_SNAPSHOT, match_id, _NO_SEAT if winner is None else winner,
+        _NO_SEAT if last_seat is None else last_seat, num_turns,
+        *players[0].stocks, *players[1].stocks)
+    if last_turn is not None:
+        data += encode_turn(last_turn)
+    return data
+
+
+def decode_spectator_message(data: bytes, registry: CardRegistry):
+    """
+    :param data: Message from the server to a spectator.
+    :param registry: Card registry to resolve card IDs with.
+    :return: MatchSnapshot, or MatchAborted if a player left.
+    :raises: ProtocolError if the message is malformed.
+    """
+    if data[:1] == bytes([MSG_SNAPSHOT]):
+        try:
+            fields = _SNAPSHOT.unpack_from(data)
+        except struct.error as e:
+            raise ProtocolError('Bad snapshot message: {}'.format(e))
+        match_id, winner, last_seat, num_turns = fields[1:5]
+        stocks = fields[5:]
+        players = [Player.from_stocks(stocks[:_NUM_RESOURCES]),
+                   Player.from_stocks(stocks[_NUM_RESOURCES:])]
+        last_turn = None
+        if len(data) > _SNAPSHOT.size:
+            last_turn = decode_turn(data[_SNAPSHOT.size:], registry)
+        return MatchSnapshot(
+            match_id, None if winner == _NO_SEAT else winner,
+            None if last_seat == _NO_SEAT else last_seat, num_turns,
+            players, last_turn)
+    elif data[:1] == bytes([MSG_ABORT]):
+        return MatchAborted()
+    raise ProtocolError('Bad spectator message')
+
+
+def decode_server_message(data: bytes, registry: CardRegistry):
+    """
+    :param data: Message from the server.
+    :param registry: Card registry to resolve card IDs with.
+    :return: MatchState, MoveRejected, MatchAborted, SessionStarted or
+        MatchSuspended.
+    :raises: ProtocolError if the message is malformed.
+    """
+    if data[:1] == bytes([MSG_STATE]):
+        try:
+            fields = _STATE.unpack_from(data)
+            hand = [registry[card_id] for card_id in fields[-HAND_SIZE:]]
+        except (IndexError, struct.error) as e:
+            raise ProtocolError('Bad state message: {}'.format(e))
+        stocks = fields[3:3 + 2 * _NUM_RESOURCES]
+        you = Player(dict(zip(resource_order, stocks[:_NUM_RESOURCES])))
+        opponent = Player(dict(zip(resource_order, stocks[_NUM_RESOURCES:])))
+        last_turn = None
+        if len(data) > _STATE.size:
+            last_turn = decode_turn(data[_STATE.size:], registry)
+        return MatchState(fields[1], fields[2], you, opponent, hand,
+                          last_turn)
+    elif data[:1] == bytes([MSG_REJECT]):
+        return MoveRejected(data[1:].decode(errors='replace'))
+    elif data[:1] == bytes([MSG_ABORT]):
+        return MatchAborted()
+    elif len(data) == 1 + TOKEN_SIZE and data[0] == MSG_SESSION:
+        return SessionStarted(data[1:])
+    elif data == bytes([MSG_SUSPEND]):
+        return MatchSuspended()
+    raise ProtocolError('Bad server message')
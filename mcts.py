@@ -0,0 +1,342 @@
+"""
+Monte-Carlo tree search agent.
+
+The opponent's hand is hidden, so every iteration deals them a random hand
+(determinization), and the cards dealt after each move are drawn from the
+dealer: both are chance events, sampled anew on every iteration. Nodes
+live in a transposition table keyed by both players' stocks, whose turn it
+is and, for the searching player, their hand. The opponent's nodes don't
+include their hand, so the statistics of their moves use availability
+counts (moves are identified by card IDs, not hand indices).
+
+Moves are ordered by a cheap prior and added gradually as a node gets more
+visits (progressive widening), so all discard sets of up to MAX_DISCARD
+cards are considered without spreading visits over all of them.
+"""
+
+import itertools
+import math
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from agents import *
+
+# Seconds of search per move
+DEFAULT_TIME_LIMIT = 0.1
+
+# UCB exploration constant
+EXPLORATION = 0.5
+
+# A node considers 1 + WIDENING * sqrt(visits) of its moves
+WIDENING = 0.5
+
+# Number of turns of each random rollout before it is scored by evaluate()
+ROLLOUT_DEPTH = 16
+
+# The transposition table is cleared when it has this many nodes
+MAX_NODES = 200000
+
+# Search of a worker process; created once by _init_worker
+_worker_search = None
+
+
+class _Node:
+    """Statistics of a searched state."""
+    __slots__ = ('visits', 'stats')
+
+    def __init__(self):
+        self.visits = 0
+        # stats[move] = [visits, total value, availability]
+        self.stats = {}
+
+
+class MCTS:
+    def __init__(self, dealer: CardDealer, exploration: float = EXPLORATION,
+                 rollout_depth: int = ROLLOUT_DEPTH,
+                 max_nodes: int = MAX_NODES):
+        """
+        :param dealer: Card dealer for chance events. It should not be
+            shared, since the search draws from it.
+        :param exploration: UCB exploration constant.
+        :param rollout_depth: Number of turns of each rollout.
+        :param max_nodes: Maximum size of the transposition table.
+        """
+        self.dealer = dealer
+        self.cards = dealer.cards
+        self.exploration = exploration
+        self.rollout_depth = rollout_depth
+        self.max_nodes = max_nodes
+        self.random = random.Random(int(dealer.rng.integers(2 ** 63)))
+        # table[key] = _Node; kept between searches
+        self.table = {}
+
+    def search(self, you: Player, opponent: Player, hand: List[int],
+               time_limit: float = DEFAULT_TIME_LIMIT,
+               max_iterations: int = None):
+        """
+        Search the position where it's your turn.
+        :param you: Player to move.
+        :param opponent: Their opponent.
+        :param hand: Card IDs of your hand.
+        :param time_limit: Seconds to search.
+        :param max_iterations: Optional limit on the number of iterations.
+        :return: Dictionary from moves to visit counts at the root. A move
+            is a card ID to play, or a sorted tuple of card IDs to discard.
+        """
+        if len(self.table) > self.max_nodes:
+            self.table.clear()
+        deadline = time.perf_counter() + time_limit
+        root_key = self._key([you, opponent], 0, hand)
+        iterations = 0
+        while time.perf_counter() < deadline and \
+                iterations != max_iterations:
+            self._iterate(you, opponent, hand)
+            iterations += 1
+        root = self.table.get(root_key)
+        if root is None:
+            return {}
+        return {move: stat[0] for move, stat in root.stats.items()}
+
+    @staticmethod
+    def _key(players: List[Player], to_move: int, hand: List[int]):
+        """
+        :return: Transposition table key. The hand is only known, and only
+            part of the key, when the searching player (0) is to move.
+        """
+        if to_move == 0:
+            return (players[0].stocks.tobytes(), players[1].stocks.tobytes(),
+                    0, tuple(sorted(hand)))
+        return (players[0].stocks.tobytes(), players[1].stocks.tobytes(), 1)
+
+    def _iterate(self, you: Player, opponent: Player, hand: List[int]) -> None:
+        """Run one iteration: select, expand, roll out and back up."""
+        deal = self.dealer.deal_index
+        players = [you.copy(), opponent.copy()]
+        hands = [list(hand), [deal() for i in range(HAND_SIZE)]]
+        to_move = 0
+        # (node, moves considered, move chosen, player) for each step
+        path = []
+
+        value = None
+        while value is None:
+            winner = won(*players)
+            if winner is not None:
+                value = 1.0 if winner is players[0] else 0.0
+                break
+            key = self._key(players, to_move, hands[to_move])
+            node = self.table.get(key)
+            is_new = node is None
+            if is_new:
+                node = self.table[key] = _Node()
+
+            moves = self._moves(players[to_move], players[1 - to_move],
+                                hands[to_move], node.visits)
+            move = self._select(node, moves)
+            path.append((node, moves, move, to_move))
+            self._do_move(players, hands, to_move, move)
+            to_move = 1 - to_move
+            grow_resources(players[to_move])
+
+            if is_new:
+                value = self._rollout(players, hands, to_move)
+
+        for node, moves, move, player in path:
+            node.visits += 1
+            for m in moves:
+                node.stats.setdefault(m, [0, 0.0, 0])[2] += 1
+            stat = node.stats[move]
+            stat[0] += 1
+            stat[1] += value if player == 0 else 1.0 - value
+
+    def _moves(self, player: Player, opponent: Player, hand: List[int],
+               visits: int) -> List:
+        """
+        :return: The first moves in prior order that a node with that many
+            visits considers: playable cards, best evaluate() score first,
+            then discards of the most expensive cards, fewest cards first.
+        """
+        limit = 1 + int(WIDENING * math.sqrt(visits))
+        cards = self.cards
+        plays = []
+        for card_id in set(hand):
+            card = cards[card_id]
+            if card.can_be_played(player):
+                p = player.copy()
+                o = opponent.copy()
+                card._play(p, o)
+                plays.append((evaluate(p, o), card_id))
+        plays.sort(reverse=True)
+        moves = [card_id for score, card_id in plays[:limit]]
+
+        if len(moves) < limit:
+            by_cost = sorted(hand, key=lambda i: cards[i].cost_amount,
+                             reverse=True)
+            seen = set()
+            for size in range(1, MAX_DISCARD + 1):
+                for discard in itertools.combinations(by_cost, size):
+                    discard = tuple(sorted(discard))
+                    if discard not in seen:
+                        seen.add(discard)
+                        moves.append(discard)
+                        if len(moves) == limit:
+                            return moves
+        return moves
+
+    def _select(self, node: _Node, moves: List):
+        """
+        :return: The move with the best UCB score, or the first move that
+            has never been tried.
+        """
+        best = None
+        best_score = -math.inf
+        for move in moves:
+            stat = node.stats.get(move)
+            if stat is None or stat[0] == 0:
+                return move
+            score = stat[1] / stat[0] + self.exploration * math.sqrt(
+                math.log(stat[2] + 1) / stat[0])
+            if score > best_score:
+                best_score = score
+                best = move
+        return best
+
+    def _do_move(self, players: List[Player], hands: List[List[int]],
+                 to_move: int, move) -> None:
+        """Do a move, and draw new cards into the hand."""
+        hand = hands[to_move]
+        if isinstance(move, int):
+            self.cards[move]._play(players[to_move], players[1 - to_move])
+            hand[hand.index(move)] = self.dealer.deal_index()
+        else:
+            for card_id in move:
+                hand[hand.index(card_id)] = self.dealer.deal_index()
+
+    def _rollout(self, players: List[Player], hands: List[List[int]],
+                 to_move: int) -> float:
+        """
+        Play random moves for a while.
+        :return: 1 if the searching player won, 0 if they lost, else their
+            evaluate() score squashed into (0, 1).
+        """
+        cards = self.cards
+        for i in range(self.rollout_depth):
+            winner = won(*players)
+            if winner is not None:
+                return 1.0 if winner is players[0] else 0.0
+            player = players[to_move]
+            hand = hands[to_move]
+            playable = [slot for slot, card_id in enumerate(hand)
+                        if cards[card_id].can_be_played(player)]
+            if playable:
+                slot = self.random.choice(playable)
+                cards[hand[slot]]._play(player, players[1 - to_move])
+            else:
+                slot = self.random.randrange(HAND_SIZE)
+            hand[slot] = self.dealer.deal_index()
+            to_move = 1 - to_move
+            grow_resources(players[to_move])
+
+        score = evaluate(players[0], players[1])
+        if math.isinf(score):
+            return 1.0 if score > 0 else 0.0
+        return 1 / (1 + math.exp(-score / 20))
+
+
+def _init_worker(card_file: str) -> None:
+    """Load the card table and create a search once per worker process."""
+    global _worker_search
+    _worker_search = MCTS(read_cards(card_file))
+
+
+def _worker_search_root(stocks: List[List[int]], hand: List[int],
+                        time_limit: float, seed: np.random.SeedSequence):
+    """
+    Search a root position in a worker process; see MCTS.search.
+    :param seed: Seed of this task's random streams, so they depend on the
+        task and not on which worker runs it.
+    """
+    search = _worker_search
+    search.dealer.seed(seed)
+    search.random.seed(int(search.dealer.rng.integers(2 ** 63)))
+    you = Player(dict(zip(resource_order, stocks[0])))
+    opponent = Player(dict(zip(resource_order, stocks[1])))
+    return search.search(you, opponent, hand, time_limit)
+
+
+class MCTSAgent(Agent):
+    """Agent that plays the most visited move of an MCTS search."""
+
+    def __init__(self, seed=None, time_limit: float = DEFAULT_TIME_LIMIT,
+                 workers: int = 1, card_file: str = 'cards.txt'):
+        """
+        :param seed: Optional seed.
+        :param time_limit: Seconds of search per move.
+        :param workers: Number of processes that search the root in
+            parallel. Their visit counts are added up.
+        :param card_file: Card definition file, for worker processes. It
+            must define the same cards as the match's dealer.
+        """
+        super().__init__(seed)
+        self.time_limit = time_limit
+        self.workers = workers
+        self.card_file = card_file
+        self._search = None
+        self._executor = None
+        # Spawns the seeds of parallel search tasks
+        self._seed = None
+
+    def choose_move(self, match: Match):
+        seat = match.current
+        you = match.players[seat]
+        opponent = match.players[1 - seat]
+        hand = match.hands[seat]
+        hand_ids = [card.id for card in hand]
+
+        if self.workers > 1:
+            visits = self._search_parallel(you, opponent, hand_ids)
+        else:
+            if self._search is None:
+                dealer = match.dealer.spawn(1)[0]
+                dealer.seed(self.random.getrandbits(64))
+                self._search = MCTS(dealer)
+            visits = self._search.search(you, opponent, hand_ids,
+                                         self.time_limit)
+
+        if not visits:
+            return [0]
+        move = max(visits, key=visits.get)
+        if isinstance(move, int):
+            return hand_ids.index(move)
+        # Discard: map card IDs to distinct hand indices
+        slots = []
+        for card_id in move:
+            slots.append(next(i for i, c in enumerate(hand_ids)
+                              if c == card_id and i not in slots))
+        return slots
+
+    def _search_parallel(self, you: Player, opponent: Player,
+                         hand: List[int]):
+        """Search in every worker and add up the root visit counts."""
+        if self._executor is None:
+            self._seed = np.random.SeedSequence(self.random.getrandbits(64))
+            self._executor = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker,
+                initargs=(self.card_file,))
+        stocks = [you.stocks.tolist(), opponent.stocks.tolist()]
+        futures = [self._executor.submit(_worker_search_root, stocks, hand,
+                                         self.time_limit, seed)
+                   for seed in self._seed.spawn(self.workers)]
+        visits = {}
+        for future in futures:
+            for move, count in future.result().items():
+                visits[move] = visits.get(move, 0) + count
+        return visits
+
+    def close(self) -> None:
+        """Shut down the worker processes, if any."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+AGENTS['mcts'] = MCTSAgent
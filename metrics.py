@@ -0,0 +1,151 @@
+"""
+Cheap counters and histograms, exported as a Prometheus text file or as
+JSON lines.
+
+Instrumented code checks metrics.enabled before measuring anything, so
+metrics cost one attribute lookup per hook while disabled (the default).
+
+    metrics.enabled = True
+    ...
+    metrics.export('castlewars.prom')
+"""
+
+import json
+import os
+import time
+from bisect import bisect_left
+from typing import List
+
+# Whether instrumented code should record metrics
+enabled = False
+
+# Histogram buckets for durations in seconds
+TIME_BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5,
+                10, 60]
+# Histogram buckets for message sizes in bytes
+SIZE_BUCKETS = [8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536]
+# Histogram buckets for game lengths in turns
+TURN_BUCKETS = [10, 20, 30, 40, 50, 75, 100, 150, 200, 500]
+
+# _metrics[name] = Counter or Histogram
+_metrics = {}
+
+
+class Counter:
+    __slots__ = ('name', 'help', 'value')
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount=1) -> None:
+        """Add to the counter."""
+        self.value += amount
+
+    def prometheus(self) -> List[str]:
+        """:return: Lines of Prometheus text exposition format."""
+        return ['# HELP {} {}'.format(self.name, self.help),
+                '# TYPE {} counter'.format(self.name),
+                '{} {}'.format(self.name, self.value)]
+
+    def snapshot(self):
+        """:return: JSON-serializable value."""
+        return self.value
+
+
+class Histogram:
+    __slots__ = ('name', 'help', 'buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, name: str, help: str, buckets: List[float]):
+        """
+        :param buckets: Sorted upper bounds of the buckets; an unbounded
+            bucket is added.
+        """
+        self.name = name
+        self.help = help
+        self.buckets = list(buckets)
+        # counts[i] = number of values in bucket i (not cumulative)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value) -> None:
+        """Record a value."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def prometheus(self) -> List[str]:
+        """:return: Lines of Prometheus text exposition format."""
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} histogram'.format(self.name)]
+        cumulative = 0
+        for bound, count in zip(self.buckets + ['+Inf'], self.counts):
+            cumulative += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(
+                self.name, bound, cumulative))
+        lines.append('{}_sum {}'.format(self.name, self.sum))
+        lines.append('{}_count {}'.format(self.name, self.count))
+        return lines
+
+    def snapshot(self):
+        """:return: JSON-serializable value."""
+        return {'buckets': self.buckets, 'counts': self.counts,
+                'sum': self.sum, 'count': self.count}
+
+
+def counter(name: str, help: str) -> Counter:
+    """
+    :return: The counter with that name, created if needed.
+    """
+    if name not in _metrics:
+        _metrics[name] = Counter(name, help)
+    return _metrics[name]
+
+
+def histogram(name: str, help: str, buckets: List[float]) -> Histogram:
+    """
+    :return: The histogram with that name, created if needed.
+    """
+    if name not in _metrics:
+        _metrics[name] = Histogram(name, help, buckets)
+    return _metrics[name]
+
+
+def prometheus_text() -> str:
+    """:return: All metrics in Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics.values():
+        lines.extend(metric.prometheus())
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(filename: str) -> None:
+    """
+    Write all metrics to a Prometheus text file, e.g. for the node
+    exporter's textfile collector. The file is replaced atomically.
+    """
+    temp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(temp_filename, 'w') as f:
+        f.write(prometheus_text())
+    os.replace(temp_filename, filename)
+
+
+def append_json_line(filename: str) -> None:
+    """Append a timestamped snapshot of all metrics as a JSON line."""
+    snapshot = {name: metric.snapshot() for name, metric in _metrics.items()}
+    with open(filename, 'a') as f:
+        f.write(json.dumps({'time': time.time(), 'metrics': snapshot}) +
+                '\n')
+
+
+def export(filename: str) -> None:
+    """
+    Export all metrics: as JSON lines if the file name ends with .jsonl,
+    else as a Prometheus text file.
+    """
+    if filename.endswith('.jsonl'):
+        append_json_line(filename)
+    else:
+        write_prometheus(filename)
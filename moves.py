@@ -0,0 +1,90 @@
+"""
+Legal move generation with integer move codes.
+
+Every move of a hand has a fixed code: codes 0 to HAND_SIZE - 1 play the
+card in that slot, and the next codes discard one of the DISCARD_SETS.
+Discards are always legal, so the legal moves of a hand depend only on
+which of its cards are playable: a bitmask with bit i set if the card in
+slot i is. The moves of every mask are precomputed.
+
+    mask = playable_mask(player, hand)
+    for code in LEGAL_MOVES[mask]:
+        match.do_move(MOVES[code])
+"""
+
+import itertools
+from typing import List
+from card import *
+from game import *
+
+# Every set of 1 to MAX_DISCARD slots, as sorted tuples, smallest first
+DISCARD_SETS = tuple(discard for size in range(1, MAX_DISCARD + 1)
+                     for discard in itertools.combinations(range(HAND_SIZE),
+                                                           size))
+
+# MOVES[code] = the move with that code, as taken by Match.do_move: a slot
+# to play, or a tuple of slots to discard
+MOVES = tuple(range(HAND_SIZE)) + DISCARD_SETS
+
+NUM_MOVES = len(MOVES)
+
+# Codes of all discards
+DISCARD_CODES = tuple(range(HAND_SIZE, NUM_MOVES))
+
+# PLAYABLE_SLOTS[mask] = slots whose bits are set in mask
+PLAYABLE_SLOTS = tuple(tuple(slot for slot in range(HAND_SIZE)
+                             if mask >> slot & 1)
+                       for mask in range(1 << HAND_SIZE))
+
+# LEGAL_MOVES[mask] = codes of the legal moves of a hand with that
+# playable mask: its playable cards, then every discard
+LEGAL_MOVES = tuple(slots + DISCARD_CODES for slots in PLAYABLE_SLOTS)
+
+# _codes[move] = code; discards are keyed by sorted tuple
+_codes = {move: code for code, move in enumerate(MOVES)}
+
+
+def playable_mask(player: Player, hand: List[Card]) -> int:
+    """
+    :param player: Player holding the hand.
+    :param hand: List of HAND_SIZE cards.
+    :return: Bitmask with bit i set if the player can play hand[i].
+    """
+    stocks = player.stocks
+    mask = 0
+    bit = 1
+    for card in hand:
+        if stocks[card.cost_index] >= card.cost_amount:
+            mask |= bit
+        bit <<= 1
+    return mask
+
+
+def legal_moves(player: Player, hand: List[Card]) -> tuple:
+    """
+    :param player: Player holding the hand.
+    :param hand: List of HAND_SIZE cards.
+    :return: Codes of all legal moves: playable cards by slot, then every
+        discard of 1 to MAX_DISCARD cards.
+    """
+    return LEGAL_MOVES[playable_mask(player, hand)]
+
+
+def is_play(code: int) -> bool:
+    """
+    :return: True if the move with that code plays a card, False if it
+        discards.
+    """
+    return code < HAND_SIZE
+
+
+def move_code(move) -> int:
+    """
+    :param move: A slot to play, or a list or tuple of distinct slots to
+        discard, in any order.
+    :return: Code of the move.
+    :raises: KeyError if there is no such move.
+    """
+    if isinstance(move, int):
+        return _codes[move]
+    return _codes[tuple(sorted(move))]
@@ -2,8 +2,11 @@
 Socket communication using a simple protocol.
 Each message has a fixed-length header with the payload length in big-
 endian, followed by the payload.
+Connections only need sendall and recv_into, so besides sockets they may be
+any connection made by the transport module, e.g. over shared memory.
 """
 
+import asyncio
 import socket
 
 # Links about TCP sockets:
@@ -13,6 +16,22 @@ import socket
 # Length of fixed-length header
 HEADER_LENGTH = 4
 
+# Longest payload accepted from a peer. Game messages are far shorter; the
+# limit keeps a bad header from making us allocate up to 4 GiB.
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+
+# Maximum number of buffers given to one sendmsg call
+_MAX_SEND_BUFFERS = 512
+
+# Default initial receive buffer size of a FramedConnection
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+
+class ProtocolError(RuntimeError):
+    """Exception for a malformed message or an incompatible peer."""
+    pass
+
 
 def send_message(sock: socket.socket, payload: bytes) -> None:
     """
@@ -23,23 +42,44 @@ def send_message(sock: socket.socket, payload: bytes) -> None:
         RuntimeError if the connection breaks.
         OverflowError if the message is too long.
     """
-    _send_bytes(sock, len(payload).to_bytes(HEADER_LENGTH, 'big'))
-    _send_bytes(sock, payload)
+    _send_buffers(sock, [len(payload).to_bytes(HEADER_LENGTH, 'big'),
+                         payload])
+
+
+def frame_message(payload: bytes) -> bytes:
+    """
+    :param payload: Payload.
+    :return: The whole message, header included, as sent by send_message.
+    :raises: OverflowError if the message is too long.
+    """
+    return len(payload).to_bytes(HEADER_LENGTH, 'big') + payload
 
 
-def _send_bytes(sock: socket.socket, bytestr: bytes) -> None:
+def _send_buffers(sock: socket.socket, buffers: list) -> None:
     """
-    Send an entire bytestring.
+    Send a sequence of byte sequences entirely, without joining them where
+    the socket supports scatter/gather sends.
     :param sock: Socket.
-    :param bytestr: Byte sequence to be sent.
+    :param buffers: List of byte sequences to send, in order.
     :raises: RuntimeError if the connection breaks.
     """
-    sent = 0
-    while sent < len(bytestr):
-        send_amount = sock.send(bytestr[sent:])
-        if send_amount == 0:
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(buffers))
+        return
+
+    buffers = [memoryview(b) for b in buffers if len(b)]
+    while buffers:
+        sent = sock.sendmsg(buffers[:_MAX_SEND_BUFFERS])
+        if sent == 0:
             raise RuntimeError('Socket connection broken')
-        sent += send_amount
+        # Drop what was sent
+        i = 0
+        while i < len(buffers) and sent >= len(buffers[i]):
+            sent -= len(buffers[i])
+            i += 1
+        del buffers[:i]
+        if sent:
+            buffers[0] = buffers[0][sent:]
 
 
 def recv_message(sock: socket.socket) -> bytes:
@@ -47,14 +87,42 @@ def recv_message(sock: socket.socket) -> bytes:
     Receive a message.
     :param sock: Socket.
     :return: The payload.
-    :raises: RuntimeError if the connection breaks.
+    :raises:
+        RuntimeError if the connection breaks.
+        ProtocolError if the message is longer than MAX_MESSAGE_SIZE.
     """
-    payload_length = int.from_bytes(
+    payload_length = _check_length(int.from_bytes(
         _recv_bytes(sock, HEADER_LENGTH), 'big'
-    )
+    ))
     return _recv_bytes(sock, payload_length)
 
 
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    """
+    Receive a message from an asyncio stream.
+    :param reader: Stream reader.
+    :return: The payload.
+    :raises:
+        asyncio.IncompleteReadError if the connection breaks.
+        ProtocolError if the message is longer than MAX_MESSAGE_SIZE.
+    """
+    payload_length = _check_length(int.from_bytes(
+        await reader.readexactly(HEADER_LENGTH), 'big'
+    ))
+    return await reader.readexactly(payload_length)
+
+
+def _check_length(length: int) -> int:
+    """
+    :param length: Payload length read from a header.
+    :return: The length.
+    :raises: ProtocolError if it is longer than MAX_MESSAGE_SIZE.
+    """
+    if length > MAX_MESSAGE_SIZE:
+        raise ProtocolError('Message of {} bytes is too long'.format(length))
+    return length
+
+
 def _recv_bytes(sock: socket.socket, length: int) -> bytes:
     """
     Receive a known-length bytestring.
@@ -63,10 +131,150 @@ def _recv_bytes(sock: socket.socket, length: int) -> bytes:
     :return: Received bytestring.
     :raises: RuntimeError if the connection breaks.
     """
-    data = b''
-    while len(data) < length:
-        temp = sock.recv(length - len(data))
-        if temp == '':
-            raise RuntimeError("Socket connection broken")
-        data += temp
-    return data
+    data = bytearray(length)
+    view = memoryview(data)
+    received = 0
+    while received < length:
+        amount = sock.recv_into(view[received:])
+        if amount == 0:
+            raise RuntimeError('Socket connection broken')
+        received += amount
+    return bytes(data)
+
+
+class FramedConnection:
+    """
+    Buffered connection using the same message framing as send_message and
+    recv_message. Received data is read into one reusable buffer, and as
+    many messages as it holds are parsed from it. Outgoing messages can be
+    queued and sent together by flush().
+    """
+
+    def __init__(self, sock: socket.socket,
+                 buffer_size: int = DEFAULT_BUFFER_SIZE):
+        """
+        :param sock: Connected socket.
+        :param buffer_size: Initial receive buffer size. The buffer grows to
+            fit larger messages.
+        """
+        self.sock = sock
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        # Received data that hasn't been parsed is _buffer[_start:_end]
+        self._start = 0
+        self._end = 0
+        # Queued byte sequences to send
+        self._queue = []
+
+    def queue_message(self, payload: bytes) -> None:
+        """
+        Queue a message, to be sent by the next flush().
+        :param payload: Payload to send. It must not be modified until it is
+            sent.
+        :raises: OverflowError if the message is too long.
+        """
+        self._queue.append(len(payload).to_bytes(HEADER_LENGTH, 'big'))
+        self._queue.append(payload)
+
+    def flush(self) -> None:
+        """
+        Send all queued messages.
+        :raises: RuntimeError if the connection breaks.
+        """
+        if self._queue:
+            buffers = self._queue
+            self._queue = []
+            _send_buffers(self.sock, buffers)
+
+    def send_message(self, payload: bytes) -> None:
+        """
+        Send a message, along with any queued ones.
+        :param payload: Payload to send.
+        :raises:
+            RuntimeError if the connection breaks.
+            OverflowError if the message is too long.
+        """
+        self.queue_message(payload)
+        self.flush()
+
+    def recv_message(self) -> bytes:
+        """
+        Receive a message.
+        :return: The payload.
+        :raises:
+            RuntimeError if the connection breaks.
+            ProtocolError if a message is longer than MAX_MESSAGE_SIZE.
+        """
+        payload = self._parse_message()
+        while payload is None:
+            self._fill()
+            payload = self._parse_message()
+        return payload
+
+    def recv_messages(self) -> list:
+        """
+        Receive at least one message, plus every other message that has
+        already arrived.
+        :return: List of payloads.
+        :raises:
+            RuntimeError if the connection breaks.
+            ProtocolError if a message is longer than MAX_MESSAGE_SIZE.
+        """
+        payloads = [self.recv_message()]
+        payload = self._parse_message()
+        while payload is not None:
+            payloads.append(payload)
+            payload = self._parse_message()
+        return payloads
+
+    def _message_length(self):
+        """
+        :return: Length of the next message, header included, or None if its
+            header hasn't been received yet.
+        :raises: ProtocolError if it is longer than MAX_MESSAGE_SIZE.
+        """
+        if self._end - self._start < HEADER_LENGTH:
+            return None
+        return HEADER_LENGTH + _check_length(int.from_bytes(
+            self._view[self._start:self._start + HEADER_LENGTH], 'big'))
+
+    def _parse_message(self):
+        """
+        :return: Payload of the next message if it has been received
+            entirely, else None.
+        """
+        length = self._message_length()
+        if length is None or self._end - self._start < length:
+            return None
+        start = self._start + HEADER_LENGTH
+        self._start += length
+        payload = bytes(self._view[start:self._start])
+        if self._start == self._end:
+            self._start = self._end = 0
+        return payload
+
+    def _fill(self) -> None:
+        """
+        Receive more data into the buffer, making room first if needed.
+        :raises: RuntimeError if the connection breaks.
+        """
+        needed = self._message_length() or HEADER_LENGTH
+        if self._start + needed > len(self._buffer):
+            # Move unparsed data to the front, and grow the buffer if the
+            # message doesn't fit
+            pending = self._end - self._start
+            if needed > len(self._buffer):
+                buffer = bytearray(max(needed, 2 * len(self._buffer)))
+                buffer[:pending] = self._view[self._start:self._end]
+                self._view.release()
+                self._buffer = buffer
+                self._view = memoryview(buffer)
+            else:
+                self._view[:pending] = self._view[self._start:self._end]
+            self._start = 0
+            self._end = pending
+
+        amount = self.sock.recv_into(self._view[self._end:])
+        if amount == 0:
+            raise RuntimeError('Socket connection broken')
+        self._end += amount
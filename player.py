@@ -1,11 +1,90 @@
+import hashlib
+from array import array
+from collections.abc import MutableMapping
+from resource import *
+
+_CASTLE = resource_index['C']
+_FENCE = resource_index['F']
+
+# STOCK_HASH_KEYS[i] = random odd 64-bit key of resource resource_order[i].
+# A player's stock hash is the sum of amount * key over their resources mod
+# 2 ** 64. The keys being odd, changing a single resource always changes it.
+# The keys are derived from the resource names so every peer has the same
+# ones.
+STOCK_HASH_KEYS = [int.from_bytes(hashlib.sha256(
+    'castlewars stock hash {}'.format(r).encode()).digest()[:8], 'big') | 1
+    for r in resource_order]
+
+HASH_MASK = 2 ** 64 - 1
+
+
+class ResourceView(MutableMapping):
+    """Dict-style view of a player's stocks, keyed by resource."""
+    __slots__ = ('_stocks',)
+
+    def __init__(self, stocks):
+        """
+        :param stocks: Array of resource amounts, in resource_order.
+        """
+        self._stocks = stocks
+
+    def __getitem__(self, resource):
+        return self._stocks[resource_index[resource]]
+
+    def __setitem__(self, resource, amount):
+        self._stocks[resource_index[resource]] = amount
+
+    def __delitem__(self, resource):
+        raise TypeError('Resources can\'t be removed')
+
+    def __iter__(self):
+        return iter(resource_order)
+
+    def __len__(self):
+        return len(resource_order)
+
+
 class Player:
+    __slots__ = ('stocks',)
+
     def __init__(self, resources):
         """
         Construct a new player with starting resources.
-        :param resources: Resource -> starting amount dictionary. The player
-            makes a private copy of the given dictionary.
+        :param resources: Resource -> starting amount mapping. The player
+            makes a private copy of the given amounts.
+        """
+        # stocks[i] = amount of resource resource_order[i]
+        self.stocks = array('i', [resources[r] for r in resource_order])
+
+    @classmethod
+    def from_stocks(cls, stocks):
+        """
+        :param stocks: Resource amounts, in resource_order.
+        :return: A new player with those stocks.
+        """
+        player = cls.__new__(cls)
+        player.stocks = array('i', stocks)
+        return player
+
+    @property
+    def resources(self):
+        """Resource -> amount view of the player's stocks."""
+        return ResourceView(self.stocks)
+
+    def stock_hash(self) -> int:
+        """
+        :return: 64-bit hash of the player's stocks; see STOCK_HASH_KEYS.
+        """
+        return sum(amount * key for amount, key
+                   in zip(self.stocks, STOCK_HASH_KEYS)) & HASH_MASK
+
+    def copy(self):
+        """
+        :return: A new player with a copy of this player's stocks.
         """
-        self.resources = dict(resources)
+        player = Player.__new__(Player)
+        player.stocks = self.stocks[:]
+        return player
 
     def change_resource(self, resource, amount):
         """
@@ -13,7 +92,16 @@ class Player:
         :param resource: Resource to change.
         :param amount: Integer amount.
         """
-        self.resources[resource] = max(0, self.resources[resource] + amount)
+        self.change_stock(resource_index[resource], amount)
+
+    def change_stock(self, index, amount):
+        """
+        Same as change_resource, with the resource given by its index.
+        :param index: Index of resource in resource_order.
+        :param amount: Integer amount.
+        """
+        stocks = self.stocks
+        stocks[index] = max(0, stocks[index] + amount)
 
     def lose_resource(self, resource, amount):
         """
@@ -21,8 +109,17 @@ class Player:
         :param resource: Resource to lose.
         :param amount: Nonnegative integer amount; lose at most this much.
         """
+        self.lose_stock(resource_index[resource], amount)
+
+    def lose_stock(self, index, amount):
+        """
+        Same as lose_resource, with the resource given by its index.
+        :param index: Index of resource in resource_order.
+        :param amount: Nonnegative integer amount; lose at most this much.
+        """
         assert amount >= 0
-        self.change_resource(resource, -amount)
+        stocks = self.stocks
+        stocks[index] = max(0, stocks[index] - amount)
 
     def attacked(self, amount):
         """
@@ -31,9 +128,8 @@ class Player:
         :param amount: Positive integer attack amount.
         """
         assert amount >= 1
-        if self.resources['F'] >= amount:
-            self.resources['F'] -= amount
-        else:
-            amount_left = amount - self.resources['F']
-            self.resources['F'] -= amount
-            self.lose_resource('C', amount_left)
\ No newline at end of file
+        stocks = self.stocks
+        fence = stocks[_FENCE]
+        stocks[_FENCE] = fence - amount
+        if fence < amount:
+            stocks[_CASTLE] = max(0, stocks[_CASTLE] - (amount - fence))
@@ -0,0 +1,162 @@
+"""
+Terminal rendering of the board, the hand and turn messages.
+
+A frame is a list of lines. Renderer keeps the last frame it drew and, on a
+terminal, redraws only the lines that changed, using ANSI cursor movement,
+in one write per frame. Lines are cut to the terminal width, since a line
+that wraps would move every row below it. A frame too tall for the terminal
+is redrawn in full every time, since drawing it scrolls the screen.
+Anything written below the frame (e.g. an input prompt) is cleared by the
+next frame.
+"""
+
+import shutil
+import sys
+from typing import List, TextIO
+from card import *
+
+_BOUNDARY = '-------------+' + ' ' * 30 + '+-------------'
+_STAT_FORMAT = '{1:>3} {0:8} |' + ' ' * 30 + '| {2:>3} {0:8}'
+# Resources of each section of the board, as resource indices
+_STAT_GROUPS = [[resource_index[r] for r in group]
+                for group in [['B', 'b'], ['S', 'w'], ['M', 'c'], ['C', 'F']]]
+_STAT_NAMES = [resource_long[r] for r in resource_order]
+
+_HAND_FORMAT = '{:2} {:1}) {}'
+_HAND_HEADER = _HAND_FORMAT.format('', '', '{:18} {:13} {}'.format(
+    'Card', 'Cost', 'Actions'))
+
+# Width of the win rate bar, in characters
+_BAR_WIDTH = 20
+
+# _card_rows[card] = name, cost and actions columns of a card in a hand
+_card_rows = {}
+
+# ANSI escape sequences
+_CLEAR_SCREEN = '\x1b[H\x1b[2J'
+_CLEAR_LINE = '\x1b[K'
+_CLEAR_BELOW = '\x1b[J'
+_MOVE = '\x1b[{};1H'
+
+
+def castle_stats_lines(you: Player, opponent: Player) -> List[str]:
+    """
+    :param you: Player representing you.
+    :param opponent: Player representing your opponent.
+    :return: Lines of resource stats for both players' castles.
+    """
+    lines = []
+    for group in _STAT_GROUPS:
+        lines.append(_BOUNDARY)
+        for i in group:
+            lines.append(_STAT_FORMAT.format(_STAT_NAMES[i], you.stocks[i],
+                                             opponent.stocks[i]))
+    lines.append(_BOUNDARY)
+    return lines
+
+
+def estimate_line(win_rate: float, turns: float, is_current: bool) -> str:
+    """
+    :param win_rate: Estimated chance of winning, from 0 to 1.
+    :param turns: Estimated number of turns left.
+    :param is_current: False if the estimate is of an earlier position.
+    :return: Line with a bar of the win rate and the estimates.
+    """
+    filled = round(win_rate * _BAR_WIDTH)
+    return 'Win chance [{}{}] {:3.0%}, about {:.0f} turns left{}'.format(
+        '#' * filled, '-' * (_BAR_WIDTH - filled), win_rate, turns,
+        '' if is_current else ' (updating)')
+
+
+def hand_lines(player: Player, hand: List[Card]) -> List[str]:
+    """
+    :param player: Player. For checking whether the cards are playable.
+    :param hand: List of cards.
+    :return: Lines listing the hand, marking playable cards.
+    """
+    lines = [_HAND_HEADER]
+    for i, card in enumerate(hand):
+        lines.append(_HAND_FORMAT.format(
+            'OK' if card.can_be_played(player) else '', i, _card_row(card)))
+    return lines
+
+
+def _card_row(card: Card) -> str:
+    """
+    :return: Name, cost and actions columns of a card; formatted once per
+        card.
+    """
+    row = _card_rows.get(card)
+    if row is None:
+        row = _card_rows[card] = '{:18} {:13} {}'.format(
+            card.name, card.cost_string(), card.action_string().capitalize())
+    return row
+
+
+class Renderer:
+    def __init__(self, stream: TextIO = None, use_ansi: bool = None):
+        """
+        :param stream: Stream to draw on; defaults to stdout.
+        :param use_ansi: True to redraw changed lines in place with ANSI
+            escape sequences; defaults to whether the stream is a terminal.
+            Otherwise, every frame is written in full below the last one.
+        """
+        self.stream = stream or sys.stdout
+        if use_ansi is None:
+            use_ansi = self.stream.isatty()
+        self.use_ansi = use_ansi
+        # Lines of the last frame drawn, or None to redraw the whole screen
+        self.previous = None
+        # Terminal size when the last frame was drawn
+        self.size = None
+
+    def update(self, lines: List[str]) -> str:
+        """
+        Make a frame the current one.
+        :param lines: Lines of the frame.
+        :return: Text that draws the frame over the previous one.
+        """
+        if not self.use_ansi:
+            return '\n'.join(lines) + '\n\n'
+
+        size = shutil.get_terminal_size()
+        if size != self.size:
+            # Resizing the terminal rewraps what was drawn
+            self.size = size
+            self.invalidate()
+        # Leave the last column free, so the cursor never wraps
+        lines = [line.expandtabs()[:size.columns - 1] for line in lines]
+        if len(lines) + 2 >= size.lines:
+            # The frame and a prompt below it don't fit, so drawing them
+            # scrolls the screen and rows can't be addressed
+            self.previous = None
+            return _CLEAR_SCREEN + '\n'.join(lines) + '\n'
+
+        previous = self.previous
+        parts = []
+        if previous is None:
+            parts.append(_CLEAR_SCREEN)
+            previous = []
+        for row, line in enumerate(lines):
+            if row >= len(previous) or previous[row] != line:
+                parts.append(_MOVE.format(row + 1))
+                parts.append(line)
+                parts.append(_CLEAR_LINE)
+        # Clear the rest of an old, longer frame and anything written after
+        # it, and leave the cursor below the frame
+        parts.append(_MOVE.format(len(lines) + 1))
+        parts.append(_CLEAR_BELOW)
+        self.previous = lines
+        return ''.join(parts)
+
+    def draw(self, lines: List[str]) -> None:
+        """
+        Draw a frame, in one write.
+        :param lines: Lines of the frame.
+        """
+        self.stream.write(self.update(lines))
+        self.stream.flush()
+
+    def invalidate(self) -> None:
+        """Redraw the whole screen on the next frame."""
+        self.previous = None
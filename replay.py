@@ -0,0 +1,378 @@
+"""
+Append-only binary log of finished matches, for viewers and balance
+analysis.
+
+A log starts with a header:
+    magic (4 bytes) | format version (2 bytes) | card set digest (32 bytes)
+followed by one record per game:
+    record length (4 bytes) | number of turns (4 bytes)
+    | winner seat (1 byte; 0xff for none) | checkpoint interval (2 bytes)
+    | number of checkpoints (4 bytes) | dealer seed (16 bytes)
+    | checkpoints | turns
+Checkpoint i is the full state after i * interval turns, so it doubles as
+an index into the turns:
+    offset of the next turn in the record (4 bytes)
+    | both players' stocks, in resource_order (4 bytes each)
+    | both players' hands (card IDs, 2 bytes each)
+Checkpoint 0 is the starting state. Each turn is
+    type (1 byte; TURN_CARD or TURN_DISCARD) | number of cards (1 byte)
+    | for each card: hand slot (1 byte) | card ID (2 bytes)
+      | ID of the card dealt into the slot (2 bytes)
+All integers are big-endian. Games are recorded in memory and appended in
+one write when they end, so readers never see a partial game.
+
+Readers memory-map the log: going to turn N of a game reads one checkpoint
+and at most interval - 1 turns, and scanning games only reads their
+headers.
+"""
+
+import mmap
+import struct
+import threading
+from array import array
+from typing import List
+from card_registry import *
+from game import *
+from turn_codec import *
+
+# Version of the replay format; bump when it changes
+REPLAY_VERSION = 1
+
+REPLAY_MAGIC = b'CWRL'
+
+# Turns between checkpoints
+DEFAULT_CHECKPOINT_INTERVAL = 16
+
+_HEADER = struct.Struct('>4sH32s')
+_GAME = struct.Struct('>IIBHI16s')
+_CHECKPOINT = struct.Struct('>I{}i{}H'.format(2 * len(resource_order),
+                                              2 * HAND_SIZE))
+_TURN_HEADER = struct.Struct('>BB')
+_TURN_CARD = struct.Struct('>BHH')
+_NO_WINNER = 0xff
+
+
+class ReplayError(RuntimeError):
+    """Exception for a malformed or incompatible replay log."""
+    pass
+
+
+class ReplayTurn:
+    """A turn read from a replay log."""
+    __slots__ = ('seat', 'turn_type', 'slots', 'card_ids', 'drawn_ids')
+
+    def __init__(self, seat: int, turn_type: int, slots: List[int],
+                 card_ids: List[int], drawn_ids: List[int]):
+        """
+        :param seat: Seat of the player who did the turn.
+        :param turn_type: TURN_CARD or TURN_DISCARD.
+        :param slots: Hand slots of the played or discarded cards.
+        :param card_ids: IDs of the played or discarded cards.
+        :param drawn_ids: IDs of the cards dealt into those slots.
+        """
+        self.seat = seat
+        self.turn_type = turn_type
+        self.slots = slots
+        self.card_ids = card_ids
+        self.drawn_ids = drawn_ids
+
+    def player_turn(self, registry: CardRegistry) -> PlayerTurn:
+        """
+        :param registry: Registry of the log's card set.
+        :return: The turn as a CardTurn or DiscardTurn.
+        """
+        if self.turn_type == TURN_CARD:
+            return CardTurn(registry[self.card_ids[0]])
+        return DiscardTurn([registry[card_id] for card_id in self.card_ids])
+
+
+class GameRecorder:
+    """
+    Records the turns of a match. Attach it as the match's recorder before
+    the first turn, then write it to a ReplayWriter when the match ends.
+    """
+
+    def __init__(self, match, seed: int = None,
+                 interval: int = DEFAULT_CHECKPOINT_INTERVAL):
+        """
+        :param match: Match in its starting state.
+        :param seed: Optional integer seed (below 2 ** 128) that recreates
+            the match's dealer.
+        :param interval: Turns between checkpoints.
+        """
+        self.seed = seed
+        self.interval = interval
+        self.num_turns = 0
+        self.checkpoints = []
+        # Encoded turns
+        self.turns = []
+        self._turns_size = 0
+        self._checkpoint(match)
+
+    def _checkpoint(self, match) -> None:
+        """Record the match's current state."""
+        self.checkpoints.append(
+            [self._turns_size] + match.players[0].stocks.tolist() +
+            match.players[1].stocks.tolist() +
+            [card.id for card in match.hands[0]] +
+            [card.id for card in match.hands[1]])
+
+    def add_turn(self, match, turn_type: int, slots: List[int],
+                 card_ids: List[int], drawn_ids: List[int]) -> None:
+        """
+        Record a turn. Called by the match after the turn has ended.
+        :param match: The match.
+        :param turn_type: TURN_CARD or TURN_DISCARD.
+        :param slots: Hand slots of the played or discarded cards.
+        :param card_ids: IDs of the played or discarded cards.
+        :param drawn_ids: IDs of the cards dealt into those slots.
+        """
+        data = _TURN_HEADER.pack(turn_type, len(slots)) + b''.join(
+            _TURN_CARD.pack(*card) for card in zip(slots, card_ids,
+                                                    drawn_ids))
+        self.turns.append(data)
+        self._turns_size += len(data)
+        self.num_turns += 1
+        if self.num_turns % self.interval == 0:
+            self._checkpoint(match)
+
+    def encode(self, winner: int = None) -> bytes:
+        """
+        :param winner: Seat of the winner, or None if nobody won.
+        :return: The game record.
+        """
+        turns_offset = _GAME.size + len(self.checkpoints) * _CHECKPOINT.size
+        parts = [None]
+        for checkpoint in self.checkpoints:
+            parts.append(_CHECKPOINT.pack(turns_offset + checkpoint[0],
+                                          *checkpoint[1:]))
+        parts.extend(self.turns)
+        seed = (self.seed or 0).to_bytes(16, 'big')
+        parts[0] = _GAME.pack(turns_offset + self._turns_size,
+                              self.num_turns,
+                              _NO_WINNER if winner is None else winner,
+                              self.interval, len(self.checkpoints), seed)
+        return b''.join(parts)
+
+
+class ReplayWriter:
+    """Appends games to a replay log. Games may be written from several
+    threads."""
+
+    def __init__(self, filename: str, registry: CardRegistry):
+        """
+        Open a log, creating it if needed.
+        :param filename: Log file.
+        :param registry: Registry of the card set the games use.
+        :raises: ReplayError if the log exists and is for another card set.
+        """
+        # Unbuffered, so each game is appended with one write (unless the
+        # write is cut short)
+        self.file = open(filename, 'ab', buffering=0)
+        if self.file.tell() == 0:
+            self._write(_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION,
+                                     registry.digest))
+        else:
+            with open(filename, 'rb') as f:
+                _check_header(f.read(_HEADER.size), registry.digest)
+        # Held while a game is written, so games from different threads
+        # don't interleave if a write is cut short
+        self._lock = threading.Lock()
+
+    def write_game(self, recorder: GameRecorder, winner: int = None) -> None:
+        """
+        Append a game.
+        :param recorder: Recorder of the game.
+        :param winner: Seat of the winner, or None if nobody won.
+        """
+        data = recorder.encode(winner)
+        with self._lock:
+            self._write(data)
+
+    def _write(self, data: bytes) -> None:
+        """Write all of data, even if the file takes it in parts."""
+        view = memoryview(data)
+        while view:
+            view = view[self.file.write(view):]
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _check_header(data: bytes, digest: bytes = None) -> bytes:
+    """
+    Check a log header.
+    :param data: Data starting with the header.
+    :param digest: Optional card set digest the log must have.
+    :return: The log's card set digest.
+    :raises: ReplayError if the header is bad or doesn't match.
+    """
+    if len(data) < _HEADER.size:
+        raise ReplayError('Bad replay log header')
+    magic, version, log_digest = _HEADER.unpack_from(data)
+    if magic != REPLAY_MAGIC:
+        raise ReplayError('Not a replay log')
+    if version != REPLAY_VERSION:
+        raise ReplayError('Replay log has version {}, we use {}'.format(
+            version, REPLAY_VERSION))
+    if digest is not None and log_digest != digest:
+        raise ReplayError('Replay log is for a different card set')
+    return log_digest
+
+
+class ReplayGame:
+    """A game in a memory-mapped replay log; parsed lazily."""
+
+    def __init__(self, log: 'ReplayLog', offset: int):
+        """
+        :param log: The log.
+        :param offset: Offset of the game record in the log.
+        """
+        self.log = log
+        self.offset = offset
+        self.length, self.num_turns, winner, self.interval, \
+            self.num_checkpoints, seed = _GAME.unpack_from(log.data, offset)
+        # Seat of the winner, or None if nobody won
+        self.winner = None if winner == _NO_WINNER else winner
+        # Integer dealer seed, or None if unknown
+        self.seed = int.from_bytes(seed, 'big') or None
+
+    def checkpoint(self, index: int):
+        """
+        :param index: Checkpoint index.
+        :return: (turn offset in the log, players, hands as lists of card
+            IDs) at turn index * interval.
+        """
+        values = _CHECKPOINT.unpack_from(
+            self.log.data, self.offset + _GAME.size + index * _CHECKPOINT.size)
+        num_resources = len(resource_order)
+        players = []
+        for seat in range(2):
+            players.append(Player.from_stocks(
+                values[1 + seat * num_resources:
+                       1 + (seat + 1) * num_resources]))
+        hands_start = 1 + 2 * num_resources
+        hands = [list(values[hands_start:hands_start + HAND_SIZE]),
+                 list(values[hands_start + HAND_SIZE:])]
+        return self.offset + values[0], players, hands
+
+    def turns(self, start: int = 0):
+        """
+        Iterate over turns.
+        :param start: Number of the first turn.
+        :return: Iterator of ReplayTurns.
+        """
+        turn_number = start - start % self.interval
+        offset = self.checkpoint(turn_number // self.interval)[0]
+        for turn in self._turns_from(offset, turn_number):
+            if turn_number >= start:
+                yield turn
+            turn_number += 1
+
+    def _turns_from(self, offset: int, turn_number: int):
+        """
+        :param offset: Offset of a turn in the log.
+        :param turn_number: Number of that turn.
+        :return: Iterator of ReplayTurns from that turn to the end.
+        """
+        data = self.log.data
+        end = self.offset + self.length
+        while offset < end:
+            turn_type, count = _TURN_HEADER.unpack_from(data, offset)
+            offset += _TURN_HEADER.size
+            slots = []
+            card_ids = []
+            drawn_ids = []
+            for i in range(count):
+                slot, card_id, drawn_id = _TURN_CARD.unpack_from(data, offset)
+                offset += _TURN_CARD.size
+                slots.append(slot)
+                card_ids.append(card_id)
+                drawn_ids.append(drawn_id)
+            yield ReplayTurn(turn_number % 2, turn_type, slots, card_ids,
+                             drawn_ids)
+            turn_number += 1
+
+    def state_at(self, turn_number: int):
+        """
+        Get the state after some turns, starting from the nearest
+        checkpoint.
+        :param turn_number: Number of turns played, at most num_turns.
+        :return: (players, hands as lists of card IDs); seat
+            turn_number % 2 is to move.
+        """
+        if not 0 <= turn_number <= self.num_turns:
+            raise IndexError('Game has {} turns'.format(self.num_turns))
+        index = turn_number // self.interval
+        offset, players, hands = self.checkpoint(index)
+        turn = index * self.interval
+        cards = self.log.registry.cards if self.log.registry else None
+        for replay_turn in self._turns_from(offset, turn):
+            if turn == turn_number:
+                break
+            seat = replay_turn.seat
+            if replay_turn.turn_type == TURN_CARD:
+                if cards is None:
+                    raise ReplayError('Need the card set to replay turns')
+                cards[replay_turn.card_ids[0]]._play(players[seat],
+                                                     players[1 - seat])
+            hand = hands[seat]
+            for slot, drawn_id in zip(replay_turn.slots,
+                                      replay_turn.drawn_ids):
+                hand[slot] = drawn_id
+            grow_resources(players[1 - seat])
+            turn += 1
+        return players, hands
+
+
+class ReplayLog:
+    """A memory-mapped replay log, read-only."""
+
+    def __init__(self, filename: str, registry: CardRegistry = None):
+        """
+        :param filename: Log file.
+        :param registry: Registry of the log's card set; needed to replay
+            turns between checkpoints.
+        :raises: ReplayError if the log is bad or for another card set.
+        """
+        self.registry = registry
+        with open(filename, 'rb') as f:
+            try:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ReplayError('Empty replay log')
+        self.digest = _check_header(
+            self.data, registry.digest if registry else None)
+        self._offsets = None
+
+    def offsets(self) -> array:
+        """
+        :return: Offsets of the games; found once by skipping from header
+            to header.
+        """
+        if self._offsets is None:
+            offsets = array('Q')
+            data = self.data
+            offset = _HEADER.size
+            # Ignore a trailing partial game, e.g. from a crashed writer
+            while offset + _GAME.size <= len(data):
+                length = _GAME.unpack_from(data, offset)[0]
+                if offset + length > len(data):
+                    break
+                offsets.append(offset)
+                offset += length
+            self._offsets = offsets
+        return self._offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets())
+
+    def __getitem__(self, index: int) -> ReplayGame:
+        return ReplayGame(self, self.offsets()[index])
+
+    def __iter__(self):
+        for offset in self.offsets():
+            yield ReplayGame(self, offset)
+
+    def close(self) -> None:
+        self.data.close()
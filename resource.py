@@ -9,3 +9,8 @@ resource_long = {
     'C': 'castle',
     'F': 'fence'
 }
+
+# Fixed order of resources, for array-based representations
+resource_order = ['B', 'b', 'S', 'w', 'M', 'c', 'C', 'F']
+# resource_index[res] = position of resource in resource_order
+resource_index = {res: i for i, res in enumerate(resource_order)}
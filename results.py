@@ -0,0 +1,304 @@
+"""
+Store of finished match results in a SQLite database, for balance analysis
+and player ratings.
+
+Results are buffered in memory and written in batches, one transaction per
+batch, so a tournament finishing thousands of games per second doesn't
+wait for a disk sync per game. The database is in WAL mode, so readers
+don't block the writer, and several processes (e.g. tournament workers)
+can share it; their batches take turns.
+
+Tables:
+    matches     id, finished (Unix time), winner (seat; NULL for a draw),
+                turns, duration (seconds)
+    seats       match_id, seat, player, score (1 for a win, 0.5 for a
+                draw, else 0), final stocks (one column per resource,
+                named as in resource_long)
+    card_plays  match_id, seat, card (name), plays
+    ratings     player, rating (Elo), games
+
+    store = ResultStore('results.db')
+    store.add(['alice', 'bob'], 0, 31, match.players, plays, 412.5)
+    ...
+    store.close()
+"""
+
+import sqlite3
+import time
+from typing import Dict, List, Tuple
+from match import *
+
+# Results buffered before they are written
+RESULTS_BATCH_SIZE = 1000
+
+# Seconds a result may wait in the buffer; see ResultStore.add
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+# Elo rating of a new player, and the most a rating changes per game
+INITIAL_RATING = 1500.0
+RATING_K = 32.0
+
+# Seconds to wait for another process's batch to finish
+_BUSY_TIMEOUT = 30.0
+
+_RESOURCE_COLUMNS = [resource_long[r] for r in resource_order]
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY,
+    finished REAL NOT NULL,
+    winner INTEGER,
+    turns INTEGER NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS seats (
+    match_id INTEGER NOT NULL REFERENCES matches (id),
+    seat INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    score REAL NOT NULL,
+    {},
+    PRIMARY KEY (match_id, seat)
+);
+CREATE INDEX IF NOT EXISTS seats_player ON seats (player, score);
+CREATE TABLE IF NOT EXISTS card_plays (
+    match_id INTEGER NOT NULL,
+    seat INTEGER NOT NULL,
+    card TEXT NOT NULL,
+    plays INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS card_plays_card
+    ON card_plays (card, match_id, seat, plays);
+CREATE TABLE IF NOT EXISTS ratings (
+    player TEXT PRIMARY KEY,
+    rating REAL NOT NULL,
+    games INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ratings_rating ON ratings (rating);
+'''.format(',\n    '.join('{} INTEGER NOT NULL'.format(column)
+                          for column in _RESOURCE_COLUMNS))
+
+_INSERT_SEAT = 'INSERT INTO seats VALUES (?, ?, ?, ?, {})'.format(
+    ', '.join('?' * len(_RESOURCE_COLUMNS)))
+
+_CARD_WIN_RATES = '''
+SELECT card, COUNT(*), AVG(score), SUM(plays)
+FROM card_plays JOIN seats USING (match_id, seat)
+{}
+GROUP BY card
+ORDER BY card
+'''
+
+
+class CardStats:
+    """Results of the seats that played a card."""
+    __slots__ = ('card', 'games', 'win_rate', 'plays')
+
+    def __init__(self, card: str, games: int, win_rate: float, plays: int):
+        """
+        :param card: Card name.
+        :param games: Number of seats that played it at least once.
+        :param win_rate: Their mean score, counting draws as half a win.
+        :param plays: Number of times it was played.
+        """
+        self.card = card
+        self.games = games
+        self.win_rate = win_rate
+        self.plays = plays
+
+
+class ResultStore:
+    """Buffered writer and reader of a results database."""
+
+    def __init__(self, filename: str, batch_size: int = RESULTS_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        """
+        Open a results database, creating it if it doesn't exist.
+        :param filename: Database file.
+        :param batch_size: Results buffered before they are written.
+        :param flush_interval: Seconds a result may wait in the buffer.
+        """
+        # Transactions are begun explicitly, one per batch. The connection
+        # may be used from another thread (e.g. flush in a worker thread),
+        # one thread at a time.
+        self.db = sqlite3.connect(filename, timeout=_BUSY_TIMEOUT,
+                                  isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        # A power loss may lose the last batches, but never corrupts the
+        # database
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(_SCHEMA)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Results not written yet, and when the oldest of them was added
+        self._pending = []
+        self._pending_since = 0.0
+
+    def add(self, players: List[str], winner, turns: int,
+            stocks: List[Player], plays: List[Dict[str, int]],
+            duration: float, flush: bool = True) -> None:
+        """
+        Buffer the result of a finished match. The buffer is written once it
+        holds batch_size results, or when a result is added after the oldest
+        has waited flush_interval seconds; see is_due().
+        :param players: Player names, in seat order.
+        :param winner: Seat of the winner, or None for a draw.
+        :param turns: Number of turns.
+        :param stocks: Final resources of both seats.
+        :param plays: For each seat, how many times they played each card,
+            by card name.
+        :param duration: Length of the match in seconds.
+        :param flush: False to leave writing the buffer to the caller, e.g.
+            to do it in another thread.
+        """
+        now = time.time()
+        if not self._pending:
+            self._pending_since = time.monotonic()
+        self._pending.append((now, list(players), winner, turns,
+                              [list(player.stocks) for player in stocks],
+                              plays, duration))
+        if flush and self.is_due():
+            self.flush()
+
+    def is_due(self) -> bool:
+        """
+        :return: True if the buffer holds batch_size results, or its oldest
+            has waited flush_interval seconds.
+        """
+        if not self._pending:
+            return False
+        return len(self._pending) >= self.batch_size or \
+            time.monotonic() - self._pending_since >= self.flush_interval
+
+    def add_match(self, match: Match, players: List[str],
+                  duration: float, flush: bool = True) -> None:
+        """
+        Buffer the result of a finished Match, or of one stopped as a draw;
+        see add().
+        :param match: The match.
+        :param players: Player names, in seat order.
+        :param duration: Length of the match in seconds.
+        :param flush: See add().
+        """
+        cards = match.dealer.cards
+        plays = [{cards[card_id].name: count
+                  for card_id, count in enumerate(counts) if count}
+                 for counts in match.plays]
+        self.add(players, match.winner(), match.num_turns, match.players,
+                 plays, duration, flush)
+
+    def flush(self) -> None:
+        """
+        Write the buffered results in one transaction. Results may be added
+        while it runs in another thread; they are left for the next flush.
+        """
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = []
+        db = self.db
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            # Other processes can't write until the commit, so the IDs are
+            # free
+            next_id, = db.execute(
+                'SELECT COALESCE(MAX(id), 0) + 1 FROM matches').fetchone()
+            matches = []
+            seats = []
+            card_plays = []
+            for match_id, (finished, players, winner, turns, stocks, plays,
+                           duration) in enumerate(pending, next_id):
+                matches.append((match_id, finished, winner, turns, duration))
+                for seat in range(2):
+                    seats.append((match_id, seat, players[seat],
+                                  _score(winner, seat), *stocks[seat]))
+                    card_plays.extend((match_id, seat, card, count)
+                                      for card, count in plays[seat].items())
+            db.executemany('INSERT INTO matches VALUES (?, ?, ?, ?, ?)',
+                           matches)
+            db.executemany(_INSERT_SEAT, seats)
+            db.executemany('INSERT INTO card_plays VALUES (?, ?, ?, ?)',
+                           card_plays)
+            self._update_ratings(pending)
+            db.execute('COMMIT')
+        except BaseException:
+            # Keep the results buffered, to retry with the next batch
+            self._pending = pending + self._pending
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            raise
+
+    def _update_ratings(self, pending: list) -> None:
+        """
+        Update the Elo ratings of the players of results, in order. A
+        player who played themselves, e.g. two clients on one host, isn't
+        rated for that match.
+        """
+        pending = [result for result in pending
+                   if result[1][0] != result[1][1]]
+        ratings = {}
+        for name in {name for result in pending for name in result[1]}:
+            row = self.db.execute(
+                'SELECT rating, games FROM ratings WHERE player = ?',
+                (name,)).fetchone()
+            ratings[name] = list(row) if row else [INITIAL_RATING, 0]
+        for finished, players, winner, *rest in pending:
+            first, second = ratings[players[0]], ratings[players[1]]
+            expected = 1 / (1 + 10 ** ((second[0] - first[0]) / 400))
+            change = RATING_K * (_score(winner, 0) - expected)
+            first[0] += change
+            second[0] -= change
+            first[1] += 1
+            second[1] += 1
+        self.db.executemany(
+            'INSERT OR REPLACE INTO ratings VALUES (?, ?, ?)',
+            [(name, rating, games)
+             for name, (rating, games) in ratings.items()])
+
+    def card_win_rates(self, card: str = None) -> List[CardStats]:
+        """
+        Write the buffer, then compute the win rate of each card's players.
+        :param card: Name of a card to compute only its win rate.
+        :return: CardStats of every card that was played, by name.
+        """
+        self.flush()
+        if card is None:
+            rows = self.db.execute(_CARD_WIN_RATES.format(''))
+        else:
+            rows = self.db.execute(_CARD_WIN_RATES.format('WHERE card = ?'),
+                                   (card,))
+        return [CardStats(*row) for row in rows]
+
+    def ratings(self, limit: int = None) -> List[Tuple[str, float, int]]:
+        """
+        Write the buffer, then list the players by rating.
+        :param limit: Optional number of players to list.
+        :return: (player, rating, games) of each player, best first.
+        """
+        self.flush()
+        return self.db.execute(
+            'SELECT player, rating, games FROM ratings ORDER BY rating DESC '
+            'LIMIT ?', (-1 if limit is None else limit,)).fetchall()
+
+    def player_stats(self, player: str):
+        """
+        Write the buffer, then summarize a player's results.
+        :return: (games, win rate counting draws as half a win); the win
+            rate is None if they have no games.
+        """
+        self.flush()
+        return self.db.execute(
+            'SELECT COUNT(*), AVG(score) FROM seats WHERE player = ?',
+            (player,)).fetchone()
+
+    def close(self) -> None:
+        """Write the buffer and close the database."""
+        self.flush()
+        self.db.close()
+
+
+def _score(winner, seat: int) -> float:
+    """:return: Score of a seat: 1 for a win, 0.5 for a draw, else 0."""
+    if winner is None:
+        return 0.5
+    return 1.0 if winner == seat else 0.0
@@ -0,0 +1,561 @@
+"""
+asyncio game server. Accepts any number of clients, pairs them through a
+matchmaking queue and runs each match as a coroutine. The server owns the
+authoritative Match and checks every move; clients only send moves and
+display the states they are sent.
+
+Spectators connect to a separate watch port and ask for a match by ID;
+every match publishes its snapshots through a Broadcast.
+
+With a checkpoint directory, every match is a Session checkpointed after
+every turn. If a client's connection drops, or the server is stopped with
+SIGTERM, the match is suspended instead of aborted: its clients reconnect
+and resume it from the checkpoint, on this server or another one sharing
+the directory.
+
+With a results database, the result of every finished match is added to it
+(see results.py); players are named by their host. Results are written in
+batches, in a worker thread.
+"""
+
+import asyncio
+import os
+import signal
+import sqlite3
+import sys
+import time
+import metrics
+import myprotocol
+import transport
+from broadcast import *
+from match import *
+from match_codec import *
+from replay import *
+from results import *
+from session import *
+
+# Seconds between metrics exports
+METRICS_INTERVAL = 10
+
+# Seconds a resumed match waits for both clients to reconnect
+RESUME_TIMEOUT = 60
+
+_BYTES_SENT = metrics.histogram(
+    'castlewars_server_bytes_sent', 'Size of messages sent to clients.',
+    metrics.SIZE_BUCKETS)
+_BYTES_RECEIVED = metrics.histogram(
+    'castlewars_server_bytes_received',
+    'Size of messages received from clients.', metrics.SIZE_BUCKETS)
+_MATCHES_STARTED = metrics.counter(
+    'castlewars_server_matches_started_total', 'Matches started.')
+_MATCHES_ABORTED = metrics.counter(
+    'castlewars_server_matches_aborted_total',
+    'Matches ended by a client leaving.')
+_MATCHES_SUSPENDED = metrics.counter(
+    'castlewars_server_matches_suspended_total',
+    'Matches suspended for their clients to resume.')
+_MATCHES_RESUMED = metrics.counter(
+    'castlewars_server_matches_resumed_total',
+    'Matches resumed from a checkpoint.')
+_GAME_TURNS = metrics.histogram(
+    'castlewars_server_game_turns', 'Number of turns of finished matches.',
+    metrics.TURN_BUCKETS)
+
+
+class ClientConnection:
+    """A connected client."""
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        # Name of the client in the results database
+        peer = writer.get_extra_info('peername')
+        self.name = peer[0] if isinstance(peer, tuple) else 'local'
+        # Set when the client's connection may be closed
+        self.done = asyncio.Event()
+
+    async def send(self, payload: bytes) -> None:
+        """Send a message to the client."""
+        if metrics.enabled:
+            _BYTES_SENT.observe(len(payload))
+        self.writer.write(myprotocol.frame_message(payload))
+        await self.writer.drain()
+
+    async def recv(self) -> bytes:
+        """Receive a message from the client."""
+        payload = await myprotocol.read_message(self.reader)
+        if metrics.enabled:
+            _BYTES_RECEIVED.observe(len(payload))
+        return payload
+
+    @property
+    def is_connected(self) -> bool:
+        return not self.writer.is_closing() and not self.reader.at_eof()
+
+
+class _Resume:
+    """A suspended session, waiting for its clients to reconnect."""
+
+    def __init__(self, session: Session):
+        self.session = session
+        # clients[seat] = client who reconnected to that seat, if any
+        self.clients = [None, None]
+        # Task that gives up after RESUME_TIMEOUT
+        self.timeout = None
+
+
+class GameServer:
+    def __init__(self, dealer: CardDealer, metrics_file: str = None,
+                 replay_file: str = None, checkpoint_dir: str = None,
+                 results_file: str = None):
+        """
+        :param dealer: Card dealer. Each match gets a dealer spawned from it.
+        :param metrics_file: Optional file to export metrics to
+            periodically; see metrics.export.
+        :param replay_file: Optional replay log to append every match to.
+        :param checkpoint_dir: Optional directory to checkpoint matches in,
+            so they can be suspended and resumed.
+        :param results_file: Optional results database to add every
+            finished match to.
+        """
+        self.metrics_file = metrics_file
+        self.checkpoints = None
+        if checkpoint_dir:
+            self.checkpoints = CheckpointStore(checkpoint_dir)
+        self.replays = None
+        if replay_file:
+            self.replays = ReplayWriter(replay_file, dealer.registry)
+        self.results = None
+        if results_file:
+            self.results = ResultStore(results_file)
+        # Held while the results are written in a worker thread
+        self._flushing = asyncio.Lock()
+        self.dealer = dealer
+        self.registry = dealer.registry
+        # Clients waiting for an opponent
+        self.waiting = asyncio.Queue()
+        # Running match tasks
+        self.matches = set()
+        # broadcasts[match ID] = Broadcast of a running match
+        self.broadcasts = {}
+        self.next_match_id = 1
+        # Watchers of the latest match who are waiting for one to start
+        self.waiting_watchers = []
+        # sessions[session ID] = (clients in seat order, match task) of a
+        # running session
+        self.sessions = {}
+        # resumes[session ID] = _Resume of a session waiting for its clients
+        self.resumes = {}
+        # Set to stop serving, once matches are suspended
+        self.stopped = asyncio.Event()
+
+    async def serve(self, host: str, port: int, watch_port: int = None) \
+            -> None:
+        """
+        Accept clients and run matches forever.
+        :param host: Host to bind to; '' for all interfaces.
+        :param port: Port to listen on.
+        :param watch_port: Optional port to accept spectators on.
+        """
+        server = await asyncio.start_server(self._handle_client, host, port)
+        tasks = [server.serve_forever(), self._matchmaker()]
+        if watch_port is not None:
+            watch_server = await asyncio.start_server(self._handle_watcher,
+                                                      host, watch_port)
+            tasks.append(watch_server.serve_forever())
+        if self.metrics_file:
+            metrics.enabled = True
+            tasks.append(self._export_metrics())
+        if self.results is not None:
+            tasks.append(self._flush_results_periodically())
+        if self.checkpoints is not None:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, lambda: asyncio.create_task(self.drain()))
+        async with server:
+            serving = asyncio.gather(*tasks)
+            stopped = asyncio.create_task(self.stopped.wait())
+            await asyncio.wait([serving, stopped],
+                               return_when=asyncio.FIRST_COMPLETED)
+            serving.cancel()
+            try:
+                await serving
+            except asyncio.CancelledError:
+                pass
+
+    async def drain(self) -> None:
+        """
+        Suspend every running match, so its clients resume it elsewhere, and
+        stop serving. Checkpoints are already up to date.
+        """
+        for clients, task in list(self.sessions.values()):
+            for client in clients:
+                await _suspend(client)
+        self.stopped.set()
+
+    async def _export_metrics(self) -> None:
+        """Export metrics every METRICS_INTERVAL seconds."""
+        while True:
+            await asyncio.sleep(METRICS_INTERVAL)
+            metrics.export(self.metrics_file)
+
+    async def _flush_results_periodically(self) -> None:
+        """Write buffered results once they are due."""
+        while True:
+            await asyncio.sleep(self.results.flush_interval)
+            if self.results.is_due():
+                await self._flush_results()
+
+    async def _flush_results(self) -> None:
+        """
+        Write the buffered results in a worker thread, so the database
+        doesn't hold up the event loop. If that fails, the results stay
+        buffered for the next try.
+        """
+        async with self._flushing:
+            try:
+                await asyncio.to_thread(self.results.flush)
+            except (sqlite3.Error, OSError) as e:
+                print('Could not write results: {}'.format(e),
+                      file=sys.stderr)
+
+    async def _handle_client(self, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter) -> None:
+        """Do the handshake with a new client and queue them for a match."""
+        # Keepalive notices clients whose machine went away mid-match
+        transport.tune_tcp(writer.get_extra_info('socket'))
+        client = ClientConnection(reader, writer)
+        try:
+            check_handshake(await client.recv(), self.registry)
+            await client.send(encode_handshake(self.registry))
+            token = decode_join(await client.recv())
+        except (ProtocolError, asyncio.IncompleteReadError,
+                ConnectionError):
+            writer.close()
+            return
+
+        if token is None:
+            await self.waiting.put(client)
+        elif not await self._resume(client, token):
+            writer.close()
+            return
+        await client.done.wait()
+        writer.close()
+
+    async def _resume(self, client: ClientConnection, token: bytes) -> bool:
+        """
+        Attach a client to the suspended session of its token, and resume
+        the match once both clients are back.
+        :return: False if there is no such session; the client is sent an
+            abort message.
+        """
+        session_id, secret = split_token(token)
+        if session_id in self.sessions:
+            # This server hasn't noticed the client's old connection drop
+            # yet; suspend the match, and resume it from its checkpoint
+            clients, task = self.sessions[session_id]
+            for old_client in clients:
+                await _suspend(old_client)
+            await asyncio.wait([task])
+        resume = self.resumes.get(session_id)
+        if resume is None and self.checkpoints is not None:
+            try:
+                session = self.checkpoints.load(session_id,
+                                                self.dealer.spawn(1)[0])
+            except SnapshotError:
+                session = None
+            if session is not None:
+                resume = self.resumes[session_id] = _Resume(session)
+                resume.timeout = asyncio.create_task(
+                    self._expire_resume(resume))
+        seat = resume.session.seat_of(secret) if resume else None
+        if seat is None:
+            try:
+                await client.send(encode_abort())
+            except ConnectionError:
+                pass
+            return False
+
+        if resume.clients[seat] is not None:
+            # Reconnected again; keep the newest connection
+            resume.clients[seat].done.set()
+        resume.clients[seat] = client
+        if None not in resume.clients:
+            del self.resumes[session_id]
+            resume.timeout.cancel()
+            if metrics.enabled:
+                _MATCHES_RESUMED.inc()
+            self._start_match(resume.clients, resume.session)
+        return True
+
+    async def _expire_resume(self, resume: _Resume) -> None:
+        """
+        Give up on a suspended session if both clients don't reconnect
+        within RESUME_TIMEOUT.
+        """
+        await asyncio.sleep(RESUME_TIMEOUT)
+        del self.resumes[resume.session.id]
+        for client in resume.clients:
+            if client is not None:
+                if client.is_connected:
+                    try:
+                        await client.send(encode_abort())
+                    except ConnectionError:
+                        pass
+                client.done.set()
+
+    async def _handle_watcher(self, reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter) -> None:
+        """
+        Do the handshake with a new spectator and send them snapshots of
+        the match they ask for until it ends.
+        """
+        client = ClientConnection(reader, writer)
+        try:
+            check_handshake(await client.recv(), self.registry)
+            await client.send(encode_handshake(self.registry))
+            match_id = decode_watch(await client.recv())
+        except (ProtocolError, asyncio.IncompleteReadError,
+                ConnectionError):
+            writer.close()
+            return
+
+        watcher = Watcher(writer)
+        if match_id == 0:
+            if self.broadcasts:
+                self.broadcasts[max(self.broadcasts)].add(watcher)
+            else:
+                self.waiting_watchers.append(watcher)
+        elif match_id in self.broadcasts:
+            self.broadcasts[match_id].add(watcher)
+        else:
+            # No such match, or it's over
+            watcher.push(myprotocol.frame_message(encode_abort()))
+            watcher.close()
+        # A spectator sends nothing more, so the end of their stream means
+        # they left; without this, one waiting for a match would never go
+        left = asyncio.create_task(_wait_eof(reader))
+        left.add_done_callback(lambda task: watcher.close())
+        try:
+            await watcher.run()
+        finally:
+            left.cancel()
+            if watcher in self.waiting_watchers:
+                self.waiting_watchers.remove(watcher)
+
+    async def _matchmaker(self) -> None:
+        """Pair waiting clients and start a match for each pair."""
+        while True:
+            first = await self.waiting.get()
+            while not first.is_connected:
+                first.done.set()
+                first = await self.waiting.get()
+            second = await self.waiting.get()
+            if not first.is_connected:
+                # Wait for another opponent for the second client
+                first.done.set()
+                await self.waiting.put(second)
+                continue
+
+            self._start_match([first, second])
+
+    def _start_match(self, clients: List[ClientConnection],
+                     session: Session = None) -> None:
+        """Run a match in a new task; see _run_match."""
+        task = asyncio.create_task(self._run_match(clients, session))
+        self.matches.add(task)
+        task.add_done_callback(self.matches.discard)
+
+    async def _run_match(self, clients: List[ClientConnection],
+                         session: Session = None) -> None:
+        """
+        Run a match until someone wins or leaves. If matches are
+        checkpointed, a client leaving suspends the match instead.
+        :param clients: Clients in seat order.
+        :param session: Session to resume, or None to start a new match.
+        """
+        start = time.monotonic()
+        if session is not None:
+            match = session.match
+            # Count the time it ran before it was suspended
+            start -= session.elapsed
+        else:
+            dealer = self.dealer.spawn(1)[0]
+            seed = None
+            if self.replays is not None:
+                # Reseed with an integer, so the replay can recreate the
+                # dealer
+                seed = int(dealer.rng.integers(2 ** 63))
+                dealer.seed(seed)
+            match = Match(dealer)
+            if self.replays is not None:
+                match.recorder = GameRecorder(match, seed)
+            if metrics.enabled:
+                _MATCHES_STARTED.inc()
+            if self.checkpoints is not None:
+                session = Session(match)
+
+        broadcast = Broadcast(self.next_match_id)
+        self.next_match_id += 1
+        self.broadcasts[broadcast.match_id] = broadcast
+        for watcher in self.waiting_watchers:
+            broadcast.add(watcher)
+        self.waiting_watchers.clear()
+
+        if session is not None:
+            self.sessions[session.id] = (clients, asyncio.current_task())
+            await self._save_checkpoint(session, start)
+        try:
+            if session is not None and match.num_turns == 0:
+                await asyncio.gather(*[
+                    client.send(encode_session(session.token(seat)))
+                    for seat, client in enumerate(clients)])
+            await self._send_states(match, clients, broadcast, None)
+            while match.winner() is None:
+                seat = match.current
+                turn = await self._recv_move(match, clients[seat])
+                if session is not None:
+                    await self._save_checkpoint(session, start)
+                await self._send_states(match, clients, broadcast, turn,
+                                        seat)
+            if metrics.enabled:
+                _GAME_TURNS.observe(match.num_turns)
+            if self.results is not None:
+                self.results.add_match(match, [client.name
+                                               for client in clients],
+                                       time.monotonic() - start, False)
+                if self.results.is_due():
+                    await self._flush_results()
+            if session is not None:
+                await asyncio.to_thread(self.checkpoints.delete, session.id)
+        except (ProtocolError, asyncio.IncompleteReadError,
+                ConnectionError):
+            broadcast.publish(encode_abort())
+            if session is not None and match.winner() is None:
+                # The clients resume from the last checkpoint
+                if metrics.enabled:
+                    _MATCHES_SUSPENDED.inc()
+                for client in clients:
+                    await _suspend(client)
+            else:
+                if metrics.enabled:
+                    _MATCHES_ABORTED.inc()
+                for client in clients:
+                    if client.is_connected:
+                        try:
+                            await client.send(encode_abort())
+                        except ConnectionError:
+                            pass
+        finally:
+            if session is not None:
+                self.sessions.pop(session.id, None)
+            del self.broadcasts[broadcast.match_id]
+            broadcast.close()
+            for client in clients:
+                client.done.set()
+            # Last, so the cleanup above is done even if this is cancelled
+            if match.recorder is not None:
+                await asyncio.to_thread(self.replays.write_game,
+                                        match.recorder, match.winner())
+
+    async def _save_checkpoint(self, session: Session, start: float) -> None:
+        """
+        Checkpoint a session. It is encoded right away, and written in a
+        worker thread so the file I/O doesn't hold up the event loop.
+        :param session: Session.
+        :param start: time.monotonic() when its match started.
+        """
+        session.elapsed = time.monotonic() - start
+        await asyncio.to_thread(self.checkpoints.write, session.id,
+                                session.encode())
+
+    async def _recv_move(self, match: Match,
+                         client: ClientConnection) -> PlayerTurn:
+        """
+        Receive moves from the current player until they make a legal one,
+        and do it.
+        :return: The turn.
+        """
+        while True:
+            move_type, slots = decode_move(await client.recv())
+            try:
+                if move_type == MSG_PLAY:
+                    return match.play(slots)
+                else:
+                    return match.discard(slots)
+            except IllegalMove as e:
+                await client.send(encode_reject(str(e)))
+
+    async def _send_states(self, match: Match,
+                           clients: List[ClientConnection],
+                           broadcast: Broadcast, last_turn: PlayerTurn,
+                           last_seat: int = None) -> None:
+        """
+        Send the match state to both clients, and a snapshot to the
+        spectators.
+        :param last_turn: The last turn, if there was one.
+        :param last_seat: Seat of the player who did the last turn.
+        """
+        winner = match.winner()
+        broadcast.publish(encode_snapshot(
+            broadcast.match_id, winner, last_seat, match.num_turns,
+            match.players, last_turn))
+        messages = []
+        for seat in range(len(clients)):
+            flags = 0
+            if winner is None and match.current == seat:
+                flags |= FLAG_YOUR_TURN
+            if last_seat == seat:
+                flags |= FLAG_LAST_BY_YOU
+            if winner is not None:
+                flags |= FLAG_GAME_OVER
+                if winner == seat:
+                    flags |= FLAG_YOU_WON
+            messages.append(encode_state(
+                flags, match.num_turns, match.players[seat],
+                match.players[1 - seat], match.hands[seat], last_turn))
+        await asyncio.gather(*[client.send(message) for client, message
+                               in zip(clients, messages)])
+
+
+async def _suspend(client: ClientConnection) -> None:
+    """Tell a client its match is suspended, and disconnect them."""
+    if client.is_connected:
+        try:
+            await client.send(encode_suspend())
+        except ConnectionError:
+            pass
+    client.writer.close()
+
+
+async def _wait_eof(reader: asyncio.StreamReader) -> None:
+    """Read and drop data until the end of a stream."""
+    try:
+        while await reader.read(4096):
+            pass
+    except ConnectionError:
+        pass
+
+
+def run_server(port: int, dealer: CardDealer, watch_port: int = None) \
+        -> None:
+    """
+    Run a game server until interrupted.
+    :param port: Port to listen on.
+    :param dealer: Card dealer.
+    :param watch_port: Optional port to accept spectators on.
+    """
+    print('Serving matches on port {}...'.format(port))
+    if watch_port is not None:
+        print('Spectators can watch on port {}.'.format(watch_port))
+    server = GameServer(dealer, os.environ.get('CASTLEWARS_METRICS'),
+                        os.environ.get('CASTLEWARS_REPLAYS'),
+                        os.environ.get('CASTLEWARS_CHECKPOINTS'),
+                        os.environ.get('CASTLEWARS_RESULTS'))
+    try:
+        asyncio.run(server.serve('', port, watch_port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server.results is not None:
+            server.results.close()
@@ -0,0 +1,259 @@
+"""
+Checkpoints of server matches, so a match can be suspended on one server
+and resumed on another.
+
+A match snapshot is a compact binary encoding of a Match:
+    magic (4 bytes) | version (2 bytes) | card set digest (32 bytes)
+    | seat to move (1 byte) | number of turns (4 bytes)
+    | stocks of seat 0, then seat 1 (4 bytes each, in resource_order)
+    | hand of seat 0, then seat 1 (2-byte card IDs)
+    | dealer generator state, then its state before its buffer was filled
+      (state, increment: 16 bytes each | has_uint32 (1 byte)
+      | uinteger (4 bytes))
+    | cards left in the dealer's buffer (2 bytes)
+    | plays of seat 0, then seat 1 (4 bytes per card, in card ID order)
+All integers are big-endian.
+
+A session is a match with a secret for each seat. Each client gets a
+session token: the session ID and their seat's secret. A checkpoint file
+holds the session ID, both secrets, the seconds the match had run (an
+8-byte float) and the snapshot. Servers that share a
+checkpoint directory can resume each other's matches; both clients must
+reconnect to the same server, e.g. through a load balancer that routes by
+session ID.
+"""
+
+import os
+import secrets
+import struct
+import time
+from match import *
+
+SNAPSHOT_VERSION = 2
+SNAPSHOT_MAGIC = b'CWMS'
+
+SESSION_ID_SIZE = 16
+SECRET_SIZE = 16
+TOKEN_SIZE = SESSION_ID_SIZE + SECRET_SIZE
+
+# Seconds a checkpoint stays resumable after it was last saved
+CHECKPOINT_EXPIRY = 300
+
+_NUM_RESOURCES = len(resource_order)
+_HEADER = struct.Struct('>4sH32s')
+_MATCH = struct.Struct('>BI{}i{}H'.format(2 * _NUM_RESOURCES,
+                                          2 * HAND_SIZE))
+_RNG = struct.Struct('>16s16sBI')
+_BUFFERED = struct.Struct('>H')
+_SESSION = struct.Struct('>{}s{}s{}sd'.format(SESSION_ID_SIZE, SECRET_SIZE,
+                                              SECRET_SIZE))
+
+
+class SnapshotError(RuntimeError):
+    """Exception for a malformed or incompatible snapshot."""
+    pass
+
+
+def encode_match(match: Match) -> bytes:
+    """
+    :param match: Match. Its dealer's cards must come from a registry.
+    :return: Snapshot of the match.
+    """
+    rng_state, buffer_state, buffered = match.dealer.get_state()
+    return b''.join([
+        _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                     match.dealer.registry.digest),
+        _MATCH.pack(match.current, match.num_turns,
+                    *match.players[0].stocks, *match.players[1].stocks,
+                    *[card.id for card in match.hands[0]],
+                    *[card.id for card in match.hands[1]]),
+        _encode_rng(rng_state), _encode_rng(buffer_state),
+        _BUFFERED.pack(buffered),
+        _plays_struct(match.dealer.registry).pack(*match.plays[0],
+                                                  *match.plays[1])])
+
+
+def decode_match(data: bytes, dealer: CardDealer) -> Match:
+    """
+    :param data: Snapshot of a match.
+    :param dealer: Card dealer for the match, with the same cards. Its
+        state is replaced by the snapshot's.
+    :return: The match, continuing where the snapshot was taken.
+    :raises: SnapshotError if the snapshot is malformed, of another version
+        or of another card set.
+    """
+    try:
+        magic, version, digest = _HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            raise SnapshotError('Not a match snapshot')
+        if version != SNAPSHOT_VERSION:
+            raise SnapshotError('Unsupported snapshot version {}'.format(
+                version))
+        if digest != dealer.registry.digest:
+            raise SnapshotError('Snapshot of a different card set')
+        offset = _HEADER.size
+        fields = _MATCH.unpack_from(data, offset)
+        offset += _MATCH.size
+        rng_state = _decode_rng(data, offset)
+        buffer_state = _decode_rng(data, offset + _RNG.size)
+        offset += 2 * _RNG.size
+        buffered, = _BUFFERED.unpack_from(data, offset)
+        offset += _BUFFERED.size
+        plays = _plays_struct(dealer.registry).unpack_from(data, offset)
+        hand_ids = fields[2 + 2 * _NUM_RESOURCES:]
+        hands = [[dealer.registry[card_id] for card_id in ids]
+                 for ids in (hand_ids[:HAND_SIZE], hand_ids[HAND_SIZE:])]
+    except (struct.error, IndexError) as e:
+        raise SnapshotError('Bad snapshot: {}'.format(e))
+
+    match = Match(dealer)
+    dealer.set_state((rng_state, buffer_state, buffered))
+    match.current, match.num_turns = fields[:2]
+    stocks = fields[2:2 + 2 * _NUM_RESOURCES]
+    match.players = [Player.from_stocks(stocks[:_NUM_RESOURCES]),
+                     Player.from_stocks(stocks[_NUM_RESOURCES:])]
+    match.hands = hands
+    num_cards = len(dealer.cards)
+    match.plays = [list(plays[:num_cards]), list(plays[num_cards:])]
+    return match
+
+
+def _plays_struct(registry: CardRegistry) -> struct.Struct:
+    """:return: Struct of both seats' play counts of a card set."""
+    return struct.Struct('>{}I'.format(2 * len(registry)))
+
+
+def _encode_rng(state: dict) -> bytes:
+    """:return: Encoding of a PCG64 state dictionary."""
+    return _RNG.pack(state['state']['state'].to_bytes(16, 'big'),
+                     state['state']['inc'].to_bytes(16, 'big'),
+                     state['has_uint32'], state['uinteger'])
+
+
+def _decode_rng(data: bytes, offset: int) -> dict:
+    """:return: PCG64 state dictionary encoded at an offset of data."""
+    state, inc, has_uint32, uinteger = _RNG.unpack_from(data, offset)
+    return {'bit_generator': 'PCG64',
+            'state': {'state': int.from_bytes(state, 'big'),
+                      'inc': int.from_bytes(inc, 'big')},
+            'has_uint32': has_uint32, 'uinteger': uinteger}
+
+
+def split_token(token: bytes):
+    """
+    :param token: Session token.
+    :return: (session ID, secret).
+    """
+    return token[:SESSION_ID_SIZE], token[SESSION_ID_SIZE:]
+
+
+class Session:
+    """A server match that can be resumed by its clients."""
+
+    def __init__(self, match: Match, session_id: bytes = None,
+                 seat_secrets: List[bytes] = None, elapsed: float = 0.0):
+        """
+        :param match: Match.
+        :param session_id: Session ID; random by default.
+        :param seat_secrets: Secret of each seat; random by default.
+        :param elapsed: Seconds the match has run, on any server.
+        """
+        self.match = match
+        self.id = session_id or secrets.token_bytes(SESSION_ID_SIZE)
+        self.secrets = seat_secrets or [secrets.token_bytes(SECRET_SIZE)
+                                        for seat in range(2)]
+        # Updated by the server before each checkpoint, so a resumed match
+        # reports its whole duration
+        self.elapsed = elapsed
+
+    def token(self, seat: int) -> bytes:
+        """:return: Session token of a seat."""
+        return self.id + self.secrets[seat]
+
+    def seat_of(self, secret: bytes):
+        """
+        :param secret: Secret from a session token.
+        :return: Seat with that secret, or None if there is none.
+        """
+        for seat, seat_secret in enumerate(self.secrets):
+            if secrets.compare_digest(secret, seat_secret):
+                return seat
+        return None
+
+    def encode(self) -> bytes:
+        """:return: Checkpoint of the session."""
+        return _SESSION.pack(self.id, *self.secrets, self.elapsed) + \
+            encode_match(self.match)
+
+    @classmethod
+    def decode(cls, data: bytes, dealer: CardDealer) -> 'Session':
+        """
+        :param data: Checkpoint of a session.
+        :param dealer: Card dealer for the match; see decode_match.
+        :raises: SnapshotError if the checkpoint is malformed.
+        """
+        if len(data) < _SESSION.size:
+            raise SnapshotError('Bad checkpoint')
+        session_id, *seat_secrets, elapsed = _SESSION.unpack_from(data)
+        return cls(decode_match(data[_SESSION.size:], dealer), session_id,
+                   seat_secrets, elapsed)
+
+
+class CheckpointStore:
+    """Directory of session checkpoints, one file per session."""
+
+    def __init__(self, directory: str, expiry: float = CHECKPOINT_EXPIRY):
+        """
+        :param directory: Directory; created if it doesn't exist.
+        :param expiry: Seconds a checkpoint stays resumable after it was
+            last saved.
+        """
+        self.directory = directory
+        self.expiry = expiry
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, session: Session) -> None:
+        """
+        Checkpoint a session, replacing its last checkpoint atomically.
+        """
+        self.write(session.id, session.encode())
+
+    def write(self, session_id: bytes, data: bytes) -> None:
+        """
+        Same as save, with the session already encoded; e.g. to encode it
+        right away and write it in another thread.
+        :param session_id: Session ID.
+        :param data: Encoded session.
+        """
+        filename = self._filename(session_id)
+        with open(filename + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(filename + '.tmp', filename)
+
+    def load(self, session_id: bytes, dealer: CardDealer):
+        """
+        :param session_id: Session ID.
+        :param dealer: Card dealer for the match; see decode_match.
+        :return: The session, or None if it has no checkpoint or it
+            expired.
+        :raises: SnapshotError if the checkpoint is malformed.
+        """
+        filename = self._filename(session_id)
+        try:
+            if time.time() - os.path.getmtime(filename) > self.expiry:
+                return None
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        return Session.decode(data, dealer)
+
+    def delete(self, session_id: bytes) -> None:
+        """Delete the checkpoint of a session, if it has one."""
+        try:
+            os.remove(self._filename(session_id))
+        except FileNotFoundError:
+            pass
+
+    def _filename(self, session_id: bytes) -> str:
+        return os.path.join(self.directory, session_id.hex() + '.session')
@@ -0,0 +1,277 @@
+"""
+Tournament runner for agents. Every pair of agents plays a number of
+games, half with each agent moving first. Games are played in chunks by
+worker processes, and each chunk sends back running statistics rather than
+every result.
+
+    python tournament.py [-n GAMES] [-j WORKERS] [--seed SEED]
+        [--replays FILE] [--results FILE] AGENT...
+
+AGENT is a name from agents.AGENTS, e.g. random, greedy or mcts. With
+--replays, every game is appended to a replay log, and with --results, its
+result is added to a results database (see results.py).
+"""
+
+import argparse
+import itertools
+import math
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from mcts import *
+from replay import *
+from results import *
+
+# Number of games each worker task plays
+DEFAULT_CHUNK_SIZE = 250
+
+# Games that last this many turns are draws
+MAX_TURNS = 1000
+
+# Card dealer of a worker process; loaded once by _init_worker
+_dealer = None
+# Replay log of a worker process, if games are recorded
+_replays = None
+# Results database of a worker process, if results are stored
+_results = None
+
+
+class MatchupStats:
+    """Running statistics of games between two agents."""
+
+    def __init__(self):
+        self.games = 0
+        # Wins of the first and second agent
+        self.wins = [0, 0]
+        self.draws = 0
+        self.turns_sum = 0
+        self.turns_square_sum = 0
+
+    def add_game(self, winner, num_turns: int) -> None:
+        """
+        :param winner: 0 if the first agent won, 1 if the second agent won,
+            None for a draw.
+        :param num_turns: Length of the game.
+        """
+        self.games += 1
+        if winner is None:
+            self.draws += 1
+        else:
+            self.wins[winner] += 1
+        self.turns_sum += num_turns
+        self.turns_square_sum += num_turns * num_turns
+
+    def merge(self, other: 'MatchupStats') -> None:
+        """Add the games of other to these statistics."""
+        self.games += other.games
+        self.wins = [a + b for a, b in zip(self.wins, other.wins)]
+        self.draws += other.draws
+        self.turns_sum += other.turns_sum
+        self.turns_square_sum += other.turns_square_sum
+
+    def win_rate(self, z: float = 1.96):
+        """
+        :param z: Normal quantile of the confidence level; 1.96 for 95%.
+        :return: (rate, low, high): the first agent's win rate, counting
+            draws as half a win, and its Wilson score interval.
+        """
+        n = self.games
+        if n == 0:
+            return 0.5, 0.0, 1.0
+        rate = (self.wins[0] + 0.5 * self.draws) / n
+        center = (rate + z * z / (2 * n)) / (1 + z * z / n)
+        half_width = z * math.sqrt(
+            rate * (1 - rate) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+        return rate, center - half_width, center + half_width
+
+    def turns(self):
+        """
+        :return: (mean, standard deviation) of game lengths.
+        """
+        if self.games == 0:
+            return 0.0, 0.0
+        mean = self.turns_sum / self.games
+        variance = max(0.0, self.turns_square_sum / self.games - mean * mean)
+        return mean, math.sqrt(variance)
+
+
+def play_match(agents: List[Agent], dealer: CardDealer,
+               max_turns: int = MAX_TURNS, replays: ReplayWriter = None,
+               results: ResultStore = None, names: List[str] = None):
+    """
+    Play one match.
+    :param agents: Agents in seat order.
+    :param dealer: Card dealer for the match.
+    :param max_turns: The match is a draw after this many turns.
+    :param replays: Optional replay log to append the match to.
+    :param results: Optional results database to add the match to.
+    :param names: Names of the agents in the results database; their class
+        names by default.
+    :return: (winner, num_turns); winner is the winner's seat, or None for a
+        draw.
+    """
+    start = time.perf_counter()
+    seed = None
+    if replays is not None:
+        # Reseed with an integer, so the replay can recreate the dealer
+        seed = int(dealer.rng.integers(2 ** 63))
+        dealer.seed(seed)
+    match = Match(dealer)
+    if replays is not None:
+        match.recorder = GameRecorder(match, seed)
+    winner = None
+    while match.num_turns < max_turns:
+        match.do_move(agents[match.current].choose_move(match))
+        winner = match.winner()
+        if winner is not None:
+            break
+    if replays is not None:
+        replays.write_game(match.recorder, winner)
+    if results is not None:
+        if names is None:
+            names = [type(agent).__name__ for agent in agents]
+        results.add_match(match, names, time.perf_counter() - start)
+    return winner, match.num_turns
+
+
+def _init_worker(card_file: str, replay_file: str = None,
+                 results_file: str = None) -> None:
+    """Load the card table once per worker process."""
+    global _dealer, _replays, _results
+    _dealer = read_cards(card_file)
+    if replay_file:
+        _replays = ReplayWriter(replay_file, _dealer.registry)
+    if results_file:
+        _results = ResultStore(results_file)
+
+
+def _play_chunk(names: List[str], num_games: int,
+                seed: np.random.SeedSequence) -> MatchupStats:
+    """
+    Play a chunk of games between two agents, alternating who goes first.
+    :param names: Names of the two agents.
+    :param num_games: Number of games.
+    :param seed: Seed of this chunk's dealer and agents.
+    :return: Statistics of the chunk, from the first agent's perspective.
+    """
+    dealer_seed, agent_seed = seed.spawn(2)
+    _dealer.seed(dealer_seed)
+    agent_seeds = agent_seed.generate_state(2)
+    agents = [AGENTS[name](int(s)) for name, s in zip(names, agent_seeds)]
+
+    stats = MatchupStats()
+    try:
+        for i in range(num_games):
+            # The first agent has seat i % 2
+            seated = agents if i % 2 == 0 else agents[::-1]
+            seated_names = names if i % 2 == 0 else names[::-1]
+            winner, num_turns = play_match(seated, _dealer,
+                                           replays=_replays,
+                                           results=_results,
+                                           names=seated_names)
+            if winner is not None and i % 2 == 1:
+                winner = 1 - winner
+            stats.add_game(winner, num_turns)
+    finally:
+        for agent in agents:
+            agent.close()
+    if _results is not None:
+        # Nothing is left buffered when the pool shuts the worker down
+        _results.flush()
+    return stats
+
+
+def run_tournament(names: List[str], num_games: int, workers: int = None,
+                   seed=None, card_file: str = 'cards.txt',
+                   chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   replay_file: str = None, results_file: str = None):
+    """
+    Play every pair of agents against each other.
+    :param names: Names of the agents, from AGENTS.
+    :param num_games: Number of games per pair.
+    :param workers: Number of worker processes; defaults to the CPU count.
+    :param seed: Optional seed; the same seed gives the same results.
+    :param card_file: Card definition file.
+    :param chunk_size: Number of games each worker task plays.
+    :param replay_file: Optional replay log to append every game to.
+    :param results_file: Optional results database to add every game to.
+    :return: Dictionary from (name, name) pairs to MatchupStats.
+    """
+    if replay_file:
+        # Create the log before the workers open it, so only one of them
+        # writes its header
+        ReplayWriter(replay_file, read_cards(card_file).registry).close()
+    if results_file:
+        # Likewise create the tables once
+        ResultStore(results_file).close()
+
+    workers = workers or os.cpu_count()
+    pairs = list(itertools.combinations(names, 2))
+    results = {pair: MatchupStats() for pair in pairs}
+
+    # One seed per chunk, so results don't depend on scheduling
+    tasks = []
+    for pair, pair_seed in zip(pairs, np.random.SeedSequence(seed).spawn(
+            len(pairs))):
+        num_chunks = math.ceil(num_games / chunk_size)
+        for chunk, chunk_seed in enumerate(pair_seed.spawn(num_chunks)):
+            size = min(chunk_size, num_games - chunk * chunk_size)
+            tasks.append((pair, size, chunk_seed))
+    tasks = iter(tasks)
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(card_file, replay_file,
+                                       results_file)) as executor:
+        # Keep a few tasks per worker in flight, and merge results as they
+        # come in
+        pending = {}
+        for pair, size, chunk_seed in itertools.islice(tasks, 4 * workers):
+            future = executor.submit(_play_chunk, pair, size, chunk_seed)
+            pending[future] = pair
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)].merge(future.result())
+                for pair, size, chunk_seed in itertools.islice(tasks, 1):
+                    future = executor.submit(_play_chunk, pair, size,
+                                             chunk_seed)
+                    pending[future] = pair
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Play agents against each other.')
+    parser.add_argument('agents', nargs='+', choices=sorted(AGENTS),
+                        help='agents to play')
+    parser.add_argument('-n', '--games', type=int, default=1000,
+                        help='games per pair of agents')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='worker processes (default: CPU count)')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--cards', default='cards.txt',
+                        help='card definition file')
+    parser.add_argument('--replays', default=None, metavar='FILE',
+                        help='replay log to append every game to')
+    parser.add_argument('--results', default=None, metavar='FILE',
+                        help='results database to add every game to')
+    args = parser.parse_args()
+    if len(args.agents) < 2:
+        parser.error('need at least two agents')
+
+    results = run_tournament(args.agents, args.games, args.workers,
+                             args.seed, args.cards,
+                             replay_file=args.replays,
+                             results_file=args.results)
+    for (first, second), stats in results.items():
+        rate, low, high = stats.win_rate()
+        mean, stdev = stats.turns()
+        print('{} vs {}: {} wins, {} losses, {} draws'.format(
+            first, second, stats.wins[0], stats.wins[1], stats.draws))
+        print('    win rate {:.1%} (95% CI {:.1%}-{:.1%}); '
+              '{:.1f} turns (sd {:.1f})'.format(rate, low, high, mean, stdev))
+
+
+if __name__ == '__main__':
+    main()
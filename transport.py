@@ -0,0 +1,362 @@
+"""
+Connections between two peers, for myprotocol. Every connection has the
+socket methods myprotocol uses (sendall, recv_into and close), so
+send_message, recv_message and FramedConnection work on any of them.
+
+Addresses are strings:
+    <host>:<port>   TCP, with Nagle's algorithm off and keepalive on
+    unix:<path>     Unix domain socket
+    shm:<name>      Shared-memory ring buffers, for peers on one machine
+
+A shared-memory channel is one block holding a ring buffer for each
+direction. Each ring has a single writer and a single reader, which only
+advance their own byte counter, so no locks are needed. Waiting is done by
+polling: briefly spinning, then yielding, then sleeping for longer and
+longer. A channel takes a single connecting peer, who claims it by
+creating a claim file in the temporary directory; the creator removes the
+file when it closes the channel.
+"""
+
+import multiprocessing.shared_memory
+import multiprocessing.resource_tracker
+import os
+import socket
+import stat
+import tempfile
+import time
+
+# Prefixes of non-TCP addresses
+UNIX_PREFIX = 'unix:'
+SHM_PREFIX = 'shm:'
+
+# Seconds of idle time before TCP keepalive probes start, between probes,
+# and the number of unanswered probes before the connection is dropped
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 6
+
+# Bytes of each direction's ring buffer
+DEFAULT_RING_SIZE = 64 * 1024
+
+# Polls of a ring before yielding the CPU, polls before sleeping, and the
+# longest sleep in seconds. Spinning only helps if the peer can run at the
+# same time.
+if hasattr(os, 'sched_getaffinity'):
+    _SPIN_POLLS = 100 if len(os.sched_getaffinity(0)) > 1 else 0
+else:
+    _SPIN_POLLS = 100 if (os.cpu_count() or 1) > 1 else 0
+_YIELD_POLLS = 2000
+_MAX_SLEEP = 0.001
+
+# Layout of a shared-memory block, in 8-byte words. Counters are a cache
+# line (8 words) apart so the two sides don't write to the same line.
+#   word 0       state: _SHM_WAITING, _SHM_CONNECTED or _SHM_CLOSED
+#   word 8, 16   bytes written and read of the listener-to-connector ring
+#   word 24, 32  same for the connector-to-listener ring
+#   byte 320     data of the listener-to-connector ring, then the other
+_STATE = 0
+_RINGS = ((8, 16), (24, 32))
+_DATA_OFFSET = 320
+
+# Names of shared-memory blocks created by this process
+_created = set()
+
+_SHM_WAITING = 0
+_SHM_CONNECTED = 1
+_SHM_CLOSED = 2
+
+
+def tune_tcp(sock: socket.socket) -> None:
+    """
+    Send small messages immediately, and detect dead peers.
+    :param sock: TCP socket.
+    """
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # Keepalive timings aren't available on every platform
+    for option, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE),
+                          ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                          ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option),
+                            value)
+
+
+def is_address(text: str) -> bool:
+    """
+    :return: True if text is a Unix socket or shared-memory address.
+    """
+    return text.startswith(UNIX_PREFIX) or text.startswith(SHM_PREFIX)
+
+
+def connect(address: str):
+    """
+    Connect to a peer that is listening.
+    :param address: Address; see the module docstring.
+    :return: Connected socket or SharedMemoryChannel.
+    :raises: OSError if the connection fails.
+    """
+    if address.startswith(UNIX_PREFIX):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address[len(UNIX_PREFIX):])
+        return sock
+    if address.startswith(SHM_PREFIX):
+        return SharedMemoryChannel.connect(address[len(SHM_PREFIX):])
+    host, port = address.rsplit(':', 1)
+    sock = socket.create_connection((host, int(port)))
+    tune_tcp(sock)
+    return sock
+
+
+def accept_one(address: str):
+    """
+    Wait for one peer to connect.
+    :param address: Address; see the module docstring. The host of a TCP
+        address may be empty to listen on all interfaces.
+    :return: (connection, description of the peer): a connected socket or
+        SharedMemoryChannel.
+    :raises: OSError if listening fails.
+    """
+    if address.startswith(SHM_PREFIX):
+        channel = SharedMemoryChannel.create(address[len(SHM_PREFIX):])
+        channel.wait_connected()
+        return channel, 'shared memory {}'.format(channel.name)
+
+    path = None
+    if address.startswith(UNIX_PREFIX):
+        path = address[len(UNIX_PREFIX):]
+        _remove_socket_file(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        host, port = address.rsplit(':', 1)
+        server = socket.socket()
+    try:
+        server.bind((host, int(port)) if path is None else path)
+        server.listen()
+        sock, peer = server.accept()
+    finally:
+        server.close()
+        if path is not None:
+            _remove_socket_file(path)
+    if address.startswith(UNIX_PREFIX):
+        return sock, address
+    tune_tcp(sock)
+    return sock, '{}:{}'.format(*peer)
+
+
+def _remove_socket_file(path: str) -> None:
+    """
+    Remove a Unix socket file, e.g. one left by a listener that crashed, so
+    the path can be bound again. Other kinds of files are left alone.
+    """
+    try:
+        if stat.S_ISSOCK(os.lstat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _claim_filename(name: str) -> str:
+    """:return: Claim file of the shared-memory channel with a name."""
+    return os.path.join(tempfile.gettempdir(),
+                        'castlewars-shm-{}.claim'.format(name.lstrip('/')))
+
+
+def _remove_claim(name: str) -> None:
+    """Remove the claim file of a shared-memory channel, if any."""
+    try:
+        os.remove(_claim_filename(name))
+    except FileNotFoundError:
+        pass
+
+
+def _yield() -> None:
+    """Let other processes, and other threads of this one, run."""
+    if hasattr(os, 'sched_yield'):
+        os.sched_yield()
+    else:
+        time.sleep(0)
+
+
+class SharedMemoryChannel:
+    """
+    Byte stream between two processes on one machine through shared
+    memory. Create it with create() on one side and connect() on the other.
+    """
+
+    def __init__(self, shm: multiprocessing.shared_memory.SharedMemory,
+                 is_owner: bool):
+        """
+        :param shm: Shared-memory block, laid out as described above.
+        :param is_owner: True for the side that created the block; it sends
+            on the first ring and unlinks the block when closed.
+        """
+        self.shm = shm
+        self.name = shm.name
+        self.is_owner = is_owner
+        self.ring_size = (shm.size - _DATA_OFFSET) // 2
+        self._words = shm.buf[:_DATA_OFFSET].cast('Q')
+        self._data = shm.buf[_DATA_OFFSET:_DATA_OFFSET + 2 * self.ring_size]
+        send, recv = (0, 1) if is_owner else (1, 0)
+        self._send_written, self._send_read = _RINGS[send]
+        self._recv_written, self._recv_read = _RINGS[recv]
+        self._send_data = self._data[send * self.ring_size:
+                                     (send + 1) * self.ring_size]
+        self._recv_data = self._data[recv * self.ring_size:
+                                     (recv + 1) * self.ring_size]
+
+    @classmethod
+    def create(cls, name: str, ring_size: int = DEFAULT_RING_SIZE) \
+            -> 'SharedMemoryChannel':
+        """
+        Create a channel for a peer to connect to.
+        :param name: Name of the shared-memory block.
+        :param ring_size: Bytes of each direction's ring buffer.
+        :raises: FileExistsError if a block with that name exists.
+        """
+        shm = multiprocessing.shared_memory.SharedMemory(
+            name, create=True, size=_DATA_OFFSET + 2 * ring_size)
+        shm.buf[:_DATA_OFFSET] = bytes(_DATA_OFFSET)
+        _created.add(shm.name)
+        # The name was free, so a claim file is left from an old channel
+        _remove_claim(shm.name)
+        return cls(shm, True)
+
+    @classmethod
+    def connect(cls, name: str) -> 'SharedMemoryChannel':
+        """
+        Connect to a channel created by a peer.
+        :param name: Name of the shared-memory block.
+        :raises:
+            FileNotFoundError if there is no such block.
+            RuntimeError if another peer already connected to it.
+        """
+        # Only the creator may unlink the block, but before Python 3.13 the
+        # resource tracker also unlinks blocks it was attached to
+        try:
+            shm = multiprocessing.shared_memory.SharedMemory(name,
+                                                             track=False)
+        except TypeError:
+            shm = multiprocessing.shared_memory.SharedMemory(name)
+            # Unless the tracker is the creator's, e.g. in the same process
+            if shm.name not in _created:
+                multiprocessing.resource_tracker.unregister(shm._name,
+                                                            'shared_memory')
+        channel = cls(shm, False)
+        # Creating the claim file is atomic, so only one peer gets past it
+        try:
+            os.close(os.open(_claim_filename(shm.name),
+                             os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+        except FileExistsError:
+            channel._release()
+            raise RuntimeError('Shared-memory channel is in use')
+        if channel._words[_STATE] != _SHM_WAITING:
+            channel._release()
+            raise RuntimeError('Shared-memory channel is in use')
+        channel._words[_STATE] = _SHM_CONNECTED
+        return channel
+
+    def wait_connected(self) -> None:
+        """Wait until a peer connects."""
+        self._wait(lambda: self._words[_STATE] != _SHM_WAITING)
+
+    def sendall(self, data) -> None:
+        """
+        Send bytes, waiting for room in the ring as needed.
+        :param data: Bytes-like object.
+        :raises: RuntimeError if the peer closed the channel.
+        """
+        words = self._words
+        size = self.ring_size
+        view = memoryview(data).cast('B')
+        sent = 0
+        while sent < len(view):
+            written = words[self._send_written]
+            free = size - (written - words[self._send_read])
+            if free == 0:
+                self._wait(lambda: words[self._send_written] -
+                           words[self._send_read] < size)
+                continue
+            amount = min(free, len(view) - sent)
+            self._copy_in(written % size, view[sent:sent + amount])
+            # Publish the data only once it is in the ring
+            words[self._send_written] = written + amount
+            sent += amount
+
+    def recv_into(self, buffer) -> int:
+        """
+        Receive bytes, waiting until at least one is available.
+        :param buffer: Writable bytes-like object to receive into.
+        :return: Number of bytes received; 0 if the peer closed the channel
+            and everything it sent has been received.
+        """
+        words = self._words
+        size = self.ring_size
+        if words[self._recv_written] == words[self._recv_read]:
+            self._wait(lambda: words[self._recv_written] !=
+                       words[self._recv_read], allow_closed=True)
+        read = words[self._recv_read]
+        available = words[self._recv_written] - read
+        amount = min(available, len(buffer))
+        if amount == 0:
+            return 0
+        start = read % size
+        first = min(amount, size - start)
+        buffer[:first] = self._recv_data[start:start + first]
+        buffer[first:amount] = self._recv_data[:amount - first]
+        words[self._recv_read] = read + amount
+        return amount
+
+    def close(self) -> None:
+        """Close the channel; the peer receives what was already sent."""
+        if self.shm is None:
+            return
+        self._words[_STATE] = _SHM_CLOSED
+        self._release()
+
+    def __del__(self):
+        self.close()
+
+    def _copy_in(self, start: int, data: memoryview) -> None:
+        """Copy data into the send ring at an offset, wrapping around."""
+        first = min(len(data), self.ring_size - start)
+        self._send_data[start:start + first] = data[:first]
+        self._send_data[:len(data) - first] = data[first:]
+
+    def _wait(self, is_ready, allow_closed: bool = False) -> None:
+        """
+        Poll until is_ready() is true: spin first, then yield, then sleep
+        for longer and longer.
+        :param is_ready: Function to poll.
+        :param allow_closed: True to also stop if the peer closed the
+            channel.
+        :raises: RuntimeError if the peer closed the channel, unless
+            allow_closed.
+        """
+        words = self._words
+        polls = 0
+        delay = 0
+        while not is_ready():
+            if words[_STATE] == _SHM_CLOSED:
+                if allow_closed:
+                    return
+                raise RuntimeError('Shared-memory channel closed')
+            polls += 1
+            if polls > _YIELD_POLLS:
+                time.sleep(delay)
+                delay = min(max(delay * 2, 1e-6), _MAX_SLEEP)
+            elif polls > _SPIN_POLLS:
+                _yield()
+
+    def _release(self) -> None:
+        """Detach from the block, unlinking it if this side created it."""
+        self._recv_data.release()
+        self._send_data.release()
+        self._data.release()
+        self._words.release()
+        self.shm.close()
+        if self.is_owner:
+            self.shm.unlink()
+            _created.discard(self.name)
+            _remove_claim(self.name)
+        self.shm = None
@@ -0,0 +1,379 @@
+"""
+Card weight tuner. Proposes changes to the weights of a card file, one card
+at a time, keeps those that make the game more balanced, and writes the
+tuned card file.
+
+Balance is measured with batches of BatchGame games in which both players
+use the same policy. The loss is the distance of the first player's win
+rate from 1/2 and, with --turns, the relative distance of the mean game
+length from a target.
+
+A candidate is compared with the current weights in rounds. Each round
+plays one batch with each, using common random numbers: game i of both
+batches deals its cards from the same stream of uniform draws, by inverse
+CDF so that a small weight change only changes a few cards, and the
+policies have the same seed. A Wald sequential probability ratio test on
+the loss differences of the rounds stops the comparison as soon as it is
+clear either way, rather than after a fixed number of games. A candidate
+the test accepts is only kept if its loss over all its batches is also
+lower than the current weights' over the same rounds.
+
+    python tuner.py [-i ITERATIONS] [-b BATCH] [--turns TURNS]
+        [--policy POLICY] [--seed SEED] [--cards FILE] [-o FILE]
+"""
+
+import argparse
+import math
+import statistics
+from batch_game import *
+
+# Games per batch, so each round plays twice as many
+DEFAULT_BATCH_SIZE = 256
+
+# Loss improvement that matters, e.g. a percentage point of win rate; see
+# SequentialTest
+DEFAULT_MIN_EFFECT = 0.01
+
+# Probabilities of keeping a candidate that isn't better by min_effect, and
+# of rejecting one that is
+DEFAULT_ALPHA = 0.05
+DEFAULT_BETA = 0.1
+
+# Rounds before the test may stop, for a usable variance estimate, and
+# rounds after which a candidate is rejected if the test hasn't stopped
+MIN_ROUNDS = 3
+MAX_ROUNDS = 200
+
+# Games that last this many turns are draws
+MAX_BATCH_TURNS = 1000
+
+# Uniform draws per game generated at a time by _PairedBatchGame
+_STREAM_BLOCK = 64
+
+POLICIES = {
+    'greedy': BatchGame.greedy_moves,
+    'random': BatchGame.random_moves,
+}
+
+
+class _PairedBatchGame(BatchGame):
+    """
+    BatchGame in which every game deals from its own stream of uniform
+    draws, by inverse CDF of the card weights. Batches with the same seed
+    but different weights deal the same cards wherever the weights allow.
+    """
+
+    def __init__(self, dealer: CardDealer, num_games: int, seed: int):
+        game_seed, stream_seed = np.random.SeedSequence(seed).spawn(2)
+        super().__init__(dealer, num_games, game_seed)
+        self._cdf = np.cumsum(self.dealer.registry.weights) / \
+            self.dealer.total_weight
+        self._stream_rng = np.random.default_rng(stream_seed)
+        # _uniforms[i, k] is the draw of game i's k-th card
+        self._uniforms = np.empty((num_games, 0))
+        self._dealt = np.zeros(num_games, dtype=np.intp)
+        rows = np.repeat(np.arange(num_games), HAND_SIZE)
+        self.hands = np.stack([
+            self._deal(rows).reshape(num_games, HAND_SIZE) for p in range(2)])
+
+    def _deal(self, rows: np.ndarray) -> np.ndarray:
+        # Number each row's cards on from the cards it was already dealt
+        order = np.argsort(rows, kind='stable')
+        counts = np.bincount(rows, minlength=self.num_games)
+        starts = np.cumsum(counts) - counts
+        sorted_rows = rows[order]
+        index = np.empty(len(rows), dtype=np.intp)
+        index[order] = self._dealt[sorted_rows] + \
+            np.arange(len(rows)) - starts[sorted_rows]
+        self._dealt += counts
+        # Blocks are drawn in the same order whatever the weights, so they
+        # hold the same draws
+        while len(rows) and self._dealt.max() > self._uniforms.shape[1]:
+            block = self._stream_rng.random((self.num_games, _STREAM_BLOCK))
+            self._uniforms = np.hstack([self._uniforms, block])
+        cards = np.searchsorted(self._cdf, self._uniforms[rows, index],
+                                side='right')
+        # Guard against the last CDF value rounding below 1
+        return np.minimum(cards, len(self.cards) - 1)
+
+
+def batch_balance(winner: np.ndarray, turns: np.ndarray):
+    """
+    :param winner: Winner of each game, as from BatchGame.run; -1 for a
+        draw.
+    :param turns: Length of each game.
+    :return: (first player's win rate, counting draws as half a win, mean
+        game length).
+    """
+    score = (winner == 0) + 0.5 * (winner < 0)
+    return float(score.mean()), float(turns.mean())
+
+
+def balance_loss(win_rate: float, turns: float,
+                 target_turns: float = None) -> float:
+    """
+    :param win_rate: First player's win rate.
+    :param turns: Mean game length.
+    :param target_turns: Optional target mean game length.
+    :return: Loss; see the module docstring.
+    """
+    loss = abs(win_rate - 0.5)
+    if target_turns:
+        loss += abs(turns / target_turns - 1)
+    return loss
+
+
+class SequentialTest:
+    """
+    Wald sequential probability ratio test of whether a candidate's loss is
+    lower, from the loss differences (candidate minus current) of rounds.
+    The differences are taken to be normal with the variance of the rounds
+    so far; the hypotheses are a mean of 0 and a mean of -min_effect.
+    """
+
+    def __init__(self, min_effect: float = DEFAULT_MIN_EFFECT,
+                 alpha: float = DEFAULT_ALPHA, beta: float = DEFAULT_BETA,
+                 min_rounds: int = MIN_ROUNDS, max_rounds: int = MAX_ROUNDS):
+        """
+        :param min_effect: Loss improvement that matters.
+        :param alpha: Probability of accepting a candidate that is no
+            better.
+        :param beta: Probability of rejecting a candidate that is better by
+            min_effect.
+        :param min_rounds: Rounds before the test may stop.
+        :param max_rounds: Rounds after which the candidate is rejected.
+        """
+        self.min_effect = min_effect
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.upper = math.log((1 - beta) / alpha)
+        self.lower = math.log(beta / (1 - alpha))
+        self.differences = []
+
+    def add(self, difference: float) -> None:
+        """:param difference: Loss difference of a round."""
+        self.differences.append(difference)
+
+    def log_likelihood_ratio(self) -> float:
+        """
+        :return: Log-likelihood ratio of the candidate being better by
+            min_effect over it being no better.
+        """
+        variance = statistics.variance(self.differences)
+        if variance == 0:
+            return 0.0
+        delta = self.min_effect
+        return -delta * (sum(self.differences) +
+                         len(self.differences) * delta / 2) / variance
+
+    def decision(self):
+        """
+        :return: True if the candidate is better, False if it isn't, None
+            if more rounds are needed.
+        """
+        rounds = len(self.differences)
+        if rounds < max(self.min_rounds, 2):
+            return None
+        ratio = self.log_likelihood_ratio()
+        if ratio >= self.upper:
+            return True
+        if ratio <= self.lower or rounds >= self.max_rounds:
+            return False
+        return None
+
+
+def _pool(balances: List[Tuple[float, float]]):
+    """
+    :param balances: (win rate, mean game length) of batches of the same
+        size.
+    :return: (win rate, mean game length) of all their games.
+    """
+    win_rates, turns = zip(*balances)
+    return statistics.fmean(win_rates), statistics.fmean(turns)
+
+
+class Tuner:
+    """Local search over card weights."""
+
+    def __init__(self, dealer: CardDealer,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 policy: Callable = BatchGame.greedy_moves,
+                 target_turns: float = None,
+                 min_effect: float = DEFAULT_MIN_EFFECT, seed=None):
+        """
+        :param dealer: Card dealer with the starting weights.
+        :param batch_size: Games per batch.
+        :param policy: Policy of both players; see BatchGame.run.
+        :param target_turns: Optional target mean game length.
+        :param min_effect: Loss improvement that matters; see
+            SequentialTest.
+        :param seed: Optional seed; the same seed gives the same results.
+        """
+        self.cards = dealer.cards
+        self.weights = list(dealer.registry.weights)
+        self.batch_size = batch_size
+        self.policy = policy
+        self.target_turns = target_turns
+        self.min_effect = min_effect
+        self.rng = np.random.default_rng(seed)
+        # Games played and rounds of all comparisons so far
+        self.games = 0
+        self.rounds = 0
+        # Loss differences of every round, for estimating their variance
+        self.differences = []
+        # (win rate, mean game length) of each batch of the current weights
+        self.balances = []
+
+    def play_batch(self, weights: List[int], seed: int):
+        """
+        :param weights: Weight of each card.
+        :param seed: Seed of the batch; batches with the same seed share
+            their random numbers.
+        :return: (first player's win rate, mean game length) of the batch.
+        """
+        dealer = CardDealer(dict(zip(self.cards, weights)))
+        game = _PairedBatchGame(dealer, self.batch_size, seed)
+        winner = game.run(self.policy, MAX_BATCH_TURNS)
+        self.games += self.batch_size
+        return batch_balance(winner, game.turns)
+
+    def balance(self):
+        """
+        :return: (first player's win rate, mean game length) of the current
+            weights, over every batch played with them so far.
+        """
+        if not self.balances:
+            for i in range(MIN_ROUNDS):
+                self.balances.append(self.play_batch(self.weights,
+                                                     self._batch_seed()))
+        return _pool(self.balances)
+
+    def _batch_seed(self) -> int:
+        return int(self.rng.integers(2 ** 63))
+
+    def loss(self) -> float:
+        """:return: Loss of the current weights; see balance()."""
+        return balance_loss(*self.balance(), self.target_turns)
+
+    def propose(self):
+        """
+        :return: (card ID, candidate weights): the current weights with that
+            card's weight one higher or lower. Weights stay at least 1.
+        """
+        weights = list(self.weights)
+        card_id = int(self.rng.integers(len(weights)))
+        if weights[card_id] == 1 or self.rng.random() < 0.5:
+            weights[card_id] += 1
+        else:
+            weights[card_id] -= 1
+        return card_id, weights
+
+    def compare(self, candidate: List[int]):
+        """
+        Play paired rounds until the sequential test stops. The batches of
+        the current weights count towards balance().
+        :param candidate: Candidate weights.
+        :return: (better, test, balances): True if the candidate is better,
+            the SequentialTest, and the candidate's batch balances.
+        """
+        test = SequentialTest(self.min_effect)
+        balances = []
+        currents = []
+        decision = None
+        while decision is None:
+            seed = self._batch_seed()
+            current = self.play_batch(self.weights, seed)
+            proposed = self.play_batch(candidate, seed)
+            currents.append(current)
+            balances.append(proposed)
+            test.add(balance_loss(*proposed, self.target_turns) -
+                     balance_loss(*current, self.target_turns))
+            decision = test.decision()
+        self.balances.extend(currents)
+        self.rounds += len(test.differences)
+        self.differences.extend(test.differences)
+        if decision:
+            # The mean of per-batch losses overstates the loss near the
+            # target, so check the pooled balances too
+            decision = balance_loss(*_pool(balances), self.target_turns) < \
+                balance_loss(*_pool(currents), self.target_turns)
+        return decision, test, balances
+
+    def step(self):
+        """
+        Compare a candidate with the current weights, and keep it if it is
+        better.
+        :return: (card ID, old weight, new weight, better, test).
+        """
+        card_id, candidate = self.propose()
+        old = self.weights[card_id]
+        better, test, balances = self.compare(candidate)
+        if better:
+            self.weights = candidate
+            self.balances = balances
+        return card_id, old, candidate[card_id], better, test
+
+    def fixed_rounds(self, alpha: float = DEFAULT_ALPHA,
+                     beta: float = DEFAULT_BETA) -> float:
+        """
+        :return: Rounds per comparison a fixed-size test with the same error
+            probabilities would need, from the variance of the rounds so
+            far.
+        """
+        if len(self.differences) < 2:
+            return math.nan
+        normal = statistics.NormalDist()
+        z = normal.inv_cdf(1 - alpha) + normal.inv_cdf(1 - beta)
+        return z * z * statistics.variance(self.differences) / \
+            self.min_effect ** 2
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Tune card weights for balance.')
+    parser.add_argument('-i', '--iterations', type=int, default=50,
+                        help='candidates to try')
+    parser.add_argument('-b', '--batch', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='games per batch')
+    parser.add_argument('--turns', type=float, default=None,
+                        help='target mean game length')
+    parser.add_argument('--policy', default='greedy',
+                        choices=sorted(POLICIES))
+    parser.add_argument('--min-effect', type=float,
+                        default=DEFAULT_MIN_EFFECT,
+                        help='loss improvement that matters')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--cards', default='cards.txt',
+                        help='card definition file')
+    parser.add_argument('-o', '--output', default='cards.tuned.txt',
+                        help='tuned card definition file')
+    args = parser.parse_args()
+
+    with open(args.cards) as f:
+        text = f.read()
+    dealer = read_cards(args.cards)
+    tuner = Tuner(dealer, args.batch, POLICIES[args.policy], args.turns,
+                  args.min_effect, args.seed)
+    win_rate, turns = tuner.balance()
+    print('start: first player win rate {:.1%}, {:.1f} turns, loss {:.4f}'
+          .format(win_rate, turns, tuner.loss()))
+    for i in range(args.iterations):
+        card_id, old, new, better, test = tuner.step()
+        win_rate, turns = tuner.balance()
+        print('{:3} {:<16} {} -> {}: {} after {:3} rounds; {:.1%}, {:.1f} '
+              'turns'.format(i + 1, tuner.cards[card_id].name, old, new,
+                             'kept' if better else 'rejected',
+                             len(test.differences), win_rate, turns))
+
+    print('tuned: loss {:.4f}'.format(tuner.loss()))
+    print('{} games in {} rounds; fixed-size comparisons with the same '
+          'error rates would take {:.0f} rounds'.format(
+              tuner.games, tuner.rounds,
+              args.iterations * tuner.fixed_rounds()))
+    with open(args.output, 'w') as f:
+        f.write(replace_weights(text, tuner.weights))
+    print('Wrote {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
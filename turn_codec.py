@@ -0,0 +1,157 @@
+"""
+Compact binary encoding of player turns.
+
+A connection starts with a handshake message from each peer:
+    magic (2 bytes) | wire version (1 byte) | card set digest (32 bytes)
+After that, each turn message is a turn type byte followed by card IDs
+from the shared CardRegistry:
+    TURN_CARD:    type (1 byte) | card ID (2 bytes)
+    TURN_DISCARD: type (1 byte) | count (1 byte) | card IDs (2 bytes each)
+Between peers, each turn message is followed by the state hash after the
+turn (8 bytes; see game.state_hash). A peer whose own hash differs asks
+for the state with a resync message, and the other peer answers with a
+state message, before the next turn:
+    TURN_RESYNC:  type (1 byte)
+    TURN_STATE:   type (1 byte) | stocks of the first player, then the
+                  second, in resource_order (4 bytes each)
+All integers are big-endian.
+"""
+
+import struct
+from myprotocol import ProtocolError
+from card_registry import *
+from game import *
+from player_turn import *
+
+# Version of the wire format; bump when the encoding changes
+WIRE_VERSION = 4
+
+HANDSHAKE_MAGIC = b'CW'
+
+# Turn types
+TURN_CARD = 1
+TURN_DISCARD = 2
+TURN_RESYNC = 3
+TURN_STATE = 4
+
+_HANDSHAKE = struct.Struct('>2sB32s')
+_CARD_TURN = struct.Struct('>BH')
+_DISCARD_HEADER = struct.Struct('>BB')
+_STATE_HASH = struct.Struct('>Q')
+_FULL_STATE = struct.Struct('>B{}i'.format(2 * len(resource_order)))
+
+
+def encode_handshake(registry: CardRegistry) -> bytes:
+    """
+    :param registry: Card registry of this peer.
+    :return: Handshake message.
+    """
+    return _HANDSHAKE.pack(HANDSHAKE_MAGIC, WIRE_VERSION, registry.digest)
+
+
+def check_handshake(data: bytes, registry: CardRegistry) -> None:
+    """
+    Check a peer's handshake message.
+    :param data: Handshake message from the peer.
+    :param registry: Card registry of this peer.
+    :raises: ProtocolError if the peer speaks another protocol or version,
+        or loaded a different card set.
+    """
+    if len(data) != _HANDSHAKE.size:
+        raise ProtocolError('Bad handshake')
+    magic, version, digest = _HANDSHAKE.unpack(data)
+    if magic != HANDSHAKE_MAGIC:
+        raise ProtocolError('Bad handshake')
+    if version != WIRE_VERSION:
+        raise ProtocolError('Peer uses wire version {}, we use {}'.format(
+            version, WIRE_VERSION))
+    if digest != registry.digest:
+        raise ProtocolError('Peer loaded a different card set')
+
+
+def encode_turn(turn: PlayerTurn) -> bytes:
+    """
+    :param turn: Player turn. Its cards must have IDs from a CardRegistry.
+    :return: Turn message.
+    """
+    if isinstance(turn, CardTurn):
+        return _CARD_TURN.pack(TURN_CARD, turn.card.id)
+    elif isinstance(turn, DiscardTurn):
+        return _DISCARD_HEADER.pack(TURN_DISCARD, len(turn.cards)) + \
+            struct.pack('>{}H'.format(len(turn.cards)),
+                        *[card.id for card in turn.cards])
+    raise TypeError('Can\'t encode {}'.format(type(turn).__name__))
+
+
+def decode_turn(data: bytes, registry: CardRegistry) -> PlayerTurn:
+    """
+    :param data: Turn message.
+    :param registry: Card registry to resolve card IDs with.
+    :return: Player turn.
+    :raises: ProtocolError if the message is malformed.
+    """
+    try:
+        if data[0] == TURN_CARD:
+            turn_type, card_id = _CARD_TURN.unpack(data)
+            return CardTurn(registry[card_id])
+        elif data[0] == TURN_DISCARD:
+            turn_type, count = _DISCARD_HEADER.unpack_from(data)
+            card_ids = struct.unpack_from('>{}H'.format(count), data,
+                                          _DISCARD_HEADER.size)
+            if len(data) != _DISCARD_HEADER.size + 2 * count:
+                raise ProtocolError('Bad discard turn')
+            return DiscardTurn([registry[card_id] for card_id in card_ids])
+    except (IndexError, struct.error) as e:
+        raise ProtocolError('Bad turn message: {}'.format(e))
+    raise ProtocolError('Unknown turn type {}'.format(data[0]))
+
+
+def encode_checked_turn(turn: PlayerTurn, state_hash: int) -> bytes:
+    """
+    :param turn: Player turn, as for encode_turn.
+    :param state_hash: State hash after the turn.
+    :return: Turn message for a peer.
+    """
+    return encode_turn(turn) + _STATE_HASH.pack(state_hash)
+
+
+def decode_checked_turn(data: bytes, registry: CardRegistry):
+    """
+    :param data: Turn message from a peer.
+    :param registry: Card registry to resolve card IDs with.
+    :return: (player turn, the peer's state hash after it).
+    :raises: ProtocolError if the message is malformed.
+    """
+    if len(data) < _STATE_HASH.size:
+        raise ProtocolError('Bad turn message')
+    split = len(data) - _STATE_HASH.size
+    return decode_turn(data[:split], registry), \
+        _STATE_HASH.unpack_from(data, split)[0]
+
+
+def encode_resync() -> bytes:
+    """:return: Resync message, asking the peer for the state."""
+    return bytes([TURN_RESYNC])
+
+
+def encode_full_state(player1: Player, player2: Player) -> bytes:
+    """
+    :param player1: Player who moved first.
+    :param player2: The other player.
+    :return: State message.
+    """
+    return _FULL_STATE.pack(TURN_STATE, *player1.stocks, *player2.stocks)
+
+
+def decode_full_state(data: bytes) -> List[Player]:
+    """
+    :param data: State message.
+    :return: [player who moved first, other player].
+    :raises: ProtocolError if the message is malformed.
+    """
+    if len(data) != _FULL_STATE.size or data[0] != TURN_STATE:
+        raise ProtocolError('Bad state message')
+    stocks = _FULL_STATE.unpack(data)[1:]
+    num_resources = len(resource_order)
+    return [Player.from_stocks(stocks[:num_resources]),
+            Player.from_stocks(stocks[num_resources:])]